@@ -1,18 +1,38 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
-from src.email_service import fetch_emails, send_email_reply, get_email_details
-from src.ai_processing import generate_reply, analyze_email
-from src.slack_notifier import send_slack_notification
+from flask import Flask, Response, render_template, request, jsonify, send_file, send_from_directory
+from src.email_service import fetch_emails, get_email_details, get_gmail_client_stats
+from src.ai_processing import generate_reply, stream_reply, analyze_email, analyze_emails_batch, BATCH_MAX_ITEMS, MODEL
+from src.slack_notifier import queue_slack_notification, get_slack_stats
 from src.storage import (
-    store_email, get_email_thread, init_db, log_action,
+    store_emails_bulk, get_email_thread, get_thread_for_message, init_db, log_action,
     is_email_deleted, mark_email_deleted,
-    is_auto_reply_enabled, set_auto_reply_mode
+    is_auto_reply_enabled, set_auto_reply_mode, delete_emails,
+    get_connection, DB_FILE, list_emails,
+    store_analysis, get_analysis, get_unanalyzed_emails, mark_notified, FALLBACK_MODEL, analysis_retry_due,
+    search_emails, rebuild_search_index, optimize_search_index, InvalidCursor
 )
+from src.sync_service import sync_inbox
+from src.llm_cache import get_llm_cache_stats
+from src.message_cache import get_message_cache_stats
+from src.attachment_service import list_message_attachments, open_attachment
+from src.attachment_store import get_attachment_store_stats
+from src.staged_scheduler import Stage, Poller, start_scheduler, get_scheduler_stats, FETCH_MAX_INTERVAL
+from src.push_service import (
+    push_enabled, verify_push_token, handle_notification, ensure_watch, get_push_stats,
+    WATCH_CHECK_INTERVAL, PUSH_FALLBACK_INTERVAL
+)
+from src.context_builder import build_thread_context, clean_body, format_reply_examples
+from src.outbox import (
+    enqueue, get_outbox_entry, list_outbox, get_outbox_stats, start_sender, AUTO_REPLY_DEDUP_WINDOW
+)
+from src.reply_index import add_reply, find_similar_replies, get_reply_index_stats, SIMILAR_REPLIES
+from src.preclassifier import preclassify, get_preclassifier_stats, PRECLASSIFIER_MODEL
 
-from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import os
+import queue
 import logging
-import sqlite3
+import threading
 import time
 import json
 from functools import wraps
@@ -24,14 +44,23 @@ class MemoryCache:
     def get(self, url): return MemoryCache._CACHE.get(url)
     def set(self, url, content): MemoryCache._CACHE[url] = content
 
+import click
 import googleapiclient.discovery
 googleapiclient.discovery.cache = MemoryCache()
 
 app = Flask(__name__, static_folder='static')
 
-notified_emails = set()
 last_email_fetch = 0
 EMAIL_FETCH_COOLDOWN = 60
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", 4))  # Threads in the analyze stage
+ANALYSIS_BATCH_THRESHOLD = int(os.getenv("ANALYSIS_BATCH_THRESHOLD", 5))  # Above this many waiting, the analyze stage uses batch prompts
+# Attachment types safe to render on the dashboard's origin (no HTML, no SVG)
+INLINE_ATTACHMENT_TYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'application/pdf'}
+REPLY_WORKERS = int(os.getenv("REPLY_WORKERS", 8))  # Threads for LLM work started by reply requests
+
+# Streamed replies run the completion and the analysis here so the response
+# generator only has to forward their results
+reply_executor = ThreadPoolExecutor(max_workers=REPLY_WORKERS, thread_name_prefix='reply')
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -55,41 +84,149 @@ def rate_limit(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def get_emails_from_db(limit=100):
+def get_emails_from_db(limit=100, cursor=None):
+    """Return (emails, next_cursor) for the dashboard, newest first"""
     try:
-        with sqlite3.connect("ai_email_assistant.db") as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT message_id, sender, recipient, subject, timestamp, body, thread_id 
-                FROM emails 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            ''', (limit,))
-            rows = cursor.fetchall()
-
-        emails = []
-        for row in rows:
-            message_id = row['message_id']
-            if is_email_deleted(message_id):
-                continue
-            emails.append({
-                'id': message_id,
-                'from': row['sender'],
-                'to': row['recipient'],
-                'subject': row['subject'],
-                'date': row['timestamp'],
-                'snippet': row['body'],
-                'threadId': row['thread_id']
-            })
-        return emails
+        rows, next_cursor = list_emails(limit, cursor)
+        emails = [{
+            'id': row['message_id'],
+            'from': row['sender'],
+            'to': row['recipient'],
+            'subject': row['subject'],
+            'date': row['timestamp'],
+            'snippet': row['body'],
+            'threadId': row['thread_id']
+        } for row in rows]
+        return emails, next_cursor
+    except InvalidCursor:
+        raise
     except Exception as e:
         logger.error(f"Failed to fetch emails from DB: {str(e)}")
-        return []
+        return [], None
+
+def email_to_row(email):
+    """Map a fetched Gmail email dict to the storage column names"""
+    return {
+        'message_id': email['id'],
+        'sender': email['from'],
+        'recipient': 'me',
+        'subject': email.get('subject', 'No Subject'),
+        'timestamp': email.get('date', datetime.now().isoformat()),
+        'body': email.get('snippet', ''),
+        'thread_id': email['threadId']
+    }
+
+def preclassify_new_emails(emails, new_ids):
+    """Store rule-based analysis for clear-cut new emails so they never reach the LLM"""
+    new_ids = set(new_ids)
+    for email in emails:
+        if email['id'] not in new_ids:
+            continue
+        analysis = preclassify(email['from'], email.get('subject'), email.get('snippet'),
+                               email.get('headers'), email.get('labelIds'))
+        if analysis:
+            store_analysis(email['id'], analysis, PRECLASSIFIER_MODEL)
 
 def json_error_response(message, code=400):
     return jsonify({'success': False, 'error': message}), code
 
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def get_or_analyze(email_id, body):
+    """Stored analysis for an email, computing and storing it on first use (or over a fallback guess due a retry)"""
+    analysis = get_analysis(email_id)
+    if analysis is None or analysis_retry_due(analysis):
+        analysis = analyze_email(body)
+        store_analysis(email_id, analysis, analysis.get('model', MODEL))
+    return analysis
+
+def timed(timings, stage, func, *args, **kwargs):
+    """Call func(*args, **kwargs), recording its duration in ms under timings[stage]"""
+    start = time.monotonic()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        timings[stage] = round((time.monotonic() - start) * 1000)
+
+def notify_if_important(email_id, sender, subject, analysis):
+    """Alert Slack once for a high-priority email opened from the dashboard"""
+    try:
+        # A fallback priority is only a keyword guess; the retried analysis decides
+        if analysis.get('model') == FALLBACK_MODEL:
+            return
+        if analysis.get('priority', 0) > 7 and not analysis.get('notified_at'):
+            slack_msg = f"Important email from {sender}: {subject}"
+            queue_slack_notification(slack_msg)
+            log_action(email_id, 'slack_notification', slack_msg)
+            mark_notified(email_id)
+    except Exception as e:
+        logger.error(f"Slack notification failed for {email_id}: {str(e)}")
+
+def start_reply_work(email_id, timings):
+    """
+    Read the email from Gmail and its thread from the DB in parallel, then start
+    the analysis in the background (it only needs the body)
+    Returns: (email_details, thread_emails, analysis_future), or None if Gmail has no such email
+    """
+    details_future = reply_executor.submit(timed, timings, 'gmail_fetch', get_email_details, email_id)
+    thread_future = reply_executor.submit(timed, timings, 'thread_lookup', get_thread_for_message, email_id)
+
+    email_details = details_future.result()
+    if not email_details:
+        return None
+    analysis_future = reply_executor.submit(timed, timings, 'analysis', get_or_analyze,
+                                            email_id, email_details['body'])
+
+    thread_emails = thread_future.result()
+    if not thread_emails:
+        # Not stored locally yet; fall back to Gmail's thread id
+        thread_emails = get_email_thread(email_details['threadId'])
+    return email_details, thread_emails, analysis_future
+
+def similar_reply_text(subject, body):
+    """Text an email is indexed and looked up by in the reply index"""
+    return f"{subject}\n{clean_body(body)}"
+
+def reply_examples(email_id, email_details, timings):
+    """
+    Replies we sent to emails like this one, formatted for the reply prompt
+    Returns: (prompt text, number of replies used)
+    """
+    similar = timed(timings, 'similar_replies', find_similar_replies,
+                    similar_reply_text(email_details['subject'], email_details['body']), SIMILAR_REPLIES, email_id)
+    return format_reply_examples(similar), len(similar)
+
+def index_sent_reply(entry):
+    """Outbox callback: add a sent reply to the reply index under the email it answers"""
+    if entry['kind'] != 'reply':
+        return
+    email_id = entry['email_id']
+    try:
+        email_details = get_email_details(email_id)
+        if email_details:
+            add_reply(email_id, similar_reply_text(email_details['subject'], email_details['body']),
+                      email_details['subject'], entry['body'])
+    except Exception as e:
+        logger.error(f"Error indexing reply to {email_id}: {str(e)}")
+
+def outbox_entry_status(entry):
+    """Public view of an outbox entry (without the message body)"""
+    return {
+        'id': entry['id'],
+        'email_id': entry['email_id'],
+        'kind': entry['kind'],
+        'to': entry['to_addr'],
+        'subject': entry['subject'],
+        'status': entry['status'],
+        'attempts': entry['attempts'],
+        'last_error': entry['last_error'],
+        'created_at': entry['created_at'],
+        'next_attempt_at': entry['next_attempt_at'] if entry['status'] == 'queued' else None,
+        'sent_at': entry['sent_at']
+    }
+
 # ---------------------------- Routes ----------------------------
 
 @app.route('/')
@@ -102,11 +239,21 @@ def serve_static(path):
 
 @app.route('/api/health')
 def health_check():
-    db_exists = os.path.exists("ai_email_assistant.db")
+    db_exists = os.path.exists(DB_FILE)
     return jsonify({
         'status': 'healthy',
         'database': db_exists,
         'gmail_connected': bool(os.getenv("GMAIL_CLIENT_ID")),
+        'gmail_client': get_gmail_client_stats(),
+        'llm_cache': get_llm_cache_stats(),
+        'message_cache': get_message_cache_stats(),
+        'attachments': get_attachment_store_stats(),
+        'preclassifier': get_preclassifier_stats(),
+        'reply_index': get_reply_index_stats(),
+        'outbox': get_outbox_stats(),
+        'slack': get_slack_stats(),
+        'scheduler': get_scheduler_stats(),
+        'push': get_push_stats(),
         'timestamp': datetime.now().isoformat()
     })
 
@@ -120,27 +267,55 @@ def get_emails():
         if not gmail_emails:
             return jsonify({'success': False, 'error': 'No emails found'}), 404
 
-        for email in gmail_emails:
-            try:
-                store_email(
-                    message_id=email['id'],
-                    sender=email['from'],
-                    recipient='me',
-                    subject=email.get('subject', 'No Subject'),
-                    timestamp=email.get('date', datetime.now().isoformat()),
-                    body=email.get('snippet', ''),
-                    thread_id=email['threadId']
-                )
-            except Exception as e:
-                logger.error(f"Error storing email {email.get('id')}: {str(e)}")
-
-        db_emails = get_emails_from_db()
-        return jsonify({'success': True, 'count': len(db_emails), 'emails': db_emails})
+        try:
+            new_ids = store_emails_bulk(email_to_row(email) for email in gmail_emails)
+            preclassify_new_emails(gmail_emails, new_ids)
+        except Exception as e:
+            logger.error(f"Error storing emails: {str(e)}")
+
+        db_emails, next_cursor = get_emails_from_db()
+        return jsonify({'success': True, 'count': len(db_emails), 'emails': db_emails, 'next_cursor': next_cursor})
 
     except Exception as e:
         logger.error(f"Error in get_emails: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/emails/page', methods=['GET'])
+def get_emails_page():
+    """Page through stored emails without hitting Gmail"""
+    limit = min(request.args.get('limit', 50, type=int), 200)
+    try:
+        emails, next_cursor = get_emails_from_db(limit, request.args.get('cursor'))
+    except InvalidCursor as e:
+        return json_error_response(str(e))
+    return jsonify({'success': True, 'count': len(emails), 'emails': emails, 'next_cursor': next_cursor})
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    """Ranked full-text search: ?q=words&limit=20&cursor=<next_cursor of the previous page>"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return json_error_response('Search query required')
+    try:
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        rows, next_cursor = search_emails(query, limit, request.args.get('cursor') or None)
+        results = [{
+            'id': row['message_id'],
+            'from': row['sender'],
+            'subject': row['subject'],
+            'date': row['timestamp'],
+            'threadId': row['thread_id'],
+            'subject_highlight': row['subject_highlight'],
+            'snippet': row['snippet'],
+            'score': round(-row['rank'], 4)  # bm25 ranks better matches lower
+        } for row in rows]
+        return jsonify({'success': True, 'results': results, 'next_cursor': next_cursor})
+    except InvalidCursor as e:
+        return json_error_response(str(e))
+    except Exception as e:
+        logger.error(f"Search failed for {query!r}: {str(e)}")
+        return json_error_response(str(e), 500)
+
 @app.route('/api/emails/<email_id>')
 def get_email(email_id):
     try:
@@ -156,6 +331,60 @@ def get_email(email_id):
         logger.error(f"Error getting email {email_id}: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/emails/<email_id>/attachments')
+def list_email_attachments(email_id):
+    try:
+        if is_email_deleted(email_id):
+            return json_error_response('Email not found (deleted)', 404)
+
+        attachments = [{
+            'part_id': a['part_id'],
+            'filename': a['filename'],
+            'mime_type': a['mime_type'],
+            'size': a['size'],
+            'downloaded': bool(a['sha256'])
+        } for a in list_message_attachments(email_id)]
+        return jsonify({'success': True, 'attachments': attachments})
+    except Exception as e:
+        logger.error(f"Error listing attachments for {email_id}: {str(e)}")
+        return json_error_response(str(e), 500)
+
+@app.route('/api/emails/<email_id>/attachments/<part_id>')
+def download_attachment(email_id, part_id):
+    """
+    Serve attachment content, downloading it from Gmail on first request; supports Range requests
+    Sent as a download unless ?inline=1 is given for a type in INLINE_ATTACHMENT_TYPES
+    """
+    try:
+        if is_email_deleted(email_id):
+            return json_error_response('Email not found (deleted)', 404)
+
+        attachment = open_attachment(email_id, part_id)
+        if attachment is None:
+            return json_error_response('Attachment not found', 404)
+
+        # The type comes from the sender, so anything that could run script on this
+        # origin (HTML, SVG, ...) is only ever offered as a download
+        mime_type = (attachment['mime_type'] or '').split(';')[0].strip().lower()
+        inline = request.args.get('inline') == '1' and mime_type in INLINE_ATTACHMENT_TYPES
+
+        # Content is addressed by its hash, so the hash is a strong ETag and it never changes
+        response = send_file(
+            os.path.abspath(attachment['file_path']),
+            mimetype=attachment['mime_type'],
+            as_attachment=not inline,
+            download_name=attachment['filename'],
+            conditional=True,
+            etag=attachment['sha256'],
+            max_age=365 * 24 * 60 * 60
+        )
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        response.headers['Content-Security-Policy'] = 'sandbox'
+        return response
+    except Exception as e:
+        logger.error(f"Error serving attachment {email_id}/{part_id}: {str(e)}")
+        return json_error_response(str(e), 500)
+
 @app.route('/api/emails/<email_id>/delete', methods=['POST'])
 def delete_email(email_id):
     try:
@@ -168,6 +397,12 @@ def delete_email(email_id):
 
 @app.route('/api/reply/generate', methods=['POST'])
 def generate_reply_combined():
+    """
+    Fan out the work for a reply: Gmail and the local thread are read in parallel,
+    the reply and the analysis are generated in parallel, and the Slack alert is
+    queued for the background dispatcher. In debug mode the response includes
+    per-stage timings in ms.
+    """
     try:
         data = request.get_json()
         email_id = data.get('email_id')
@@ -177,71 +412,191 @@ def generate_reply_combined():
         if is_email_deleted(email_id):
             return json_error_response('Email is deleted', 404)
 
-        email_details = get_email_details(email_id)
-        if not email_details:
+        started = time.monotonic()
+        timings = {}
+        work = start_reply_work(email_id, timings)
+        if work is None:
             return json_error_response('Email not found', 404)
+        email_details, thread_emails, analysis_future = work
 
-        thread_emails = get_email_thread(email_details['threadId'])
-        context = "\n\n".join([f"From: {e['sender']}\nSubject: {e['subject']}\n{e['body']}" for e in thread_emails])
-
-        reply = generate_reply(email_details['subject'], context)
-        analysis = analyze_email(email_details['body'])
+        context, context_stats = timed(timings, 'context', build_thread_context, thread_emails,
+                                        executor=reply_executor)
+        examples, similar_replies = reply_examples(email_id, email_details, timings)
 
-        log_action(email_id, 'reply_generated', json.dumps({'model': 'llama3-8b-8192', 'context_length': len(context)}))
+        reply = timed(timings, 'reply', generate_reply, email_details['subject'], context, examples)
+        analysis = analysis_future.result()
+        timings['total'] = round((time.monotonic() - started) * 1000)
 
-        if analysis.get('priority', 0) > 7:
-            slack_msg = f"Important email from {email_details['from']}: {email_details['subject']}"
-            send_slack_notification(slack_msg)
-            log_action(email_id, 'slack_notification', slack_msg)
+        log_action(email_id, 'reply_generated', json.dumps({
+            'model': MODEL, 'context_length': len(context), 'similar_replies': similar_replies, **context_stats
+        }))
+        notify_if_important(email_id, email_details['from'], email_details['subject'], analysis)
 
-        return jsonify({
+        result = {
             'success': True,
             'reply': reply,
             'analysis': analysis,
             'sender': email_details['from'],
             'subject': email_details['subject'],
             'thread_count': len(thread_emails)
-        })
+        }
+        if app.debug:
+            result['timings'] = timings
+        return jsonify(result)
 
     except Exception as e:
         logger.error(f"Error generating reply: {str(e)}")
         return json_error_response(str(e), 500)
 
+@app.route('/api/reply/stream', methods=['POST'])
+def stream_reply_events():
+    """
+    Generate a reply as server-sent events: meta first, then token events as the
+    model writes, an analysis event whenever the parallel analysis finishes, and
+    done (with time-to-first-token) or error at the end.
+    """
+    try:
+        data = request.get_json() or {}
+        email_id = data.get('email_id')
+        if not email_id:
+            return json_error_response('Email ID required')
+
+        if is_email_deleted(email_id):
+            return json_error_response('Email is deleted', 404)
+
+        started = time.monotonic()
+        work = start_reply_work(email_id, {})
+        if work is None:
+            return json_error_response('Email not found', 404)
+        email_details, thread_emails, analysis_future = work
+
+        context, context_stats = build_thread_context(thread_emails, executor=reply_executor)
+        examples, similar_replies = reply_examples(email_id, email_details, {})
+    except Exception as e:
+        logger.error(f"Error preparing streamed reply: {str(e)}")
+        return json_error_response(str(e), 500)
+
+    events = queue.Queue()
+
+    def produce_reply():
+        try:
+            for text in stream_reply(email_details['subject'], context, examples):
+                events.put(('token', text))
+            events.put(('reply_done', None))
+        except Exception as e:
+            events.put(('reply_done', e))
+
+    def produce_analysis(future):
+        events.put(('analysis', future))
+
+    reply_executor.submit(produce_reply)
+    analysis_future.add_done_callback(produce_analysis)
+
+    def generate():
+        yield sse_event('meta', {
+            'sender': email_details['from'],
+            'subject': email_details['subject'],
+            'thread_count': len(thread_emails)
+        })
+
+        first_token_ms = None
+        reply_length = 0
+        reply_error = None
+        analysis = None
+        pending = {'reply_done', 'analysis'}
+        while pending:
+            kind, value = events.get()
+            if kind == 'token':
+                if first_token_ms is None:
+                    first_token_ms = round((time.monotonic() - started) * 1000)
+                reply_length += len(value)
+                yield sse_event('token', {'text': value})
+                continue
+
+            pending.discard(kind)
+            if kind == 'analysis':
+                if value.exception() is not None:
+                    logger.error(f"Error analyzing email {email_id}: {value.exception()}")
+                    continue
+                analysis = value.result()
+                yield sse_event('analysis', analysis)
+            elif value is not None:
+                reply_error = value
+                logger.error(f"Error streaming reply: {str(value)}")
+
+        timings = {
+            'first_token_ms': first_token_ms,
+            'total_ms': round((time.monotonic() - started) * 1000)
+        }
+        try:
+            log_action(email_id, 'reply_generated', json.dumps({
+                'model': MODEL, 'streamed': True, 'context_length': len(context),
+                'similar_replies': similar_replies, 'reply_length': reply_length, **timings, **context_stats
+            }))
+            if analysis is not None:
+                notify_if_important(email_id, email_details['from'], email_details['subject'], analysis)
+        except Exception as e:
+            logger.error(f"Error recording streamed reply: {str(e)}")
+
+        if reply_error is not None:
+            yield sse_event('error', {'error': str(reply_error)})
+        else:
+            yield sse_event('done', timings)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Keep reverse proxies from buffering the stream
+    })
+
 @app.route('/api/reply/send', methods=['POST'])
 def send_reply():
+    """
+    Queue a reply for the background sender and return right away (202).
+    Repeating a request, or sending an Idempotency-Key header already used,
+    returns the original outbox entry instead of queueing a second copy.
+    """
     try:
         data = request.get_json()
         required = ['email_id', 'to', 'subject', 'body']
         if not all(k in data for k in required):
             return json_error_response('Missing required fields')
 
-        success = send_email_reply(
+        entry, created = enqueue(
+            email_id=data['email_id'],
             to=data['to'],
             subject=data['subject'],
             body=data['body'],
-            email_id=data['email_id'],
-            in_reply_to=data['email_id']
+            idempotency_key=request.headers.get('Idempotency-Key') or data.get('idempotency_key')
         )
-
-        if success:
-            log_action(data['email_id'], 'reply_sent', json.dumps({
-                'to': data['to'],
-                'subject': data['subject'],
-                'body_length': len(data['body'])
-            }))
-            return jsonify({'success': True})
-
-        return json_error_response('Failed to send email', 500)
+        return jsonify({'success': True, 'queued': created, 'outbox': outbox_entry_status(entry)}), 202
+    except ValueError as e:
+        return json_error_response(str(e))
     except Exception as e:
-        logger.exception("Error sending reply")
+        logger.exception("Error queueing reply")
         return json_error_response(str(e), 500)
 
+@app.route('/api/outbox', methods=['GET'])
+def get_outbox():
+    """Delivery progress: counts by status and the most recent entries"""
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    return jsonify({
+        'success': True,
+        'stats': get_outbox_stats(),
+        'entries': [outbox_entry_status(entry) for entry in list_outbox(limit)]
+    })
+
+@app.route('/api/outbox/<int:entry_id>', methods=['GET'])
+def get_outbox_status(entry_id):
+    entry = get_outbox_entry(entry_id)
+    if entry is None:
+        return json_error_response('Outbox entry not found', 404)
+    return jsonify({'success': True, 'outbox': outbox_entry_status(entry)})
+
 
 @app.route('/api/actions/<email_id>')
 def get_actions(email_id):
     try:
-        with sqlite3.connect("ai_email_assistant.db") as conn:
-            conn.row_factory = sqlite3.Row
+        with get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM actions WHERE email_id = ? ORDER BY created_at DESC', (email_id,))
             actions = [dict(row) for row in cursor.fetchall()]
@@ -250,6 +605,20 @@ def get_actions(email_id):
         logger.error(f"Error getting actions for email {email_id}: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/gmail/push', methods=['POST'])
+def gmail_push():
+    """Pub/Sub push endpoint for Gmail watch notifications"""
+    if not push_enabled():
+        return json_error_response('Push notifications are not configured', 404)
+    if not verify_push_token(request.args.get('token')):
+        return json_error_response('Invalid push token', 403)
+    if handle_notification(request.get_json(silent=True)):
+        # Runs the incremental sync from the last synced historyId as soon as the
+        # fetch stage is free; a burst of notifications collapses into one sync
+        fetch_poller.trigger()
+    # Any 2xx acknowledges the message: stale or malformed ones must not be redelivered
+    return '', 204
+
 @app.route("/auto-reply/status", methods=["GET"])
 def get_auto_reply_status():
     return jsonify({"auto_reply_enabled": is_auto_reply_enabled()}), 200
@@ -265,76 +634,136 @@ def toggle_auto_reply():
 def handle_404(e):
     return json_error_response('Endpoint not found', 404)
 
+# ---------------------------- Commands ----------------------------
+@app.cli.command('search-index')
+@click.argument('action', type=click.Choice(['rebuild', 'optimize']))
+def search_index_command(action):
+    """Rebuild the full-text search index from the emails table, or optimize it."""
+    start = time.time()
+    if action == 'rebuild':
+        rebuild_search_index()
+    else:
+        optimize_search_index()
+    click.echo(f"Search index {action} finished in {time.time() - start:.2f}s")
+
 # ---------------------------- Scheduler ----------------------------
-def scheduled_email_fetch():
-    with app.app_context():
-        global notified_emails
-        try:
-            logger.info("⏰ Scheduled: Checking for new emails...")
-            gmail_emails = fetch_emails()
-            gmail_ids = set(email['id'] for email in gmail_emails)
-
-            with sqlite3.connect("ai_email_assistant.db") as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT message_id FROM emails")
-                local_ids = set(row[0] for row in cursor.fetchall())
-
-            deleted_ids = local_ids - gmail_ids
-            for msg_id in deleted_ids:
-                cursor.execute("DELETE FROM emails WHERE message_id = ?", (msg_id,))
-                logger.info(f"🗑️ Deleted stale email from DB: {msg_id}")
-                if msg_id in notified_emails:
-                    notified_emails.remove(msg_id)
-            conn.commit()
-
-            for email in gmail_emails:
-                email_id = email['id']
-                store_email(
-                    message_id=email_id,
-                    sender=email['from'],
-                    recipient='me',
-                    subject=email.get('subject', 'No Subject'),
-                    timestamp=email.get('date', datetime.now().isoformat()),
-                    body=email.get('snippet', ''),
-                    thread_id=email['threadId']
-                )
-                analysis = analyze_email(email.get('snippet', ''))
-                priority = analysis.get('priority', 0)
-
-                if priority > 7 and email_id not in notified_emails:
-                    slack_msg = f"📬 High Priority Email from {email['from']}: {email.get('subject', '')}"
-                    send_slack_notification(slack_msg)
-                    log_action(email_id, 'slack_notification', slack_msg)
-                    notified_emails.add(email_id)
-
-                if is_auto_reply_enabled():
-                    reply_body = (
-                        f"Hello,\n\n"
-                        f"Thank you for your message. I'm currently unavailable but will get back to you as soon as possible.\n\n"
-                        f"Best regards,\nAI Email Assistant"
-                    )
-
-                    send_email_reply(
-                        to=email['from'],
-                        subject=f"Re: {email.get('subject', 'No Subject')}",
-                        body=reply_body,
-                        email_id=email_id,
-                        in_reply_to=email_id,
-                    )
-                    log_action(email_id, "auto-reply", "Auto reply sent")
-
-            logger.info("✅ Scheduled email fetch complete.")
-        except Exception as e:
-            logger.error(f"❌ Scheduled fetch failed: {e}")
+# fetch -> store -> analyze -> notify, with store also feeding auto-reply. Each
+# stage has its own workers and a bounded queue, so a slow LLM backs work up
+# toward the fetch poller instead of overlapping or skipping fetches.
+_analysis_claims = set()  # Emails queued for or being analyzed
+_analysis_claims_lock = threading.Lock()
+
+def fetch_new_mail():
+    """Fetch stage: one sync with Gmail; returns True if anything changed"""
+    sync = sync_inbox()
+    logger.info(f"{'Full' if sync['full_sync'] else 'Incremental'} sync: "
+                f"{len(sync['emails'])} new, {len(sync['removed'])} removed")
+    # Passed on even when empty so the store stage retries emails whose analysis failed
+    store_stage.put(sync)
+    return bool(sync['emails'] or sync['removed'])
+
+def store_synced(sync):
+    """Store stage: apply a sync to the DB and hand the results on"""
+    delete_emails(sync['removed'])
+    for msg_id in sync['removed']:
+        logger.info(f"🗑️ Deleted stale email from DB: {msg_id}")
+
+    gmail_emails = sync['emails']
+    new_ids = set(store_emails_bulk(email_to_row(email) for email in gmail_emails))
+    preclassify_new_emails(gmail_emails, new_ids)
+    queue_analysis()
+
+    for email in gmail_emails:
+        if email['id'] in new_ids:
+            auto_reply_stage.put(email)
+
+def queue_analysis():
+    """Hand emails without a stored analysis, and not already on their way, to the analyze stage"""
+    with _analysis_claims_lock:
+        rows = [row for row in get_unanalyzed_emails() if row['message_id'] not in _analysis_claims]
+        _analysis_claims.update(row['message_id'] for row in rows)
+    for row in rows:
+        analyze_stage.put(row)
+
+def analyze_rows(rows):
+    """Analyze stage: one email alone, or a backlog in batch prompts; saved before notifying"""
+    try:
+        if len(rows) == 1:
+            results = {rows[0]['message_id']: analyze_email(rows[0]['body'] or '')}
+        else:
+            results = analyze_emails_batch([(row['message_id'], row['body'] or '') for row in rows])
+        for row in rows:
+            analysis = results.get(row['message_id'])
+            if analysis is None:
+                continue
+            store_analysis(row['message_id'], analysis, analysis.get('model', MODEL))
+            notify_stage.put((row, analysis))
+    finally:
+        # Anything left unanalyzed is picked up again after the next fetch
+        with _analysis_claims_lock:
+            _analysis_claims.difference_update(row['message_id'] for row in rows)
+
+def notify_analyzed(item):
+    """Notify stage: alert Slack if the email is high priority"""
+    row, analysis = item
+    # Fallback guesses stay unanalyzed and are retried; the real analysis decides
+    if analysis.get('model') != FALLBACK_MODEL and analysis.get('priority', 0) > 7:
+        email_id = row['message_id']
+        slack_msg = f"📬 High Priority Email from {row['sender']}: {row['subject'] or ''}"
+        queue_slack_notification(slack_msg)
+        log_action(email_id, 'slack_notification', slack_msg)
+        mark_notified(email_id)
+
+def auto_reply(email):
+    """Auto-reply stage: queue the away message for a new email while auto-reply is on"""
+    if not is_auto_reply_enabled():
+        return
+    email_id = email['id']
+    reply_body = (
+        f"Hello,\n\n"
+        f"Thank you for your message. I'm currently unavailable but will get back to you as soon as possible.\n\n"
+        f"Best regards,\nAI Email Assistant"
+    )
+
+    # Queued, not sent inline: the sender paces and retries it, and a
+    # sender gets at most one auto-reply per AUTO_REPLY_DEDUP_WINDOW
+    try:
+        _, queued = enqueue(
+            email_id=email_id,
+            to=email['from'],
+            subject=f"Re: {email.get('subject', 'No Subject')}",
+            body=reply_body,
+            kind='auto-reply',
+            dedup_window=AUTO_REPLY_DEDUP_WINDOW
+        )
+    except ValueError as e:
+        logger.warning(f"Not auto-replying to {email_id}: {e}")
+        return
+    if queued:
+        log_action(email_id, "auto-reply-queued", "Auto reply queued")
+
+def renew_gmail_watch():
+    """Keep the Gmail push watch alive; fetch polling backs off further while it is"""
+    fetch_poller.max_interval = PUSH_FALLBACK_INTERVAL if ensure_watch() else FETCH_MAX_INTERVAL
+    return False
+
+# Created in pipeline order, which is also the order they drain in on shutdown
+store_stage = Stage('store', store_synced, queue_size=4)
+analyze_stage = Stage('analyze', analyze_rows, workers=ANALYSIS_WORKERS, queue_size=BATCH_MAX_ITEMS * ANALYSIS_WORKERS,
+                      batch_size=BATCH_MAX_ITEMS, batch_after=ANALYSIS_BATCH_THRESHOLD)
+notify_stage = Stage('notify', notify_analyzed)
+auto_reply_stage = Stage('auto-reply', auto_reply)
+fetch_poller = Poller('fetch', fetch_new_mail)
+if push_enabled():
+    watch_poller = Poller('gmail-watch', renew_gmail_watch, WATCH_CHECK_INTERVAL, WATCH_CHECK_INTERVAL)
 
 # ---------------------------- Run App ----------------------------
 if __name__ == '__main__':
-    if not os.path.exists("ai_email_assistant.db"):
+    if not os.path.exists(DB_FILE):
         logger.info("Database not found, initializing...")
         init_db()
 
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(scheduled_email_fetch, 'interval', seconds=60)
-    scheduler.start()
+    start_scheduler()
+    start_sender(on_sent=index_sent_reply)
 
     app.run(host='0.0.0.0', port=5000, debug=True)
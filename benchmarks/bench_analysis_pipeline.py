@@ -0,0 +1,69 @@
+"""
+Benchmark: serial analyze_email calls vs a multi-worker analyze stage (as the
+staged scheduler runs it with ANALYSIS_WORKERS threads), against a stub LLM
+server with injected latency and occasional 429s.
+
+Run from the repository root:
+    python -m benchmarks.bench_analysis_pipeline
+"""
+import os
+import tempfile
+import time
+
+os.environ.setdefault('GROQ_API_KEY', 'stub')
+
+from groq import Groq
+
+from benchmarks.llm_stub import start_llm_stub
+from src import ai_processing, storage
+from src.rate_limit import LLMRateLimiter
+from src.staged_scheduler import Stage
+
+EMAILS = 100
+LATENCY = 0.2
+
+
+def make_rows(label):
+    return [{'message_id': f"{label}-{i}", 'body': f"[{label}] Can we meet on Friday about item {i}?"}
+            for i in range(EMAILS)]
+
+
+def handler(row):
+    analysis = ai_processing.analyze_email(row['body'])
+    storage.store_analysis(row['message_id'], analysis, ai_processing.MODEL)
+
+
+def main():
+    server = start_llm_stub(latency=LATENCY, rate_limit_fraction=0.05)
+    ai_processing.client = Groq(api_key='stub', base_url=server.url, max_retries=0)
+    # Generous limits so the benchmark measures concurrency rather than pacing
+    ai_processing.llm_limiter = LLMRateLimiter(rpm=60000, tpm=10 ** 8)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.set_db_path(os.path.join(tmp, 'bench.db'))
+        print(f"{EMAILS} emails, {LATENCY * 1000:.0f} ms stub latency, 5% injected 429s")
+
+        start = time.perf_counter()
+        for row in make_rows('serial'):
+            handler(row)
+        serial_time = time.perf_counter() - start
+        print(f"{'serial':>12}: {serial_time:6.2f}s")
+
+        for workers in (4, 8):
+            stage = Stage(f"analyze{workers}", handler, workers=workers)
+            start = time.perf_counter()
+            stage.start()
+            for row in make_rows(f"stage{workers}"):
+                stage.put(row)
+            stage.stop()
+            elapsed = time.perf_counter() - start
+            stats = stage.stats()
+            print(f"{f'{workers} workers':>12}: {elapsed:6.2f}s  {serial_time / elapsed:4.1f}x  "
+                  f"processed {stats['processed']}, failed {stats['failed']}, max lag {stats['max_lag_ms']:.0f} ms")
+
+    print(f"stub requests: {server.requests}, of which 429: {server.rate_limited}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
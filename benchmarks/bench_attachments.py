@@ -0,0 +1,110 @@
+"""
+Benchmark: attachment downloads against a Gmail stub.
+
+Compares peak Python memory and time for one large attachment fetched whole
+through attachments().get().execute() vs streamed into the content-addressed
+store, then downloads every attachment of a mailbox where each message carries
+the same logo, and serves one through the Flask route with and without Range.
+
+Run from the repository root:
+    python -m benchmarks.bench_attachments
+"""
+import base64
+import os
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('GROQ_API_KEY', 'stub')
+_tmp = tempfile.TemporaryDirectory()
+os.environ['DB_FILE'] = os.path.join(_tmp.name, 'bench.db')
+
+import requests
+
+import app as web
+from benchmarks.gmail_stub import start_stub_server, build_stub_service, attachment_response
+from src import attachment_service, attachment_store, email_service
+
+MESSAGES = 20
+ATTACHMENT_BYTES = 8 * 1024 * 1024
+LATENCY = 0.05
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def fetch_whole(service, message_id, attachment_id):
+    response = service.users().messages().attachments().get(
+        userId='me', messageId=message_id, id=attachment_id
+    ).execute()
+    return base64.urlsafe_b64decode(response['data'])
+
+
+def main():
+    server = start_stub_server(message_count=MESSAGES, latency=LATENCY, attachment_bytes=ATTACHMENT_BYTES)
+    service = build_stub_service(server)
+    email_service.authenticate_gmail = lambda: service
+    email_service._ensure_fresh_credentials = lambda: None
+    email_service._thread_session = requests.Session  # The stub needs no credentials
+    attachment_store.ATTACHMENT_DIR = os.path.join(_tmp.name, 'attachments')
+
+    ids = [f"m{i}" for i in range(MESSAGES)]
+    for message_id in ids:
+        attachment_response(server, 'report', message_id)
+    print(f"{MESSAGES} messages, each with a shared 40 KiB logo and a "
+          f"{ATTACHMENT_BYTES // 2 ** 20} MiB report, {LATENCY * 1000:.0f} ms stub latency")
+
+    attachments = attachment_service.list_message_attachments(ids[0])
+    report = next(a for a in attachments if a['part_id'] == '2')
+    data, elapsed, peak = measure(fetch_whole, service, ids[0], report['gmail_attachment_id'])
+    print(f"{'whole response':>16}: {elapsed * 1000:7.0f} ms  peak {peak / 2 ** 20:6.1f} MiB")
+    row, elapsed, peak = measure(attachment_service.open_attachment, ids[0], '2')
+    print(f"{'streamed':>16}: {elapsed * 1000:7.0f} ms  peak {peak / 2 ** 20:6.1f} MiB")
+    with open(row['file_path'], 'rb') as f:
+        assert f.read() == data
+
+    start = time.perf_counter()
+    for message_id in ids[:-1]:
+        for attachment in attachment_service.list_message_attachments(message_id):
+            attachment_service.open_attachment(message_id, attachment['part_id'])
+    elapsed = time.perf_counter() - start
+    files = sum(len(names) for _, _, names in os.walk(attachment_store.ATTACHMENT_DIR))
+    print(f"downloaded {2 * (MESSAGES - 1)} attachments in {elapsed:.2f}s, {files} files on disk, "
+          f"store stats {attachment_store.get_attachment_store_stats()}")
+
+    start = time.perf_counter()
+    attachment_service.open_attachment(ids[0], '2')
+    print(f"repeat open (already stored): {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    # Ids issued before this point are now rejected, like expired Gmail attachment ids
+    attachment_service.list_message_attachments(ids[-1])
+    server.attachment_generation += 1
+    row = attachment_service.open_attachment(ids[-1], '2')
+    print(f"stale attachment id refreshed and downloaded: {os.path.getsize(row['file_path'])} bytes")
+
+    client = web.app.test_client()
+    url = f"/api/emails/{ids[0]}/attachments/2"
+    start = time.perf_counter()
+    full = client.get(url)
+    full_time = time.perf_counter() - start
+    start = time.perf_counter()
+    partial = client.get(url, headers={'Range': 'bytes=1048576-1114111'})
+    range_time = time.perf_counter() - start
+    assert partial.status_code == 206 and partial.data == data[1048576:1114112]
+    cached = client.get(url, headers={'If-None-Match': full.headers['ETag']})
+    print(f"route: full {full.status_code} {len(full.data)} bytes in {full_time * 1000:.1f} ms, "
+          f"range {partial.status_code} {len(partial.data)} bytes in {range_time * 1000:.1f} ms, "
+          f"If-None-Match {cached.status_code}")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Benchmark: store_email per row vs store_emails_bulk in one transaction.
+
+Run from the repository root:
+    python -m benchmarks.bench_bulk_store
+"""
+import os
+import tempfile
+import time
+
+from src import storage
+
+SIZES = [1000, 10000]
+
+
+def make_rows(count, prefix):
+    return [{
+        'message_id': f"{prefix}-{i}",
+        'sender': f"sender{i}@example.com",
+        'recipient': 'me',
+        'subject': f"Subject {i}",
+        'timestamp': 'Tue, 15 Apr 2025 10:00:00 +0000',
+        'body': f"Snippet for message {i}",
+        'thread_id': f"thread-{i % 97}"
+    } for i in range(count)]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.set_db_path(os.path.join(tmp, 'bench.db'))
+        print(f"{'rows':>6} {'per-row':>10} {'bulk':>8} {'speedup':>8}")
+
+        for size in SIZES:
+            rows = make_rows(size, f"single{size}")
+            start = time.perf_counter()
+            for row in rows:
+                storage.store_email(**row)
+            single_time = time.perf_counter() - start
+
+            rows = make_rows(size, f"bulk{size}")
+            start = time.perf_counter()
+            inserted = storage.store_emails_bulk(rows)
+            bulk_time = time.perf_counter() - start
+
+            assert len(inserted) == size
+            assert storage.store_emails_bulk(rows) == []
+            print(f"{size:>6} {single_time:>9.3f}s {bulk_time:>7.3f}s {single_time / bulk_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Benchmark: per-message metadata gets vs batched gets against a local Gmail stub.
+
+Run from the repository root:
+    python -m benchmarks.bench_gmail_batch
+"""
+import time
+
+from benchmarks.gmail_stub import start_stub_server, build_stub_service
+from src.email_service import fetch_message_metadata, METADATA_HEADERS, BATCH_SIZE
+
+SIZES = [25, 100, 500]
+
+
+def fetch_sequential(service, message_ids):
+    results = {}
+    for msg_id in message_ids:
+        results[msg_id] = service.users().messages().get(
+            userId='me', id=msg_id, format='metadata', metadataHeaders=METADATA_HEADERS
+        ).execute()
+    return results
+
+
+def main():
+    server = start_stub_server(message_count=max(SIZES))
+    service = build_stub_service(server)
+    print(f"stub latency {server.latency * 1000:.0f} ms/request, batch size {BATCH_SIZE}")
+    print(f"{'messages':>8} {'sequential':>12} {'batched':>10} {'speedup':>8}")
+
+    for size in SIZES:
+        listed = service.users().messages().list(userId='me', maxResults=size).execute()
+        ids = [m['id'] for m in listed['messages']]
+
+        start = time.perf_counter()
+        sequential = fetch_sequential(service, ids)
+        sequential_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batched = fetch_message_metadata(service, ids)
+        batched_time = time.perf_counter() - start
+
+        assert sequential.keys() == batched.keys()
+        print(f"{size:>8} {sequential_time:>11.3f}s {batched_time:>9.3f}s {sequential_time / batched_time:>7.1f}x")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Benchmark: opening an email with get_email_details, first view (format='full'
+fetch from a Gmail stub) vs repeat views served from the local message cache.
+
+Run from the repository root:
+    python -m benchmarks.bench_message_cache
+"""
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.gmail_stub import start_stub_server, build_stub_service
+from src import email_service, message_cache, storage
+
+MESSAGES = 200
+LATENCY = 0.08  # A realistic messages.get round trip
+
+
+def time_opens(ids):
+    durations = []
+    for msg_id in ids:
+        start = time.perf_counter()
+        details = email_service.get_email_details(msg_id)
+        durations.append(time.perf_counter() - start)
+        assert details and details['body'], msg_id
+    return durations
+
+
+def main():
+    server = start_stub_server(message_count=MESSAGES, latency=LATENCY)
+    service = build_stub_service(server)
+    email_service.authenticate_gmail = lambda: service
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.set_db_path(os.path.join(tmp, 'bench.db'))
+        ids = [f"m{i}" for i in range(MESSAGES)]
+        print(f"{MESSAGES} messages, {LATENCY * 1000:.0f} ms stub latency, codec {message_cache.MESSAGE_CACHE_CODEC}")
+
+        for label, run in (('first view', time_opens), ('cached view', time_opens)):
+            durations = run(ids)
+            print(f"{label:>12}: median {statistics.median(durations) * 1000:7.2f} ms  "
+                  f"p95 {sorted(durations)[int(len(durations) * 0.95)] * 1000:7.2f} ms")
+
+        stats = message_cache.get_message_cache_stats()
+        raw = len(email_service.get_email_details(ids[0])['body']) * MESSAGES
+        print(f"cache: {stats['entries']} entries, {stats['bytes'] / 1024:.0f} KiB stored "
+              f"for ~{raw / 1024:.0f} KiB of bodies, hit rate {stats['hit_rate']}")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Benchmark: body extraction over synthetic large multipart messages.
+
+Compares three approaches on the same Gmail format='full' payloads:
+  top-level only  the old get_email_details loop (first text part of payload.parts)
+  decode all      walk every part, decode everything, convert whole HTML parts with BeautifulSoup
+  extract_body    src.mime_parser (lazy walk, plain first, skip attachments, capped decode)
+
+Run from the repository root:
+    python -m benchmarks.bench_mime_parser
+"""
+import base64
+import os
+import random
+import time
+
+from bs4 import BeautifulSoup
+
+from src.mime_parser import extract_body, iter_parts
+
+MESSAGES_PER_KIND = 20
+random.seed(7)
+
+WORDS = ("meeting budget review quarterly invoice schedule team project update report "
+         "deadline client proposal agenda notes follow action items contract").split()
+
+
+def b64(data):
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def text(size):
+    out, length = [], 0
+    while length < size:
+        word = random.choice(WORDS)
+        out.append(word)
+        length += len(word) + 1
+    return " ".join(out)
+
+
+def newsletter_html(size):
+    rows = []
+    length = 0
+    while length < size:
+        row = (f'<tr><td style="padding:12px;font-family:Arial;color:#333"><a href="https://example.com/'
+               f'{random.randint(0, 10 ** 9)}?utm_source=news">{text(120)}</a></td></tr>')
+        rows.append(row)
+        length += len(row)
+    return (f"<html><head><style>{'td{color:red}' * 200}</style></head><body>"
+            f"<table>{''.join(rows)}</table><script>{'var x=1;' * 500}</script></body></html>")
+
+
+def leaf(mime_type, data, filename='', disposition=None):
+    headers = [{'name': 'Content-Type', 'value': f'{mime_type}; charset="UTF-8"'}]
+    if disposition:
+        headers.append({'name': 'Content-Disposition', 'value': disposition})
+    return {'mimeType': mime_type, 'filename': filename, 'headers': headers,
+            'body': {'size': len(data), 'data': b64(data)}}
+
+
+def multipart(mime_type, parts):
+    return {'mimeType': mime_type, 'filename': '', 'headers': [], 'body': {'size': 0}, 'parts': parts}
+
+
+def make_corpus():
+    corpus = []
+    for _ in range(MESSAGES_PER_KIND):
+        body = text(4000)
+        # mixed -> [alternative -> [plain, html], 2 MB PDF, 1 MB image]
+        corpus.append(('mixed+attachments', multipart('multipart/mixed', [
+            multipart('multipart/alternative', [
+                leaf('text/plain', body.encode()),
+                leaf('text/html', f"<html><body><p>{body}</p></body></html>".encode()),
+            ]),
+            leaf('application/pdf', os.urandom(2 * 1024 * 1024), 'report.pdf', 'attachment; filename="report.pdf"'),
+            leaf('image/png', os.urandom(1024 * 1024), 'chart.png', 'attachment; filename="chart.png"'),
+        ])))
+        # HTML-only newsletter, ~800 KB
+        corpus.append(('html newsletter', leaf('text/html', newsletter_html(800_000).encode())))
+        # related -> [alternative -> [plain, html], inline images] with a long plain body
+        corpus.append(('long plain+inline', multipart('multipart/related', [
+            multipart('multipart/alternative', [
+                leaf('text/plain', text(400_000).encode()),
+                leaf('text/html', newsletter_html(400_000).encode()),
+            ]),
+            *[leaf('image/jpeg', os.urandom(200 * 1024), f'img{i}.jpg', 'inline') for i in range(5)],
+        ])))
+    return corpus
+
+
+def top_level_only(payload):
+    for part in payload.get('parts', []):
+        if part['mimeType'] in ['text/plain', 'text/html']:
+            data = part['body'].get('data', '')
+            if data:
+                return base64.urlsafe_b64decode(data + '===').decode('utf-8')
+    return ''
+
+
+def decode_all(payload):
+    plain, html = '', ''
+    for part in iter_parts(payload):
+        data = base64.urlsafe_b64decode(part['body'].get('data', '') + '===')
+        if part['mimeType'] == 'text/plain' and not plain:
+            plain = data.decode('utf-8', errors='replace')
+        elif part['mimeType'] == 'text/html' and not html:
+            soup = BeautifulSoup(data.decode('utf-8', errors='replace'), 'html.parser')
+            for tag in soup(['script', 'style', 'head']):
+                tag.decompose()
+            html = soup.get_text("\n", strip=True)
+    return plain or html
+
+
+def main():
+    corpus = make_corpus()
+    kinds = sorted({kind for kind, _ in corpus})
+    size = sum(len(p['body'].get('data', '')) for _, payload in corpus for p in iter_parts(payload))
+    print(f"{len(corpus)} messages, {size / 2 ** 20:.0f} MiB of base64 part data")
+    print(f"{'':>16} " + " ".join(f"{kind:>20}" for kind in kinds) + f" {'non-empty':>10}")
+
+    for name, extract in (('top-level only', top_level_only), ('decode all', decode_all),
+                          ('extract_body', extract_body)):
+        per_kind = {}
+        non_empty = 0
+        for kind, payload in corpus:
+            start = time.perf_counter()
+            body = extract(payload)
+            per_kind[kind] = per_kind.get(kind, 0) + time.perf_counter() - start
+            non_empty += bool(body.strip())
+        row = " ".join(f"{per_kind[kind] / MESSAGES_PER_KIND * 1000:>17.2f} ms" for kind in kinds)
+        print(f"{name:>16} {row} {non_empty:>6}/{len(corpus)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Benchmark: sending replies inline vs through the outbox, against a Gmail stub.
+
+1. What the caller waits for: /api/reply/send used to call Gmail inline; it now
+   only writes an outbox row. The same holds for a scheduler tick auto-replying
+   to a batch of new emails.
+2. Draining a queue through injected 429/5xx responses and sends whose response
+   is lost after Gmail accepted them, checking that no message goes out twice and
+   that the global send rate is respected.
+3. Recovery after a crash between claiming a message and recording the result.
+
+Run from the repository root:
+    python -m benchmarks.bench_outbox
+"""
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('GROQ_API_KEY', 'stub')
+_tmp = tempfile.TemporaryDirectory()
+os.environ['DB_FILE'] = os.path.join(_tmp.name, 'bench.db')
+
+import app as web
+from benchmarks.gmail_stub import start_stub_server, build_stub_service
+from src import email_service, outbox
+from src.rate_limit import TokenBucket
+from src.storage import get_connection
+
+SEND_LATENCY = 0.4  # Seconds per messages.send, in line with what Gmail takes
+TICK_EMAILS = 20
+DRAIN_MESSAGES = 30
+SENDS_PER_SECOND = 5
+
+
+def reset_outbox():
+    with get_connection() as conn:
+        conn.execute("DELETE FROM outbox")
+
+
+def duplicates(server):
+    return sum(len(ids) - 1 for ids in server.sent.values())
+
+
+def wait_until_settled(timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = outbox.get_outbox_stats()
+        if not stats['queued'] and not stats['sending']:
+            return stats
+        time.sleep(0.05)
+    raise TimeoutError(outbox.get_outbox_stats())
+
+
+def main():
+    server = start_stub_server(latency=0.01)
+    server.send_latency = SEND_LATENCY
+    local = threading.local()
+
+    def stub_service():
+        if not hasattr(local, 'service'):
+            local.service = build_stub_service(server)
+        return local.service
+
+    email_service.authenticate_gmail = stub_service
+    client = web.app.test_client()
+
+    inline, queued = [], []
+    for i in range(10):
+        start = time.perf_counter()
+        email_service.send_email_reply(f"user{i}@example.com", "Re: hi", "Thanks!", f"m{i}", f"m{i}")
+        inline.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        response = client.post('/api/reply/send', json={
+            'email_id': f"m{i}", 'to': f"user{i}@example.com", 'subject': 'Re: hi', 'body': 'Thanks!'
+        })
+        queued.append(time.perf_counter() - start)
+        assert response.status_code == 202
+    repeat = client.post('/api/reply/send', json={
+        'email_id': 'm0', 'to': 'user0@example.com', 'subject': 'Re: hi', 'body': 'Thanks!'
+    }).get_json()
+    print(f"/api/reply/send with {SEND_LATENCY * 1000:.0f} ms Gmail sends: inline "
+          f"{statistics.median(inline) * 1000:.0f} ms, queued {statistics.median(queued) * 1000:.1f} ms "
+          f"(repeated request queued again: {repeat['queued']})")
+
+    start = time.perf_counter()
+    for i in range(TICK_EMAILS):
+        email_service.send_email_reply(f"tick{i}@example.com", "Re: hi", "Away", f"t{i}", f"t{i}")
+    inline_tick = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(TICK_EMAILS):
+        # The same sender twice in a tick gets one auto-reply
+        outbox.enqueue(f"t{i}", f"tick{i // 2}@example.com", "Re: hi", "Away", kind='auto-reply',
+                       dedup_window=outbox.AUTO_REPLY_DEDUP_WINDOW)
+    queued_tick = time.perf_counter() - start
+    print(f"scheduler tick auto-replying to {TICK_EMAILS} emails: inline {inline_tick:.1f} s, "
+          f"queued {queued_tick * 1000:.1f} ms ({outbox.get_outbox_stats()['queued'] - 10} queued "
+          f"for {TICK_EMAILS // 2} senders)")
+
+    reset_outbox()
+    server.sent.clear()
+    server.send_latency = 0.02
+    outbox.send_limiter = TokenBucket(SENDS_PER_SECOND, 1)
+    outbox.OUTBOX_RETRY_BASE = 0.2
+    server.send_failures = [429, 503, 500, 429, 502]
+    server.accept_then_fail = 3
+    for i in range(DRAIN_MESSAGES):
+        outbox.enqueue(f"d{i}", f"drain{i}@example.com", "Re: report", f"Reply {i}")
+    start = time.perf_counter()
+    outbox.start_sender()
+    stats = wait_until_settled()
+    elapsed = time.perf_counter() - start
+    with get_connection() as conn:
+        attempts = conn.execute("SELECT SUM(attempts) FROM outbox").fetchone()[0]
+    print(f"drained {DRAIN_MESSAGES} messages in {elapsed:.1f} s at a limit of {SENDS_PER_SECOND}/s: "
+          f"sent {stats['sent']}, failed {stats['failed']}, {attempts} attempts, "
+          f"{len(server.sent)} distinct messages at Gmail, {duplicates(server)} duplicates")
+    outbox.stop_sender(5)
+
+    # Crash 1: Gmail accepted the send but the process died before recording it.
+    # Crash 2: the process died after claiming, before sending.
+    reset_outbox()
+    server.sent.clear()
+    for i in range(2):
+        outbox.enqueue(f"c{i}", f"crash{i}@example.com", "Re: crash", f"Reply {i}")
+    accepted = outbox._claim_next()
+    email_service.send_message(email_service.build_message(
+        accepted['to_addr'], accepted['subject'], accepted['body'], None, accepted['message_id_header']))
+    outbox._claim_next()
+    with get_connection() as conn:
+        conn.execute("UPDATE outbox SET updated_at = updated_at - ?", (outbox.OUTBOX_SENDING_TIMEOUT + 1,))
+    outbox.start_sender()
+    stats = wait_until_settled()
+    print(f"after a restart with 2 interrupted sends: sent {stats['sent']}, "
+          f"{len(server.sent)} distinct messages at Gmail, {duplicates(server)} duplicates")
+    outbox.stop_sender(5)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Benchmark: local pre-classifier throughput on synthetic messages (single core).
+
+Run from the repository root:
+    python -m benchmarks.bench_preclassifier
+"""
+import random
+import time
+
+from src.preclassifier import preclassify, get_preclassifier_stats
+
+MESSAGES = 100_000
+
+SENDERS = ['alice@example.com', 'bob@partner.org', 'noreply@shop.example', 'news@list.example',
+           'carol@example.com', 'notifications@tracker.example']
+SUBJECTS = ['Quarterly numbers', 'Re: contract draft', 'Your weekly digest', 'FYI: office closed Friday',
+            'Meeting tomorrow?', 'URGENT: server down', 'Your receipt from Example Store']
+BODIES = [
+    'Hi, could you take a look at the attached draft and let me know what you think?',
+    'For your information, the office will be closed on Friday for maintenance.',
+    'Can we schedule a meeting next week to go over the roadmap?',
+    'This week in tech: ten stories you missed. Click to unsubscribe at any time.',
+    'The production cluster is down, please respond asap.',
+    'Thanks for your order. Your receipt is attached. View this email in your browser.',
+]
+HEADER_SETS = [None, None, None, {'list-unsubscribe': '<mailto:unsub@list.example>'}, {'precedence': 'bulk'}]
+
+
+def make_messages(count):
+    rng = random.Random(42)
+    return [(rng.choice(SENDERS), rng.choice(SUBJECTS), rng.choice(BODIES), rng.choice(HEADER_SETS))
+            for _ in range(count)]
+
+
+def main():
+    messages = make_messages(MESSAGES)
+    start = time.perf_counter()
+    for sender, subject, body, headers in messages:
+        preclassify(sender, subject, body, headers)
+    elapsed = time.perf_counter() - start
+
+    print(f"{MESSAGES} messages in {elapsed:.3f}s = {MESSAGES / elapsed:,.0f} messages/s")
+    print(f"stats: {get_preclassifier_stats()}")
+
+
+if __name__ == '__main__':
+    main()
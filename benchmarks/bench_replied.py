@@ -0,0 +1,80 @@
+"""
+Benchmark: replied-email bookkeeping with the old JSON file vs the replied_emails table.
+
+For each mailbox size, times what fetch_emails does per sync (filter a page
+of 25 listed ids against the replied set) and what a sent reply does (record
+one id). The JSON side reproduces the removed load_replied_emails /
+save_replied_email: parse the whole file, `in list`, rewrite the file.
+
+Run from the repository root:
+    python -m benchmarks.bench_replied
+"""
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from src import storage
+
+SIZES = (10_000, 100_000, 1_000_000)
+PAGE = 25
+RUNS = 5
+
+
+def median_ms(func, runs=RUNS):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def json_filter(path, page):
+    with open(path) as f:
+        replied = json.load(f)
+    return [m for m in page if m not in replied]
+
+
+def json_save(path, message_id):
+    with open(path) as f:
+        replied = json.load(f)
+    if message_id not in replied:
+        replied.append(message_id)
+        with open(path, 'w') as f:
+            json.dump(replied, f)
+
+
+def table_filter(page):
+    replied = storage.get_replied_ids(page)
+    return [m for m in page if m not in replied]
+
+
+def main():
+    print(f"{'replied ids':>12} {'JSON filter':>12} {'JSON save':>10} {'table filter':>13} {'table save':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in SIZES:
+            ids = [f"18c{i:013x}" for i in range(size)]
+            # Half the page was replied to long ago, half is new
+            page = ids[:PAGE // 2] + [f"new{i}" for i in range(PAGE - PAGE // 2)]
+
+            json_path = os.path.join(tmp, f"replied_{size}.json")
+            with open(json_path, 'w') as f:
+                json.dump(ids, f)
+            json_filter_ms = median_ms(lambda: json_filter(json_path, page))
+            counter = iter(range(RUNS))
+            json_save_ms = median_ms(lambda: json_save(json_path, f"sent{next(counter)}"))
+
+            storage.REPLIED_EMAILS_FILE = json_path
+            storage.set_db_path(os.path.join(tmp, f"replied_{size}.db"))  # Imports the JSON once
+            table_filter_ms = median_ms(lambda: table_filter(page))
+            counter = iter(range(RUNS))
+            table_save_ms = median_ms(lambda: storage.mark_replied(f"sent{next(counter)}"))
+
+            print(f"{size:>12} {json_filter_ms:>9.2f} ms {json_save_ms:>7.1f} ms "
+                  f"{table_filter_ms:>10.3f} ms {table_save_ms:>8.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark: similar-reply lookup latency in the memory-mapped embedding index.
+
+Fills EmbeddingIndex with 10k, 100k and 1M random unit vectors and times
+top-k search for one query and for a batch of queries scored together. At
+10k it also times the approach without an index: embedding every stored
+email again for each query and comparing in Python.
+
+Run from the repository root:
+    python -m benchmarks.bench_reply_index
+"""
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from src.reply_index import EmbeddingIndex, EMBEDDING_DIM, embed
+
+SIZES = (10_000, 100_000, 1_000_000)
+APPEND_CHUNK = 100_000
+K = 5
+BATCH = 32
+RUNS = 20
+rng = np.random.default_rng(5)
+random.seed(5)
+
+WORDS = ("meeting budget review quarterly invoice schedule team project update report deadline "
+         "client proposal agenda notes follow action items contract payment thursday friday").split()
+
+
+def fill(index, rows):
+    start = time.perf_counter()
+    while len(index) < rows:
+        count = min(APPEND_CHUNK, rows - len(index))
+        index.append(rng.standard_normal((count, EMBEDDING_DIM), dtype=np.float32))
+    return time.perf_counter() - start
+
+
+def median_ms(func, runs=RUNS):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def scan_without_index(texts, query):
+    """Re-embed every stored email and keep the best K by cosine similarity"""
+    q = embed(query)
+    q /= np.linalg.norm(q)
+    scored = []
+    for i, text in enumerate(texts):
+        v = embed(text)
+        scored.append((float(q @ v) / (float(np.linalg.norm(v)) or 1.0), i))
+    return sorted(scored, reverse=True)[:K]
+
+
+def main():
+    texts = [" ".join(random.choices(WORDS, k=60)) for _ in range(SIZES[0])]
+    query = " ".join(random.choices(WORDS, k=60))
+    embed_ms = median_ms(lambda: embed(query), 200)
+    print(f"dim {EMBEDDING_DIM}, k={K}; embedding one 60-word email: {embed_ms:.3f} ms")
+    start = time.perf_counter()
+    scan_without_index(texts, query)
+    print(f"without an index, 10k emails re-embedded per query: {(time.perf_counter() - start) * 1000:.0f} ms\n")
+
+    print(f"{'vectors':>10} {'file':>9} {'append':>8} {'1 query':>10} {f'{BATCH} queries':>12} {'per query':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        index = EmbeddingIndex(tmp)
+        for size in SIZES:
+            append_s = fill(index, size)
+            single = rng.standard_normal(EMBEDDING_DIM, dtype=np.float32)
+            batch = rng.standard_normal((BATCH, EMBEDDING_DIM), dtype=np.float32)
+            index.search(single, K)  # Page the matrix in before timing
+            runs = RUNS if size < 1_000_000 else 5
+            single_ms = median_ms(lambda: index.search(single, K), runs)
+            batch_ms = median_ms(lambda: index.search(batch, K), runs)
+            size_mib = os.path.getsize(index.vectors_path) / 2 ** 20
+            print(f"{size:>10} {size_mib:>5.0f} MiB {append_s:>6.1f} s {single_ms:>7.1f} ms "
+                  f"{batch_ms:>9.1f} ms {batch_ms / BATCH:>7.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark: time until the operator sees reply text, blocking /api/reply/generate
+vs streamed /api/reply/stream, against a stub LLM that emits one word at a time.
+The blocking run is made in debug mode and also prints its per-stage timings,
+to check the fan-out total tracks the slowest stage rather than their sum.
+
+Gmail is replaced with a canned message behind a fixed delay, and the response
+cache is turned off so every request reaches the stub.
+
+Run from the repository root:
+    python -m benchmarks.bench_reply_stream
+"""
+import json
+import os
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault('GROQ_API_KEY', 'stub')
+os.environ['LLM_CACHE_MAX_TEMPERATURE'] = '-1'  # Bypass the cache for every completion
+_tmp = tempfile.TemporaryDirectory()
+os.environ['DB_FILE'] = os.path.join(_tmp.name, 'bench.db')
+
+from groq import Groq
+
+import app as web
+from benchmarks.llm_stub import start_llm_stub
+from src import ai_processing
+from src.rate_limit import LLMRateLimiter
+
+LATENCY = 0.3        # Stub time before the first token
+TOKEN_LATENCY = 0.02  # Stub time between words
+GMAIL_LATENCY = 0.15  # Simulated messages.get round trip
+RUNS = 5
+
+
+def fake_email_details(email_id):
+    time.sleep(GMAIL_LATENCY)
+    return {
+        'id': email_id,
+        'threadId': f"thread-{email_id}",
+        'from': 'alice@example.com',
+        'subject': 'Project proposal',
+        'date': '',
+        'snippet': '',
+        'body': 'Hi, can we go through the proposal this week? The budget needs sign-off by Friday.'
+    }
+
+
+def time_blocking(client, email_id):
+    start = time.perf_counter()
+    response = client.post('/api/reply/generate', json={'email_id': email_id})
+    data = response.get_json()
+    assert data['success'], data
+    elapsed = time.perf_counter() - start
+    stage_timings.append(data['timings'])
+    return elapsed, elapsed
+
+
+def time_streaming(client, email_id):
+    start = time.perf_counter()
+    response = client.post('/api/reply/stream', json={'email_id': email_id}, buffered=False)
+    first_token = None
+    for chunk in response.response:
+        if first_token is None and b'event: token' in chunk:
+            first_token = time.perf_counter() - start
+        assert b'event: error' not in chunk, chunk
+    response.close()
+    return first_token, time.perf_counter() - start
+
+
+stage_timings = []
+
+
+def main():
+    server = start_llm_stub(latency=LATENCY, token_latency=TOKEN_LATENCY)
+    ai_processing.client = Groq(api_key='stub', base_url=server.url, max_retries=0)
+    ai_processing.llm_limiter = LLMRateLimiter(rpm=60000, tpm=10 ** 8)
+    web.get_email_details = fake_email_details
+    web.app.debug = True
+    client = web.app.test_client()
+
+    print(f"{LATENCY * 1000:.0f} ms to first token, {TOKEN_LATENCY * 1000:.0f} ms per word, "
+          f"{GMAIL_LATENCY * 1000:.0f} ms Gmail fetch, {RUNS} runs")
+    for label, measure in (('blocking', time_blocking), ('streaming', time_streaming)):
+        first, total = [], []
+        for run in range(RUNS):
+            # A fresh email each run so the analysis is computed rather than read back
+            ttft, elapsed = measure(client, f"{label}-{run}")
+            first.append(ttft)
+            total.append(elapsed)
+        print(f"{label:>10}: first text {statistics.median(first) * 1000:6.0f} ms  "
+              f"complete {statistics.median(total) * 1000:6.0f} ms")
+
+    stages = {stage: statistics.median(t[stage] for t in stage_timings) for stage in stage_timings[0]}
+    print("blocking stages (ms):", stages, f"sum of stages {sum(v for k, v in stages.items() if k != 'total')}")
+
+    with web.get_connection() as conn:
+        row = conn.execute(
+            "SELECT details FROM actions WHERE action_type = 'reply_generated' ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+    print("last logged timings:", {k: v for k, v in json.loads(row['details']).items() if k.endswith('_ms')})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+Benchmark: the fixed-interval scheduler tick vs the staged scheduler, on a
+scripted mailbox and the stub LLM, with time compressed 30x (the 60 s tick
+becomes 2 s, the 45 s analysis deadline 1.5 s, the 15-300 s adaptive fetch
+interval 0.5-10 s).
+
+The mailbox gets a burst of mail, then a steady trickle, then nothing. For each
+email we time arrival in the mailbox -> analysis stored, and we count Gmail
+syncs, in total and while the mailbox is idle. The old tick (sync, store, run
+the analysis pool until the deadline, auto-reply) is reproduced here, fired the
+way APScheduler fires an interval job with max_instances=1: a tick due while
+the previous one still runs is skipped.
+
+Run from the repository root:
+    python -m benchmarks.bench_scheduler
+"""
+import os
+import statistics
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+SCALE = 30
+os.environ.setdefault('GROQ_API_KEY', 'stub')
+os.environ['FETCH_MIN_INTERVAL'] = str(15 / SCALE)
+os.environ['FETCH_MAX_INTERVAL'] = str(300 / SCALE)
+os.environ.setdefault('ANALYSIS_WORKERS', '4')
+_tmp = tempfile.TemporaryDirectory()
+os.environ['DB_FILE'] = os.path.join(_tmp.name, 'bench.db')
+
+from groq import Groq
+
+import app as web
+from benchmarks.llm_stub import start_llm_stub
+from src import ai_processing, storage
+from src.rate_limit import LLMRateLimiter
+from src.staged_scheduler import start_scheduler, stop_scheduler, get_scheduler_stats
+
+TICK = 60 / SCALE
+DEADLINE = 45 / SCALE
+LLM_LATENCIES = (0.5, 2.5)  # Seconds per LLM call: typical, then slow
+SYNC_LATENCY = 0.05
+BURST = 40
+TRICKLE = 20
+TRICKLE_EVERY = 0.3
+IDLE_FROM = 8.0
+RUN_FOR = 20.0
+
+
+class Mailbox:
+    """Emails appear at scripted offsets from start(); sync() returns those not seen yet"""
+
+    def __init__(self, label):
+        arrivals = [0.0] * BURST + [2.0 + i * TRICKLE_EVERY for i in range(TRICKLE)]
+        self.pending = [(at, {
+            'id': f"{label}-{i}", 'threadId': f"{label}-{i}", 'from': f"client{i}@example.com",
+            'subject': f"Project update {i}", 'snippet': f"[{label}] Can we meet on Friday about item {i}?",
+            'date': '2026-10-18T09:00:00'
+        }) for i, at in enumerate(arrivals)]
+        self.arrived_at = {}
+        self.syncs = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.started = time.monotonic()
+
+    def sync(self):
+        time.sleep(SYNC_LATENCY)
+        now = time.monotonic() - self.started
+        with self.lock:
+            self.syncs.append(now)
+            due = [(at, email) for at, email in self.pending if at <= now]
+            self.pending = [(at, email) for at, email in self.pending if at > now]
+        for at, email in due:
+            self.arrived_at[email['id']] = self.started + at
+        return {'emails': [email for _, email in due], 'removed': [], 'full_sync': False}
+
+
+stored_at = {}
+old_pool = ThreadPoolExecutor(max_workers=web.ANALYSIS_WORKERS, thread_name_prefix='old-analysis')
+old_in_progress = set()
+old_lock = threading.Lock()
+
+
+def run_pipeline(items, handler, key, deadline):
+    """
+    The old tick's analysis pool: submit items as workers free up until the
+    deadline, skipping any still running from an earlier tick; work in flight
+    at the deadline finishes in the background
+    """
+    def run(item_key, item):
+        try:
+            handler(item)
+        finally:
+            with old_lock:
+                old_in_progress.discard(item_key)
+
+    end_time = time.monotonic() + deadline
+    pending, running = deque(items), set()
+    while pending and time.monotonic() < end_time:
+        if len(running) >= web.ANALYSIS_WORKERS:
+            done, running = wait(running, timeout=end_time - time.monotonic(), return_when=FIRST_COMPLETED)
+            continue
+        item = pending.popleft()
+        with old_lock:
+            if key(item) in old_in_progress:
+                continue
+            old_in_progress.add(key(item))
+        running.add(old_pool.submit(run, key(item), item))
+    wait(running, timeout=max(0.0, end_time - time.monotonic()))
+
+
+def record_analysis(message_id, analysis, model):
+    storage.store_analysis(message_id, analysis, model)
+    stored_at[message_id] = time.monotonic()
+
+
+def old_tick(mailbox):
+    """The scheduled_email_fetch body this change replaces, minus logging"""
+    sync = mailbox.sync()
+    gmail_emails = sync['emails']
+    new_ids = set(storage.store_emails_bulk(web.email_to_row(email) for email in gmail_emails))
+    web.preclassify_new_emails(gmail_emails, new_ids)
+    rows = storage.get_unanalyzed_emails()
+
+    def analyze_batch(rows):
+        results = ai_processing.analyze_emails_batch([(row['message_id'], row['body']) for row in rows])
+        for message_id, analysis in results.items():
+            record_analysis(message_id, analysis, ai_processing.MODEL)
+
+    def analyze_one(row):
+        record_analysis(row['message_id'], ai_processing.analyze_email(row['body']), ai_processing.MODEL)
+
+    if len(rows) > web.ANALYSIS_BATCH_THRESHOLD:
+        by_id = {row['message_id']: row for row in rows}
+        batches = [[by_id[email_id] for email_id, _ in batch]
+                   for batch in ai_processing.pack_batches([(row['message_id'], row['body']) for row in rows])]
+        run_pipeline(batches, analyze_batch, key=lambda batch: tuple(row['message_id'] for row in batch),
+                     deadline=DEADLINE)
+    else:
+        run_pipeline(rows, analyze_one, key=lambda row: row['message_id'], deadline=DEADLINE)
+
+
+def run_fixed_interval(mailbox):
+    """Fire old_tick every TICK seconds, skipping a tick while the previous one runs"""
+    running = threading.Event()
+    skipped, durations = 0, []
+
+    def tick():
+        start = time.monotonic()
+        try:
+            old_tick(mailbox)
+        finally:
+            durations.append(time.monotonic() - start)
+            running.clear()
+
+    mailbox.start()
+    due = mailbox.started
+    while due < mailbox.started + RUN_FOR:
+        time.sleep(max(0.0, due - time.monotonic()))
+        if running.is_set():
+            skipped += 1
+        else:
+            running.set()
+            threading.Thread(target=tick, daemon=True).start()
+        due += TICK
+    while running.is_set():
+        time.sleep(0.05)
+    return {'skipped ticks': skipped, 'longest tick': f"{max(durations):.2f} s"}
+
+
+def run_staged(mailbox):
+    web.sync_inbox = mailbox.sync
+    web.store_analysis = record_analysis
+    mailbox.start()
+    start_scheduler()
+    time.sleep(RUN_FOR)
+    stats = get_scheduler_stats()
+    stop_scheduler()
+    web.fetch_poller.interval = web.fetch_poller.min_interval
+    return {'fetch interval now': f"{stats['fetch']['interval_seconds']} s",
+            'analyze max lag': f"{stats['analyze']['max_lag_ms']:.0f} ms",
+            'store blocked puts': stats['store']['blocked_puts']}
+
+
+def report(name, mailbox, extra):
+    latencies = sorted(stored_at[i] - at for i, at in mailbox.arrived_at.items() if i in stored_at)
+    total = BURST + TRICKLE
+    idle_syncs = sum(1 for t in mailbox.syncs if t >= IDLE_FROM + TICK)
+    print(f"{name}: {len(latencies)}/{total} analyzed, arrival->analyzed "
+          f"p50 {statistics.median(latencies):.2f} s, p95 {latencies[int(len(latencies) * 0.95) - 1]:.2f} s, "
+          f"max {latencies[-1]:.2f} s; {len(mailbox.syncs)} Gmail syncs "
+          f"({idle_syncs} in the last {RUN_FOR - IDLE_FROM - TICK:.0f} s of idle); "
+          + ", ".join(f"{key} {value}" for key, value in extra.items()))
+
+
+def main():
+    server = start_llm_stub()
+    ai_processing.client = Groq(api_key='stub', base_url=server.url, max_retries=0)
+    ai_processing.llm_limiter = LLMRateLimiter(rpm=60000, tpm=10 ** 8)
+    for latency in LLM_LATENCIES:
+        server.latency = latency
+        print(f"{BURST} emails at once, then {TRICKLE} over {TRICKLE * TRICKLE_EVERY:.0f} s, then idle; "
+              f"{latency * 1000:.0f} ms per LLM call, {web.ANALYSIS_WORKERS} analysis workers")
+
+        mailbox = Mailbox(f"fixed{latency}")
+        extra = run_fixed_interval(mailbox)
+        report(f"  fixed {TICK:.0f} s tick", mailbox, extra)
+
+        mailbox = Mailbox(f"staged{latency}")
+        extra = run_staged(mailbox)
+        report("  staged      ", mailbox, extra)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
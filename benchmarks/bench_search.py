@@ -0,0 +1,99 @@
+"""
+Benchmark: full-text search latency on a synthetic 100k-message mailbox.
+
+Emails are inserted through store_emails_bulk so the FTS5 triggers do the
+indexing, then a mix of queries is timed for the first page and for a page
+reached through the keyset cursor, before and after optimize.
+
+Run from the repository root:
+    python -m benchmarks.bench_search
+"""
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from src import storage
+
+MESSAGES = 100_000
+RUNS = 20
+random.seed(11)
+
+COMMON = ("meeting budget review report project team update schedule invoice client "
+          "deadline proposal agenda contract follow notes call plan status question").split()
+# Zipf-like vocabulary: a few common words and a long tail of rare ones
+VOCABULARY = COMMON + [f"term{i}" for i in range(20_000)]
+CUM_WEIGHTS = list(itertools.accumulate([1000] * len(COMMON) + [1 / (i + 1) for i in range(20_000)]))
+SENDERS = [f"{name}@{domain}" for name in ("alice", "bob", "carol", "dave", "erin", "frank")
+           for domain in ("example.com", "corp.test", "mail.test")]
+
+QUERIES = {
+    'common word': 'meeting',
+    'two words': 'budget review',
+    'rare word': 'term1234',
+    'prefix': 'prop',
+    'sender filter': 'from:alice invoice',
+    'phrase': '"project update"',
+}
+
+
+def make_rows():
+    for i in range(MESSAGES):
+        words = random.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=80)
+        yield {
+            'message_id': f"msg{i}",
+            'sender': random.choice(SENDERS),
+            'recipient': 'me',
+            'subject': " ".join(random.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=5)),
+            'timestamp': f"Tue, 15 Apr 2025 10:{i % 60:02d}:00 +0000",
+            'body': " ".join(words),
+            'thread_id': f"t{i // 3}"
+        }
+
+
+def time_query(query, pages):
+    first, paged = [], []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        rows, cursor = storage.search_emails(query, 20)
+        first.append(time.perf_counter() - start)
+        for _ in range(pages - 1):
+            if not cursor:
+                break
+            start = time.perf_counter()
+            rows, cursor = storage.search_emails(query, 20, cursor)
+        paged.append(time.perf_counter() - start)
+    return statistics.median(first) * 1000, statistics.median(paged) * 1000, len(rows)
+
+
+def report(label):
+    print(f"\n{label}")
+    print(f"{'query':>14} {'page 1':>9} {'page 5':>9}")
+    for name, query in QUERIES.items():
+        first, fifth, _ = time_query(query, 5)
+        print(f"{name:>14} {first:>6.2f} ms {fifth:>6.2f} ms")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.set_db_path(os.path.join(tmp, 'bench.db'))
+        start = time.perf_counter()
+        rows = list(make_rows())
+        for offset in range(0, MESSAGES, 5000):
+            storage.store_emails_bulk(rows[offset:offset + 5000])
+        print(f"indexed {MESSAGES} emails through the insert trigger in {time.perf_counter() - start:.1f}s")
+
+        report("after bulk insert")
+        start = time.perf_counter()
+        storage.optimize_search_index()
+        print(f"\noptimize took {time.perf_counter() - start:.2f}s")
+        report("after optimize")
+
+        rows, _ = storage.search_emails('budget review', 1)
+        print(f"\nexample result: {rows[0]['subject_highlight']!r}\n  {rows[0]['snippet'][:120]!r}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark: Slack alerts for a burst of high-priority mail, inline vs dispatcher.
+
+A local stand-in for chat.postMessage (with per-request latency) counts
+posts and TCP connections. The old path posted each alert inline with
+requests.post, opening a connection per alert; the dispatcher queues alerts,
+posts the first at once over a kept-alive session and folds the rest of the
+burst into a digest. The stub can also answer 429 with Retry-After to check
+that the dispatcher waits as asked.
+
+Run from the repository root:
+    python -m benchmarks.bench_slack
+"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+LATENCY = 0.15
+BURST = 20
+COALESCE_SECONDS = 1.0
+
+
+class SlackStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests.append((time.monotonic(), payload['blocks'][0]['text']['text']))
+            limited = self.server.rate_limit_next
+            self.server.rate_limit_next = 0
+        if limited:
+            body = json.dumps({'ok': False, 'error': 'ratelimited'}).encode()
+            self.send_response(429)
+            self.send_header('Retry-After', str(limited))
+        else:
+            body = json.dumps({'ok': True}).encode()
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_slack_stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlackStubHandler)
+    server.lock = threading.Lock()
+    server.latency = LATENCY
+    server.connections = 0
+    server.requests = []
+    server.rate_limit_next = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def reset(server):
+    server.connections = 0
+    server.requests = []
+
+
+def wait_idle(slack_notifier, timeout=30):
+    """Wait until every queued alert has been posted, alone or in a digest"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = slack_notifier.get_slack_stats()
+        delivered = stats['posted'] + stats['failed'] - stats['digests'] + stats['coalesced']
+        if delivered >= stats['queued']:
+            return stats
+        time.sleep(0.02)
+    raise TimeoutError(slack_notifier.get_slack_stats())
+
+
+def main():
+    server = start_slack_stub()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/chat.postMessage"
+    os.environ.update(SLACK_BOT_TOKEN='xoxb-stub', CHANNEL_ID='C123', SLACK_API_URL=url,
+                      SLACK_COALESCE_SECONDS=str(COALESCE_SECONDS))
+    from src import slack_notifier
+
+    alerts = [f"📬 High Priority Email from sender{i}@example.com: Urgent {i}" for i in range(BURST)]
+
+    start = time.perf_counter()
+    for alert in alerts:
+        # What send_slack_notification used to do for every alert
+        requests.post(url, headers={'Authorization': 'Bearer xoxb-stub'},
+                      json=slack_notifier._payload("New Email Notification", alert))
+    inline = time.perf_counter() - start
+    print(f"inline, {BURST} alerts in one tick: caller blocked {inline:.2f} s, "
+          f"{len(server.requests)} posts over {server.connections} connections")
+
+    reset(server)
+    start = time.perf_counter()
+    for alert in alerts:
+        slack_notifier.queue_slack_notification(alert)
+    queued = time.perf_counter() - start
+    stats = wait_idle(slack_notifier)
+    delivered = time.perf_counter() - start
+    print(f"dispatcher, {BURST} alerts in one tick: caller blocked {queued * 1000:.2f} ms, "
+          f"{len(server.requests)} post(s) ({stats['digests']} digest of {stats['coalesced']}) over "
+          f"{server.connections} connection(s), all delivered after {delivered:.2f} s")
+
+    # Alerts trickling in as analyses finish, one every 100 ms
+    reset(server)
+    time.sleep(COALESCE_SECONDS)
+    for alert in alerts:
+        slack_notifier.queue_slack_notification(alert)
+        time.sleep(0.1)
+    wait_idle(slack_notifier)
+    print(f"dispatcher, {BURST} alerts over {BURST * 0.1:.0f} s: {len(server.requests)} posts "
+          f"(first alert alone, then one digest per {COALESCE_SECONDS:.0f} s window)")
+
+    reset(server)
+    time.sleep(COALESCE_SECONDS)
+    server.rate_limit_next = 2
+    slack_notifier.queue_slack_notification("First alert (rate limited)")
+    time.sleep(0.5)
+    for alert in alerts[:5]:
+        slack_notifier.queue_slack_notification(alert)
+    wait_idle(slack_notifier)
+    times = [t for t, _ in server.requests]
+    print(f"429 with Retry-After: 2 -> retried after {times[1] - times[0]:.2f} s; "
+          f"{len(server.requests)} requests, alerts queued during the wait went out as "
+          f"{len(server.requests) - 2} digest")
+
+    slack_notifier.stop_dispatcher(5)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
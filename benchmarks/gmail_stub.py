@@ -0,0 +1,280 @@
+"""
+Minimal local stand-in for the Gmail REST API used by the benchmarks.
+
+Serves messages.list, messages.get, attachments.get and the multipart batch
+endpoint with an injected per-request latency so round-trip savings are visible
+locally. When attachment_bytes is set, full messages carry a logo shared by every
+message plus a per-message report; bumping server.attachment_generation makes
+previously issued attachment ids stale, as Gmail's do.
+
+messages.send records each message under its Message-ID header in server.sent
+(so duplicates can be counted) and answers `rfc822msgid:` list queries from it.
+server.send_failures is a list of statuses returned by the next sends, and
+server.accept_then_fail makes a send succeed but still answer 503, like a
+response lost after Gmail accepted the message.
+
+getProfile, history.list and watch serve a mailbox history that starts at
+server.history_id; add_history_message() delivers a new unread inbox message
+and returns the historyId it was recorded under. server.calls counts requests
+per endpoint.
+"""
+import base64
+import email
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import httplib2
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+MESSAGE_PATH = re.compile(r'^/gmail/v1/users/me/messages/([^/?]+)$')
+ATTACHMENT_PATH = re.compile(r'^/gmail/v1/users/me/messages/([^/?]+)/attachments/([^/?]+)$')
+LOGO_BYTES = 40 * 1024
+
+
+def make_message(msg_id):
+    return {
+        'id': msg_id,
+        'threadId': f"t{msg_id}",
+        'labelIds': ['INBOX', 'UNREAD'],
+        'snippet': f"Stub message {msg_id} about the quarterly meeting",
+        'sizeEstimate': 2048,
+        'payload': {
+            'headers': [
+                {'name': 'From', 'value': f"Sender {msg_id} <sender{msg_id}@example.com>"},
+                {'name': 'Subject', 'value': f"Subject {msg_id}"},
+                {'name': 'Date', 'value': 'Tue, 15 Apr 2025 10:00:00 +0000'},
+            ]
+        }
+    }
+
+
+def attachment_content(kind, msg_id, size):
+    """Deterministic attachment bytes; the logo is identical across messages"""
+    if kind == 'logo':
+        return random.Random('logo').randbytes(LOGO_BYTES)
+    return random.Random(f"{kind}-{msg_id}").randbytes(size)
+
+
+def attachment_response(server, kind, msg_id):
+    """Encoded attachments.get response body, built once per attachment so serving it
+    doesn't allocate (keeps the stub out of client-side memory measurements)"""
+    key = (kind, msg_id)
+    with server.attachment_lock:
+        if key not in server.attachment_cache:
+            data = attachment_content(kind, msg_id, server.attachment_bytes)
+            server.attachment_cache[key] = json.dumps(
+                {'size': len(data), 'data': base64.urlsafe_b64encode(data).decode()}
+            ).encode()
+        return server.attachment_cache[key]
+
+
+def _attachment_part(part_id, kind, msg_id, filename, mime_type, size, generation):
+    return {
+        'partId': part_id,
+        'mimeType': mime_type,
+        'filename': filename,
+        'headers': [{'name': 'Content-Disposition', 'value': f'attachment; filename="{filename}"'}],
+        'body': {'size': size, 'attachmentId': f"{kind}.{msg_id}.{generation}"}
+    }
+
+
+def make_full_message(msg_id, body_bytes=20000, attachment_bytes=0, generation=0):
+    """make_message plus a text/plain body part (and attachments if requested), as returned for format='full'"""
+    message = make_message(msg_id)
+    line = f"Message {msg_id}: notes from the quarterly meeting, action items and the budget table.\n"
+    body = (line * (body_bytes // len(line) + 1))[:body_bytes]
+    message['payload']['mimeType'] = 'multipart/alternative'
+    message['payload']['parts'] = [{
+        'partId': '0',
+        'mimeType': 'text/plain',
+        'headers': [{'name': 'Content-Type', 'value': 'text/plain; charset="UTF-8"'}],
+        'body': {'size': len(body), 'data': base64.urlsafe_b64encode(body.encode()).decode()}
+    }]
+    if attachment_bytes:
+        message['payload']['mimeType'] = 'multipart/mixed'
+        message['payload']['parts'] += [
+            _attachment_part('1', 'logo', msg_id, 'logo.png', 'image/png', LOGO_BYTES, generation),
+            _attachment_part('2', 'report', msg_id, f"report-{msg_id}.pdf", 'application/pdf',
+                             attachment_bytes, generation),
+        ]
+    return message
+
+
+class GmailStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _count(self, endpoint):
+        with self.server.history_lock:
+            self.server.calls[endpoint] = self.server.calls.get(endpoint, 0) + 1
+
+    def _history(self, query):
+        start = int(query['startHistoryId'][0])
+        with self.server.history_lock:
+            if start < self.server.history_floor:
+                return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+            records = [record for record in self.server.history if int(record['id']) > start]
+            payload = {'historyId': str(self.server.history_id)}
+        if records:
+            payload['history'] = records
+        return 200, payload
+
+    def _get(self, path):
+        """Resolve a GET path to (status, payload)"""
+        parsed = urlparse(path)
+        if parsed.path == '/gmail/v1/users/me/profile':
+            self._count('profile')
+            return 200, {'emailAddress': self.server.email_address, 'historyId': str(self.server.history_id)}
+        if parsed.path == '/gmail/v1/users/me/history':
+            self._count('history')
+            return self._history(parse_qs(parsed.query))
+        if parsed.path == '/gmail/v1/users/me/messages':
+            query = parse_qs(parsed.query).get('q', [''])[0]
+            match = re.search(r'rfc822msgid:(\S+)', query)
+            if match:
+                with self.server.send_lock:
+                    ids = self.server.sent.get(match.group(1), [])
+                return 200, {'messages': [{'id': ids[0], 'threadId': ids[0]}]} if ids else {'resultSizeEstimate': 0}
+            count = int(parse_qs(parsed.query).get('maxResults', ['100'])[0])
+            count = min(count, self.server.message_count)
+            return 200, {'messages': [{'id': f"m{i}", 'threadId': f"tm{i}"} for i in range(count)]}
+        match = MESSAGE_PATH.match(parsed.path)
+        if match:
+            if parse_qs(parsed.query).get('format') == ['full']:
+                return 200, make_full_message(match.group(1), attachment_bytes=self.server.attachment_bytes,
+                                              generation=self.server.attachment_generation)
+            return 200, make_message(match.group(1))
+        match = ATTACHMENT_PATH.match(parsed.path)
+        if match:
+            kind, msg_id, generation = match.group(2).split('.')
+            if int(generation) != self.server.attachment_generation:
+                return 400, {'error': {'code': 400, 'message': 'Invalid attachment token'}}
+            return 200, attachment_response(self.server, kind, msg_id)
+        return 404, {'error': {'code': 404, 'message': 'Not found'}}
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        status, payload = self._get(self.path)
+        self._send_json(payload, status)
+
+    def _send(self, raw):
+        """Handle messages.send: (status, payload)"""
+        time.sleep(self.server.send_latency)
+        message = email.message_from_bytes(base64.urlsafe_b64decode(json.loads(raw)['raw']))
+        with self.server.send_lock:
+            if self.server.send_failures:
+                status = self.server.send_failures.pop(0)
+                return status, {'error': {'code': status, 'message': 'Injected failure'}}
+            gmail_id = f"sent{next(self.server.sent_ids)}"
+            self.server.sent.setdefault(message['Message-ID'], []).append(gmail_id)
+            if self.server.accept_then_fail:
+                self.server.accept_then_fail -= 1
+                return 503, {'error': {'code': 503, 'message': 'Backend error'}}
+        return 200, {'id': gmail_id, 'threadId': gmail_id, 'labelIds': ['SENT']}
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        raw = self.rfile.read(length).decode()
+        if urlparse(self.path).path == '/gmail/v1/users/me/watch':
+            self._count('watch')
+            time.sleep(self.server.latency)
+            expiration = int((time.time() + 7 * 86400) * 1000)
+            self._send_json({'historyId': str(self.server.history_id), 'expiration': str(expiration)})
+            return
+        if urlparse(self.path).path == '/gmail/v1/users/me/messages/send':
+            status, payload = self._send(raw)
+            self._send_json(payload, status)
+            return
+        if urlparse(self.path).path != '/batch':
+            self._send_json({'error': {'code': 404}}, 404)
+            return
+
+        time.sleep(self.server.latency)
+        boundary = self.headers.get_param('boundary')
+        parts = [p for p in raw.split(f"--{boundary}") if 'Content-ID' in p]
+
+        out_boundary = 'stub_batch_boundary'
+        chunks = []
+        for part in parts:
+            content_id = re.search(r'Content-ID:\s*<([^>]+)>', part).group(1)
+            request_line = re.search(r'^(GET|POST) (\S+) HTTP/1.1', part, re.M)
+            time.sleep(self.server.per_item_latency)
+            status, payload = self._get(request_line.group(2))
+            reason = 'OK' if status == 200 else 'Not Found'
+            chunks.append(
+                f"--{out_boundary}\r\n"
+                f"Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {reason}\r\n"
+                f"Content-Type: application/json\r\n\r\n"
+                f"{json.dumps(payload)}\r\n"
+            )
+        chunks.append(f"--{out_boundary}--\r\n")
+        body = ''.join(chunks).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', f'multipart/mixed; boundary={out_boundary}')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub_server(message_count=500, latency=0.02, per_item_latency=0.0005, attachment_bytes=0):
+    """Start the stub server on a free port in a daemon thread"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), GmailStubHandler)
+    server.attachment_bytes = attachment_bytes
+    server.attachment_generation = 0
+    server.attachment_cache = {}
+    server.attachment_lock = threading.Lock()
+    server.message_count = message_count
+    server.latency = latency
+    server.per_item_latency = per_item_latency
+    server.send_latency = latency
+    server.send_lock = threading.Lock()
+    server.sent = {}
+    server.sent_ids = itertools.count()
+    server.send_failures = []
+    server.accept_then_fail = 0
+    server.email_address = 'assistant@example.com'
+    server.history_lock = threading.Lock()
+    server.history_id = server.history_floor = 1000
+    server.history = []
+    server.calls = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def add_history_message(server, msg_id, history_id=None):
+    """Deliver an unread inbox message; returns the historyId recording it"""
+    with server.history_lock:
+        server.history_id = max(server.history_id + 1, history_id or 0)
+        server.history.append({
+            'id': str(server.history_id),
+            'messagesAdded': [{'message': {'id': msg_id, 'threadId': f"t{msg_id}", 'labelIds': ['INBOX', 'UNREAD']}}]
+        })
+        return server.history_id
+
+
+def build_stub_service(server):
+    """Build a Gmail discovery client whose rootUrl points at the stub server"""
+    doc = json.loads(get_static_doc('gmail', 'v1'))
+    doc['rootUrl'] = f"http://127.0.0.1:{server.server_address[1]}/"
+    return build_from_document(doc, http=httplib2.Http())
@@ -0,0 +1,124 @@
+"""
+Minimal local stand-in for the Groq (OpenAI-compatible) chat completions API.
+
+Every request sleeps for an injected latency, and a configurable fraction is
+answered with 429 so retry/backoff paths get exercised. Batched analysis
+prompts ("[id: N]" entries) get one result per id, with a configurable
+fraction of items left out to exercise split-and-retry. Streaming requests
+get the reply as server-sent chunks, one word every token_latency seconds;
+other requests wait for the same generation time before answering.
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANALYSIS = {
+    "category": "meeting",
+    "priority": 6,
+    "requires_action": True,
+    "action_type": "reply",
+    "key_topics": ["schedule"]
+}
+
+REPLY = (
+    "Thanks for your email. I have reviewed the proposal and the timeline looks workable. "
+    "Could we meet on Thursday at 2pm or Friday at 10am to go through the open questions? "
+    "I will bring the updated budget figures and the revised delivery plan. "
+    "Let me know which slot suits you and I will send an invite."
+)
+
+
+class LLMStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, request, content):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for index, word in enumerate(re.findall(r'\S+\s*', content)):
+            if index:
+                time.sleep(self.server.token_latency)
+            chunk = {
+                'id': 'chatcmpl-stub',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': request.get('model'),
+                'choices': [{'index': 0, 'delta': {'content': word}, 'finish_reason': None}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(self.server.latency)
+
+        if random.random() < self.server.rate_limit_fraction:
+            with self.server.lock:
+                self.server.rate_limited += 1
+            self._send(429, {'error': {'message': 'Rate limit reached', 'type': 'tokens'}},
+                       {'retry-after': '0.05'})
+            return
+
+        prompt = request['messages'][-1]['content']
+        json_mode = (request.get('response_format') or {}).get('type') == 'json_object'
+        batch_ids = re.findall(r'\[id: ([^\]]+)\]', prompt)
+        if json_mode and batch_ids:
+            results = [dict(ANALYSIS, id=i) for i in batch_ids if random.random() >= self.server.drop_fraction]
+            content = json.dumps({'results': results})
+        elif json_mode:
+            content = json.dumps(ANALYSIS)
+        else:
+            content = REPLY
+        if request.get('stream'):
+            self._stream(request, content)
+            return
+        # A non-streamed reply arrives only once every word has been generated
+        time.sleep(self.server.token_latency * max(0, len(content.split()) - 1))
+        self._send(200, {
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 100, 'completion_tokens': 40, 'total_tokens': 140}
+        })
+
+
+def start_llm_stub(latency=0.2, rate_limit_fraction=0.0, drop_fraction=0.0, token_latency=0.0):
+    """Start the stub on a free port in a daemon thread; returns the server (base URL in server.url)"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LLMStubHandler)
+    server.latency = latency
+    server.rate_limit_fraction = rate_limit_fraction
+    server.drop_fraction = drop_fraction
+    server.token_latency = token_latency
+    server.requests = 0
+    server.rate_limited = 0
+    server.lock = threading.Lock()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
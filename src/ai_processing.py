@@ -1,23 +1,74 @@
 import os
-from groq import Groq
+import time
+import logging
+from groq import Groq, RateLimitError
 from dotenv import load_dotenv
 import json
-from typing import Dict, Any
+from typing import Callable, Dict, Any, Iterator, List, Optional, Tuple
+from src import llm_cache
+from src.storage import FALLBACK_MODEL
+from src.preclassifier import keyword_classes, priority_from_classes
+from src.tokenizer import count_tokens, truncate_to_tokens
+from src.rate_limit import llm_limiter, estimate_tokens, backoff_delay
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-client = Groq(api_key=GROQ_API_KEY)
+# Retries are handled in _complete so they go through the shared rate limiter
+client = Groq(api_key=GROQ_API_KEY, max_retries=0)
+MODEL = "llama3-8b-8192"
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 4))
+DEFAULT_COMPLETION_TOKENS = 256  # Token estimate for calls without max_tokens
+REPLY_TEMPERATURE = 0.7
+REPLY_MAX_TOKENS = 500
 
-def generate_reply(subject: str, context: str) -> str:
-    """Generate a thoughtful email reply using LLM with improved context handling."""
-    prompt = f"""
+
+def _retry_after(error: RateLimitError) -> float:
+    try:
+        return float(error.response.headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _complete(prompt: str, temperature: float, model: str = MODEL,
+              validate: Optional[Callable[[str], Any]] = None, **params) -> str:
+    """
+    Run a single-prompt chat completion through the response cache and rate limiter.
+    validate: raises ValueError for a reply that must not be cached (see llm_cache.cached_completion)
+    """
+    def compute():
+        estimated = estimate_tokens(prompt, params.get("max_tokens", DEFAULT_COMPLETION_TOKENS))
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            llm_limiter.acquire(estimated)
+            try:
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=temperature,
+                    **params
+                )
+                return response.choices[0].message.content
+            except RateLimitError as e:
+                if attempt == LLM_MAX_RETRIES:
+                    raise
+                time.sleep(max(_retry_after(e), backoff_delay(attempt)))
+
+    return llm_cache.cached_completion(model, prompt, temperature, compute, validate=validate, **params)
+
+
+def _reply_prompt(subject: str, context: str, examples: str = "") -> str:
+    # Without examples the prompt is unchanged, so earlier cached replies still match
+    examples_section = f"""
+    - Replies we sent to similar emails before (reuse their facts and tone where they apply, don't copy them):
+    {examples}""" if examples else ""
+    return f"""
     You are an AI email assistant helping manage emails. Your task is to compose a professional reply.
     
     Context:
     - Email Subject: {subject}
     - Full Conversation Thread:
-    {context}
+    {context}{examples_section}
     
     Instructions:
     1. Analyze the entire conversation thread
@@ -30,40 +81,109 @@ def generate_reply(subject: str, context: str) -> str:
     
     Format your response as plain text (no markdown).
     """
-    
+
+
+def generate_reply(subject: str, context: str, examples: str = "") -> str:
+    """Generate a thoughtful email reply using LLM with improved context handling."""
+    prompt = _reply_prompt(subject, context, examples)
     try:
-        response = client.chat.completions.create(
-            model="llama3-8b-8192",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=500
-        )
-        return response.choices[0].message.content.strip()
+        content = _complete(prompt, temperature=REPLY_TEMPERATURE, max_tokens=REPLY_MAX_TOKENS)
+        return content.strip()
     except Exception as e:
         print(f"Error generating reply: {e}")
         return "I encountered an error generating a reply. Please try again later."
 
 
+def stream_reply(subject: str, context: str, examples: str = "") -> Iterator[str]:
+    """
+    Same reply as generate_reply, yielded piece by piece as the model produces it.
+    Uses the same cache entry as generate_reply: a cached reply is yielded in one
+    piece, and a finished stream is stored for later calls. Errors are raised to
+    the caller, which has already sent part of the reply.
+    """
+    prompt = _reply_prompt(subject, context, examples)
+    params = {"max_tokens": REPLY_MAX_TOKENS}
+    key = None
+    if llm_cache.is_cacheable(REPLY_TEMPERATURE):
+        key = llm_cache.make_key(MODEL, prompt, REPLY_TEMPERATURE, **params)
+        cached = llm_cache.lookup(key)
+        if cached is not None:
+            yield cached.strip()
+            return
+
+    # Rate limit retries are only possible before the first token is sent
+    estimated = estimate_tokens(prompt, REPLY_MAX_TOKENS)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        llm_limiter.acquire(estimated)
+        try:
+            stream = client.chat.completions.create(
+                model=MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=REPLY_TEMPERATURE,
+                stream=True,
+                **params
+            )
+            break
+        except RateLimitError as e:
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            time.sleep(max(_retry_after(e), backoff_delay(attempt)))
+
+    parts = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        text = chunk.choices[0].delta.content
+        if text:
+            # Leading whitespace is dropped to match generate_reply's strip()
+            if not parts:
+                text = text.lstrip()
+                if not text:
+                    continue
+            parts.append(text)
+            yield text
+
+    if key is not None:
+        llm_cache.store(key, MODEL, "".join(parts))
+
+
+def summarize_email(email_text: str, max_words: int = 40) -> str:
+    """One or two sentence summary of an email, used for older messages in long threads."""
+    prompt = f"""
+    Summarize this email in at most {max_words} words. Keep names, dates, decisions and open questions.
+    Return only the summary as plain text.
+
+    Email Content:
+    {email_text}
+    """
+    # Temperature 0 keeps the summary deterministic so the response cache reuses it
+    content = _complete(prompt, temperature=0.0, max_tokens=max_words * 2)
+    return content.strip()
+
+
 def calculate_priority_manually(email_text: str) -> int:
     """Basic keyword-based fallback priority logic."""
-    email_text = email_text.lower()
-
-    if "urgent" in email_text or "asap" in email_text or "immediately" in email_text:
-        return 9
-    elif "please respond" in email_text or "awaiting your response" in email_text:
-        return 8
-    elif "meeting" in email_text or "schedule" in email_text:
-        return 7
-    elif "reminder" in email_text:
-        return 6
-    elif "fyi" in email_text or "for your information" in email_text:
-        return 3
-    else:
-        return 5
+    return priority_from_classes(keyword_classes(email_text))
+
+
+def _parse_analysis(content: str) -> Dict[str, Any]:
+    """analyze_email's reply as a dict; raises ValueError if it is not one."""
+    analysis = json.loads(content)
+    if not isinstance(analysis, dict):
+        raise ValueError(f"Expected a JSON object, got {type(analysis).__name__}")
+    priority = analysis.get("priority", 0)
+    if isinstance(priority, str) and priority.strip().isdigit():
+        analysis["priority"] = int(priority)
+    elif not isinstance(priority, (int, float)) or isinstance(priority, bool):
+        raise ValueError(f"Priority is not a number: {priority!r}")
+    return analysis
 
 
 def analyze_email(email_text: str) -> Dict[str, Any]:
-    """Analyze email content for priority, category, and action items."""
+    """
+    Analyze email content for priority, category, and action items.
+    If the LLM call fails, returns a keyword-based guess with model set to FALLBACK_MODEL.
+    """
     prompt = f"""
     Analyze this email and return JSON with:
     - category (meeting, question, task, general)
@@ -79,14 +199,10 @@ def analyze_email(email_text: str) -> Dict[str, Any]:
     """
     
     try:
-        response = client.chat.completions.create(
-            model="llama3-8b-8192",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3,
-            response_format={"type": "json_object"}
-        )
-
-        analysis = json.loads(response.choices[0].message.content)
+        content = _complete(prompt, temperature=0.3, response_format={"type": "json_object"},
+                            validate=_parse_analysis)
+        analysis = _parse_analysis(content)
+        analysis.pop("model", None)  # Reserved for marking fallback guesses
 
         # Fallback priority logic if not present or too low/confusing
         model_priority = analysis.get("priority", 0)
@@ -102,9 +218,145 @@ def analyze_email(email_text: str) -> Dict[str, Any]:
             "priority": calculate_priority_manually(email_text),
             "requires_action": False,
             "action_type": "none",
-            "key_topics": []
+            "key_topics": [],
+            "model": FALLBACK_MODEL
         }
 
 
+ANALYSIS_CATEGORIES = {"meeting", "question", "task", "general"}
+ANALYSIS_ACTION_TYPES = {"reply", "schedule", "forward", "none"}
+BATCH_TOKEN_BUDGET = int(os.getenv("BATCH_TOKEN_BUDGET", 6000))  # Prompt + completion, under the 8k window
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 20))
+BATCH_ITEM_MAX_TOKENS = 400      # Longer emails are truncated inside a batch prompt
+BATCH_OUTPUT_TOKENS_PER_ITEM = 80
+
+BATCH_PROMPT_HEADER = """
+    Analyze each email below. Return a JSON object of the form
+    {"results": [{"id": "<email id>", "category": ..., "priority": ..., "requires_action": ...,
+    "action_type": ..., "key_topics": [...]}, ...]}
+    with exactly one entry per email id, where:
+    - category (meeting, question, task, general)
+    - priority (1-10)
+    - requires_action (boolean)
+    - action_type (reply, schedule, forward, none)
+    - key_topics (array of strings)
+
+    Emails:
+    """
+
+
+def validate_analysis(item: Any) -> Optional[Dict[str, Any]]:
+    """Check one analysis against the analyze_email schema; returns the cleaned dict or None."""
+    if not isinstance(item, dict):
+        return None
+    priority = item.get("priority")
+    if isinstance(priority, str) and priority.strip().isdigit():
+        priority = int(priority)
+    if not isinstance(priority, int) or isinstance(priority, bool) or not 1 <= priority <= 10:
+        return None
+    if item.get("category") not in ANALYSIS_CATEGORIES or item.get("action_type") not in ANALYSIS_ACTION_TYPES:
+        return None
+    if not isinstance(item.get("requires_action"), bool):
+        return None
+    topics = item.get("key_topics", [])
+    if not isinstance(topics, list) or not all(isinstance(t, str) for t in topics):
+        return None
+    return {
+        "category": item["category"],
+        "priority": priority,
+        "requires_action": item["requires_action"],
+        "action_type": item["action_type"],
+        "key_topics": topics
+    }
+
 
+def _batch_entry(key: str, text: str) -> str:
+    return f"\n    [id: {key}]\n    {text}\n"
 
+
+def pack_batches(emails: List[Tuple[str, str]], token_budget: int = BATCH_TOKEN_BUDGET,
+                 max_items: int = BATCH_MAX_ITEMS) -> List[List[Tuple[str, str]]]:
+    """
+    Group (id, text) pairs into batches whose prompt plus expected output fits token_budget.
+    Texts are truncated to BATCH_ITEM_MAX_TOKENS first.
+    """
+    header_tokens = count_tokens(BATCH_PROMPT_HEADER)
+    batches, current, used = [], [], header_tokens
+    for email_id, text in emails:
+        text = truncate_to_tokens(text or "", BATCH_ITEM_MAX_TOKENS)
+        cost = count_tokens(_batch_entry(email_id, text)) + BATCH_OUTPUT_TOKENS_PER_ITEM
+        if current and (used + cost > token_budget or len(current) >= max_items):
+            batches.append(current)
+            current, used = [], header_tokens
+        current.append((email_id, text))
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _parse_batch(content: str) -> List[Any]:
+    """The results list of a batch reply; raises ValueError if the reply has no such list."""
+    parsed = json.loads(content)
+    items = parsed.get("results") if isinstance(parsed, dict) else None
+    if not isinstance(items, list):
+        raise ValueError("Batch reply has no results list")
+    return items
+
+
+def _analyze_batch_once(batch: List[Tuple[str, str]]) -> Dict[str, Dict[str, Any]]:
+    """One LLM call for the batch; returns only the items whose result passed validation."""
+    keys = {str(i + 1): email_id for i, (email_id, _) in enumerate(batch)}
+    prompt = BATCH_PROMPT_HEADER + "".join(
+        _batch_entry(str(i + 1), text) for i, (_, text) in enumerate(batch)
+    ) + "\n    Return ONLY valid JSON:\n    "
+
+    content = _complete(prompt, temperature=0.3, response_format={"type": "json_object"},
+                        max_tokens=BATCH_OUTPUT_TOKENS_PER_ITEM * len(batch) + 50, validate=_parse_batch)
+
+    results = {}
+    for item in _parse_batch(content):
+        key = str(item.get("id")) if isinstance(item, dict) else None
+        analysis = validate_analysis(item)
+        if key in keys and analysis is not None:
+            results[keys[key]] = analysis
+    return results
+
+
+def _analyze_batch(batch: List[Tuple[str, str]], results: Dict[str, Dict[str, Any]]) -> None:
+    """Analyze a batch into results; raises if the LLM call itself fails."""
+    if len(batch) == 1:
+        email_id, text = batch[0]
+        results[email_id] = analyze_email(text)
+        return
+
+    results.update(_analyze_batch_once(batch))
+
+    # Split whatever came back missing or invalid in half and retry only those.
+    # A failed call is not split: smaller batches would fail the same way, just more often.
+    failed = [entry for entry in batch if entry[0] not in results]
+    if failed:
+        middle = (len(failed) + 1) // 2
+        for part in (failed[:middle], failed[middle:]):
+            if part:
+                _analyze_batch(part, results)
+
+
+def analyze_emails_batch(emails: List[Tuple[str, str]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Analyze many emails with as few LLM calls as possible.
+    emails: (id, text) pairs. Returns id -> analysis in the analyze_email schema;
+    items the batched prompt gets wrong are retried in smaller batches and
+    finally one at a time through analyze_email. Stops at the first LLM call
+    that fails outright (network error, 5xx, unparseable reply): emails missing
+    from the result were not analyzed.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    for batch in pack_batches(emails):
+        try:
+            _analyze_batch(batch, results)
+        except Exception as e:
+            logger.error(f"Error analyzing batch of {len(batch)} emails, "
+                         f"leaving {len(emails) - len(results)} unanalyzed: {e}")
+            break
+    return results
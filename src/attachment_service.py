@@ -0,0 +1,68 @@
+import logging
+from requests import HTTPError
+from src import attachment_store
+from src.email_service import get_email_details, get_message_payload, stream_attachment
+from src.mime_parser import list_attachments
+from src.storage import get_attachments, get_attachment, set_attachment_content, store_attachments
+from src.utils import KeyedLocks
+
+logger = logging.getLogger(__name__)
+
+# One lock per attachment being downloaded, so concurrent requests share a download
+_inflight = KeyedLocks()
+
+
+def list_message_attachments(message_id):
+    """Attachments of a message, recording them from Gmail if the message was never opened"""
+    attachments = get_attachments(message_id)
+    if not attachments and get_email_details(message_id):
+        attachments = get_attachments(message_id)
+    return attachments
+
+
+def _refreshed_part(message_id, part_id):
+    """Re-read the message so its attachment ids are current; returns the part or None"""
+    attachments = list_attachments(get_message_payload(message_id).get('payload', {}))
+    store_attachments(message_id, attachments)
+    return next((a for a in attachments if a['part_id'] == part_id), None)
+
+
+def _download(message_id, part_id, attachment_id):
+    if attachment_id:
+        try:
+            return attachment_store.write_stream(stream_attachment(message_id, attachment_id))
+        except HTTPError as e:
+            # Attachment ids expire; anything but a 4xx is a real failure
+            if e.response is None or not 400 <= e.response.status_code < 500:
+                raise
+            logger.info(f"Attachment id for {message_id}/{part_id} is stale, refreshing")
+
+    part = _refreshed_part(message_id, part_id)
+    if part is None:
+        raise LookupError(f"Attachment {part_id} no longer exists in {message_id}")
+    if part['attachment_id']:
+        return attachment_store.write_stream(stream_attachment(message_id, part['attachment_id']))
+    # Small parts can come inline in the message instead of behind an attachment id
+    return attachment_store.write_stream(attachment_store.decode_base64_stream([part['data'] or '']))
+
+
+def open_attachment(message_id, part_id):
+    """
+    Attachment row with file_path pointing at its content, downloading it on first use
+    Returns None if the message has no such part.
+    """
+    attachment = get_attachment(message_id, part_id)
+    if attachment is None and get_email_details(message_id):
+        attachment = get_attachment(message_id, part_id)
+    if attachment is None:
+        return None
+    if attachment_store.exists(attachment['sha256']):
+        return attachment
+
+    with _inflight.hold((message_id, part_id)):
+        attachment = get_attachment(message_id, part_id)
+        if not attachment_store.exists(attachment['sha256']):
+            sha256, size = _download(message_id, part_id, attachment['gmail_attachment_id'])
+            set_attachment_content(message_id, part_id, sha256, attachment_store.path_for(sha256), size)
+            attachment = get_attachment(message_id, part_id)
+        return attachment
@@ -0,0 +1,78 @@
+import os
+import base64
+import hashlib
+import logging
+import tempfile
+from typing import Iterable, Iterator, Tuple
+from dotenv import load_dotenv
+from src.utils import Counters
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Files are stored once per distinct content under <dir>/<aa>/<bb>/<sha256>, so a
+# logo or signature image repeated across emails takes one file
+ATTACHMENT_DIR = os.getenv("ATTACHMENT_DIR", "attachments")
+CHUNK_SIZE = 256 * 1024  # Bytes decoded and written per step
+
+store_stats = Counters('written', 'deduplicated', 'bytes_written')
+
+
+def get_attachment_store_stats():
+    return store_stats.snapshot()
+
+
+def path_for(sha256: str) -> str:
+    return os.path.join(ATTACHMENT_DIR, sha256[:2], sha256[2:4], sha256)
+
+
+def exists(sha256: str) -> bool:
+    return bool(sha256) and os.path.exists(path_for(sha256))
+
+
+def decode_base64_stream(chunks: Iterable[str]) -> Iterator[bytes]:
+    """Decode base64url text arriving in arbitrary pieces without joining it first"""
+    pending = ''
+    for chunk in chunks:
+        pending += chunk
+        usable = len(pending) - len(pending) % 4
+        if usable:
+            yield base64.urlsafe_b64decode(pending[:usable])
+            pending = pending[usable:]
+    if pending.rstrip('='):
+        yield base64.urlsafe_b64decode(pending + '=' * (-len(pending) % 4))
+
+
+def write_stream(chunks: Iterable[bytes]) -> Tuple[str, int]:
+    """
+    Write content to the store while hashing it
+    The data goes to a temporary file first and is renamed into place, so readers
+    never see a partial file; content already stored is not written twice.
+    Returns: (sha256 hex digest, size in bytes)
+    """
+    os.makedirs(ATTACHMENT_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=ATTACHMENT_DIR, prefix='.incoming-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+
+        sha256 = digest.hexdigest()
+        final_path = path_for(sha256)
+        if os.path.exists(final_path):
+            os.remove(temp_path)
+            store_stats.add('deduplicated')
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(temp_path, final_path)
+            store_stats.add('written')
+            store_stats.add('bytes_written', size)
+        return sha256, size
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,124 @@
+import os
+import re
+import logging
+from concurrent.futures import Executor
+from typing import Dict, Any, List, Optional, Tuple
+from dotenv import load_dotenv
+from src.ai_processing import summarize_email
+from src.tokenizer import count_tokens, truncate_to_tokens
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Thread context has to fit beside the prompt template and the 500-token reply
+# inside llama3-8b-8192's 8k window
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+CONTEXT_VERBATIM_MESSAGES = int(os.getenv("CONTEXT_VERBATIM_MESSAGES", 3))  # Newest messages kept as-is in an overflowing thread
+CONTEXT_MAX_SUMMARIES = int(os.getenv("CONTEXT_MAX_SUMMARIES", 5))  # Older ones beyond this are dropped
+SUMMARY_MIN_TOKENS = 40  # Don't ask for a summary that can't fit in what's left
+REPLY_EXAMPLE_TOKENS = int(os.getenv("REPLY_EXAMPLE_TOKENS", 200))  # Per past reply shown to the model
+
+# Lines where quoted history or a forwarded copy begins; everything after is dropped
+QUOTE_HEADER = re.compile(
+    r"^(?:On .{0,200}wrote:\s*$"
+    r"|-{2,}\s*Original Message\s*-{2,}"
+    r"|-{2,}\s*Forwarded message\s*-{2,}"
+    r"|From: .+\n(?:Sent|Date): )",
+    re.IGNORECASE | re.MULTILINE
+)
+# Signature delimiter ("-- ") and common mobile footers
+SIGNATURE = re.compile(
+    r"^(?:--\s*$|Sent from my \w+|Get Outlook for \w+)",
+    re.IGNORECASE | re.MULTILINE
+)
+
+
+def clean_body(text: str) -> str:
+    """Remove quoted replies, forwarded history and the signature from an email body"""
+    if not text:
+        return ""
+    match = QUOTE_HEADER.search(text)
+    if match:
+        text = text[:match.start()]
+    match = SIGNATURE.search(text)
+    if match:
+        text = text[:match.start()]
+    lines = [line for line in text.splitlines() if not line.lstrip().startswith(">")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def _format(email: Dict[str, Any], body: str, summarized: bool = False) -> str:
+    label = " (earlier message, summarized)" if summarized else ""
+    return f"From: {email.get('sender')}{label}\nSubject: {email.get('subject')}\n{body}"
+
+
+def _summary(body: str) -> str:
+    try:
+        return summarize_email(body)
+    except Exception as e:
+        logger.warning(f"Could not summarize thread message: {e}")
+        return truncate_to_tokens(body, 60)
+
+
+def build_thread_context(thread_emails: List[Dict[str, Any]], token_budget: int = CONTEXT_TOKEN_BUDGET,
+                         executor: Optional[Executor] = None) -> Tuple[str, Dict[str, int]]:
+    """
+    Build the conversation context for generate_reply within token_budget.
+    thread_emails: stored emails, oldest first (as returned by get_email_thread)
+    A thread that fits is used verbatim. Otherwise the newest messages are kept
+    verbatim, older ones are replaced by cached LLM summaries, and anything that
+    still doesn't fit is dropped.
+    executor: runs the summary calls concurrently; without one they run in turn
+    Returns: (context string, token accounting for the action log)
+    """
+    stats = {'messages': len(thread_emails), 'verbatim': 0, 'summarized': 0, 'dropped': 0}
+    messages = [(email, clean_body(email.get('body') or '')) for email in reversed(thread_emails)]
+
+    entries = [_format(email, body) for email, body in messages]
+    used = sum(count_tokens(entry) for entry in entries)
+    if used <= token_budget:
+        stats.update(verbatim=len(entries), context_tokens=used)
+        return "\n\n".join(reversed(entries)), stats
+
+    entries, used = [], 0
+    for email, body in messages[:CONTEXT_VERBATIM_MESSAGES]:
+        remaining = token_budget - used
+        entry = _format(email, body)
+        tokens = count_tokens(entry)
+        if not entries and tokens > remaining:
+            # The newest message is always included, cut to the budget if necessary
+            entry = truncate_to_tokens(entry, remaining)
+            tokens = min(count_tokens(entry), remaining)
+        if tokens > remaining:
+            break
+        entries.append(entry)
+        used += tokens
+    stats['verbatim'] = len(entries)
+
+    older = messages[len(entries):]
+    wanted = [] if token_budget - used < SUMMARY_MIN_TOKENS else [
+        i for i, (_, body) in enumerate(older) if body][:CONTEXT_MAX_SUMMARIES]
+    summaries = dict(zip(wanted, (executor.map if executor else map)(_summary, [older[i][1] for i in wanted])))
+
+    for i, (email, _) in enumerate(older):
+        remaining = token_budget - used
+        if i in summaries and remaining >= SUMMARY_MIN_TOKENS:
+            entry = _format(email, summaries[i], summarized=True)
+            tokens = count_tokens(entry)
+            if tokens <= remaining:
+                entries.append(entry)
+                used += tokens
+                stats['summarized'] += 1
+                continue
+        stats['dropped'] += 1
+
+    stats['context_tokens'] = used
+    return "\n\n".join(reversed(entries)), stats
+
+
+def format_reply_examples(similar: List[Dict[str, Any]], max_tokens: int = REPLY_EXAMPLE_TOKENS) -> str:
+    """Past replies (from find_similar_replies) as prompt text, each cut to max_tokens"""
+    return "\n\n".join(
+        f"Re: {entry.get('subject')}\n{truncate_to_tokens(clean_body(entry.get('reply') or ''), max_tokens)}"
+        for entry in similar
+    )
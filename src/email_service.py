@@ -1,15 +1,25 @@
 import base64
 import email
 import os
-import json
+import re
 import logging
+import threading
+import time
 from email.utils import parseaddr
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import httplib2
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from google.auth.transport.requests import Request
+from googleapiclient.http import HttpRequest
+from google.auth.transport.requests import AuthorizedSession, Request
 from dotenv import load_dotenv
+from src import message_cache
+from src.mime_parser import extract_body, list_attachments, PARSER_VERSION
+from src.attachment_store import decode_base64_stream
+from src.storage import store_attachments, get_replied_ids, mark_replied
+from src.utils import Counters
 
 # Initialize logging and environment
 load_dotenv()
@@ -21,102 +31,209 @@ GMAIL_CLIENT_SECRET = os.getenv("GMAIL_CLIENT_SECRET")
 GMAIL_REFRESH_TOKEN = os.getenv("GMAIL_REFRESH_TOKEN")
 BOT_EMAIL = os.getenv("BOT_EMAIL")
 MAX_EMAIL_SIZE = 10 * 1024 * 1024  # 10MB
-REPLIED_EMAILS_FILE = "replied_emails.json"
 MAX_RESULTS = 25  # Default number of emails to fetch
+BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", 50))  # Gmail allows up to 100 calls per batch
+BATCH_MAX_RETRIES = 2
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# List-*/Precedence/Auto-Submitted let the local pre-classifier spot bulk mail
+METADATA_HEADERS = ['From', 'Subject', 'Date', 'List-Unsubscribe', 'List-Id', 'Precedence', 'Auto-Submitted']
+TOKEN_REFRESH_MARGIN = 300  # Refresh the access token this many seconds before expiry
+ATTACHMENT_READ_SIZE = 64 * 1024  # Bytes of the attachments().get response read per step
+ATTACHMENT_TIMEOUT = 60
 
-def load_replied_emails():
-    """Load list of already replied emails from JSON file"""
-    try:
-        if os.path.exists(REPLIED_EMAILS_FILE):
-            with open(REPLIED_EMAILS_FILE, 'r') as f:
-                return json.load(f)
-        return []
-    except Exception as e:
-        logger.error(f"Error loading replied emails: {str(e)}")
-        return []
+# Process-wide Gmail client. The discovery client and credentials are shared;
+# each thread gets its own httplib2 transport since httplib2 is not thread-safe.
+_service = None
+_credentials = None
+_client_lock = threading.Lock()
+_thread_local = threading.local()
+client_stats = Counters('builds', 'cache_hits', 'token_refreshes', 'transports')
 
-def save_replied_email(email_id):
-    """Save email ID to prevent duplicate replies"""
-    try:
-        replied_emails = load_replied_emails()
-        if email_id not in replied_emails:
-            replied_emails.append(email_id)
-            with open(REPLIED_EMAILS_FILE, 'w') as f:
-                json.dump(replied_emails, f)
-    except Exception as e:
-        logger.error(f"Error saving replied email: {str(e)}")
+def get_gmail_client_stats():
+    """Snapshot of the Gmail client cache counters"""
+    return client_stats.snapshot()
+
+def _token_is_fresh():
+    expiry = _credentials.expiry
+    if not _credentials.token or expiry is None:
+        return False
+    now = datetime.now(timezone.utc).replace(tzinfo=None)  # google-auth uses naive UTC
+    return expiry - now > timedelta(seconds=TOKEN_REFRESH_MARGIN)
+
+def _ensure_fresh_credentials():
+    """Refresh the shared access token only when it is close to expiring"""
+    if _token_is_fresh():
+        return
+    with _client_lock:
+        if not _token_is_fresh():
+            _credentials.refresh(Request())
+            client_stats.add('token_refreshes')
+
+def _thread_http():
+    """Authorized transport owned by the calling thread"""
+    http = getattr(_thread_local, 'http', None)
+    if http is None:
+        http = AuthorizedHttp(_credentials, http=httplib2.Http())
+        _thread_local.http = http
+        client_stats.add('transports')
+    return http
+
+def _thread_session():
+    """requests session with the shared credentials, owned by the calling thread (used for streaming)"""
+    session = getattr(_thread_local, 'session', None)
+    if session is None:
+        session = AuthorizedSession(_credentials)
+        _thread_local.session = session
+        client_stats.add('transports')
+    return session
+
+def _build_request(http, *args, **kwargs):
+    _ensure_fresh_credentials()
+    return HttpRequest(_thread_http(), *args, **kwargs)
 
 def authenticate_gmail():
-    """Authenticate and return Gmail service with automatic token refresh"""
+    """Return the shared Gmail service, building it and its credentials on first use"""
+    global _service, _credentials
+    if _service is not None:
+        client_stats.add('cache_hits')
+        return _service
+
     try:
-        creds = Credentials.from_authorized_user_info({
-            "client_id": GMAIL_CLIENT_ID,
-            "client_secret": GMAIL_CLIENT_SECRET,
-            "refresh_token": GMAIL_REFRESH_TOKEN,
-            "token_uri": "https://oauth2.googleapis.com/token"
-        })
-        
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        
-        return build('gmail', 'v1', credentials=creds)
+        with _client_lock:
+            if _service is None:
+                _credentials = Credentials.from_authorized_user_info({
+                    "client_id": GMAIL_CLIENT_ID,
+                    "client_secret": GMAIL_CLIENT_SECRET,
+                    "refresh_token": GMAIL_REFRESH_TOKEN,
+                    "token_uri": "https://oauth2.googleapis.com/token"
+                })
+                _service = build(
+                    'gmail', 'v1',
+                    http=AuthorizedHttp(_credentials, http=httplib2.Http()),
+                    requestBuilder=_build_request
+                )
+                client_stats.add('builds')
+            else:
+                client_stats.add('cache_hits')
+        return _service
     except Exception as e:
         logger.error(f"Authentication failed: {str(e)}")
         raise
 
+def parse_message_metadata(msg_data):
+    """Convert a Gmail metadata response into the email dictionary used across the app"""
+    headers = {h['name'].lower(): h['value'] for h in msg_data.get('payload', {}).get('headers', [])}
+    return {
+        'id': msg_data['id'],
+        'threadId': msg_data['threadId'],
+        'from': parseaddr(headers.get('from', ''))[1] or headers.get('from', ''),
+        'subject': headers.get('subject', 'No Subject'),
+        'date': headers.get('date', datetime.now().isoformat()),
+        'snippet': msg_data.get('snippet', ''),
+        'labelIds': msg_data.get('labelIds', []),
+        'headers': headers
+    }
+
+def fetch_message_metadata(service, message_ids, batch_size=BATCH_SIZE, failed=None):
+    """
+    Fetch metadata for many messages using Gmail batch requests
+    Returns: Dict mapping message id to the raw Gmail response. Messages that
+    failed (after retrying rate-limited/5xx items) are logged and left out.
+    failed: optional list that collects those ids, except messages Gmail no longer has (404)
+    """
+    results = {}
+    pending = list(message_ids)
+    batch_size = max(1, min(int(batch_size), 100))
+
+    for attempt in range(BATCH_MAX_RETRIES + 1):
+        retry = []
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                results[request_id] = response
+                return
+            status = getattr(getattr(exception, 'resp', None), 'status', None)
+            if status in RETRYABLE_STATUSES and attempt < BATCH_MAX_RETRIES:
+                retry.append(request_id)
+            else:
+                logger.error(f"Error fetching metadata for email {request_id}: {exception}")
+                if failed is not None and status != 404:
+                    failed.append(request_id)
+
+        for start in range(0, len(pending), batch_size):
+            batch = service.new_batch_http_request(callback=callback)
+            for msg_id in pending[start:start + batch_size]:
+                batch.add(
+                    service.users().messages().get(
+                        userId='me',
+                        id=msg_id,
+                        format='metadata',
+                        metadataHeaders=METADATA_HEADERS
+                    ),
+                    request_id=msg_id
+                )
+            try:
+                batch.execute()
+            except HttpError as error:
+                # The whole batch call failed; every item in it is retried together
+                if error.resp.status not in RETRYABLE_STATUSES or attempt >= BATCH_MAX_RETRIES:
+                    raise
+                retry.extend(m for m in pending[start:start + batch_size] if m not in results)
+
+        if not retry:
+            break
+        logger.warning(f"Retrying {len(retry)} rate-limited metadata requests")
+        time.sleep(2 ** attempt)
+        pending = retry
+
+    return results
+
+def list_unread_emails(service, max_results=MAX_RESULTS):
+    """
+    List recent unread inbox emails, raising on Gmail API errors
+    Returns: (email dictionaries, set of every listed message id, ids whose metadata
+    could not be fetched)
+    """
+    result = service.users().messages().list(
+        userId='me',
+        maxResults=max_results,
+        q="is:inbox -from:me is:unread",
+        labelIds=['INBOX']
+    ).execute()
+
+    messages = result.get('messages', [])
+    listed = {msg['id'] for msg in messages}
+    replied = get_replied_ids(list(listed))
+    messages = [msg for msg in messages if msg['id'] not in replied]
+    failed = []
+    metadata = fetch_message_metadata(service, [msg['id'] for msg in messages], failed=failed)
+    emails = []
+
+    for msg in messages:
+        msg_data = metadata.get(msg['id'])
+        if msg_data is None:
+            continue
+
+        try:
+            # Skip large emails
+            if int(msg_data.get('sizeEstimate', 0)) > MAX_EMAIL_SIZE:
+                continue
+
+            emails.append(parse_message_metadata(msg_data))
+
+        except Exception as e:
+            logger.error(f"Error processing email {msg['id']}: {str(e)}")
+            continue
+
+    return emails, listed, failed
+
 def fetch_emails(max_results=MAX_RESULTS):
     """
     Fetch recent unread emails from inbox
     Returns: List of email dictionaries with id, threadId, from, subject, date, snippet
     """
     try:
-        service = authenticate_gmail()
-        replied_emails = load_replied_emails()
-        
-        # Fetch email metadata
-        result = service.users().messages().list(
-            userId='me',
-            maxResults=max_results,
-            q="is:inbox -from:me is:unread",
-            labelIds=['INBOX']
-        ).execute()
-        
-        messages = result.get('messages', [])
-        emails = []
-        
-        for msg in messages:
-            if msg['id'] in replied_emails:
-                continue
-                
-            try:
-                # Get message details
-                msg_data = service.users().messages().get(
-                    userId='me',
-                    id=msg['id'],
-                    format='metadata',
-                    metadataHeaders=['From', 'Subject', 'Date']
-                ).execute()
-                
-                # Skip large emails
-                if int(msg_data.get('sizeEstimate', 0)) > MAX_EMAIL_SIZE:
-                    continue
-                
-                # Parse headers
-                headers = {h['name'].lower(): h['value'] for h in msg_data.get('payload', {}).get('headers', [])}
-                
-                emails.append({
-                    'id': msg['id'],
-                    'threadId': msg_data['threadId'],
-                    'from': parseaddr(headers.get('from', ''))[1] or headers.get('from', ''),
-                    'subject': headers.get('subject', 'No Subject'),
-                    'date': headers.get('date', datetime.now().isoformat()),
-                    'snippet': msg_data.get('snippet', '')
-                })
-                
-            except Exception as e:
-                logger.error(f"Error processing email {msg['id']}: {str(e)}")
-                continue
-                
+        emails, _, _ = list_unread_emails(authenticate_gmail(), max_results)
         return emails
 
     except HttpError as error:
@@ -129,17 +246,39 @@ def fetch_emails(max_results=MAX_RESULTS):
         return []
 
 def get_email_details(email_id):
-    """Get complete details of a specific email including body content"""
+    """Get complete details of a specific email including body content, from the local cache when possible"""
+    email_details = message_cache.get(email_id, PARSER_VERSION)
+    if email_details is not None:
+        return email_details
+
+    email_details = _fetch_email_details(email_id)
+    if email_details is not None:
+        message_cache.put(email_id, email_details, PARSER_VERSION)
+    return email_details
+
+def get_message_payload(email_id):
+    """Raw format='full' message from Gmail (not cached)"""
+    service = authenticate_gmail()
+    return service.users().messages().get(
+        userId='me',
+        id=email_id,
+        format='full'
+    ).execute()
+
+def _fetch_email_details(email_id):
+    """Fetch and decode a message with format='full', recording its attachment parts"""
     try:
-        service = authenticate_gmail()
-        msg_data = service.users().messages().get(
-            userId='me',
-            id=email_id,
-            format='full'
-        ).execute()
+        msg_data = get_message_payload(email_id)
+        payload = msg_data.get('payload', {})
         
         # Process headers
-        headers = {h['name'].lower(): h['value'] for h in msg_data.get('payload', {}).get('headers', [])}
+        headers = {h['name'].lower(): h['value'] for h in payload.get('headers', [])}
+
+        attachments = list_attachments(payload)
+        try:
+            store_attachments(email_id, attachments)
+        except Exception as e:
+            logger.warning(f"Could not record attachments of {email_id}: {str(e)}")
         
         email_details = {
             'id': email_id,
@@ -148,22 +287,12 @@ def get_email_details(email_id):
             'subject': headers.get('subject', 'No Subject'),
             'date': headers.get('date', datetime.now().isoformat()),
             'snippet': msg_data.get('snippet', ''),
-            'body': ''
+            'body': extract_body(payload),
+            'attachments': [
+                {'part_id': a['part_id'], 'filename': a['filename'], 'mime_type': a['mime_type'], 'size': a['size']}
+                for a in attachments
+            ]
         }
-        
-        # Extract email body
-        parts = msg_data.get('payload', {}).get('parts', [])
-        for part in parts:
-            if part['mimeType'] in ['text/plain', 'text/html']:
-                try:
-                    data = part['body'].get('data', '')
-                    if data:
-                        email_details['body'] = base64.urlsafe_b64decode(data + '===').decode('utf-8')
-                        break
-                except Exception as e:
-                    logger.warning(f"Error decoding part {part['partId']}: {str(e)}")
-                    continue
-                    
         return email_details
         
     except HttpError as error:
@@ -172,36 +301,92 @@ def get_email_details(email_id):
     except Exception as e:
         logger.error(f"Error getting email details: {str(e)}")
         return None
+
+def _json_string_field(chunks, field):
+    """Yield the value of a top-level JSON string field piece by piece as the text streams in"""
+    marker = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+    chunks = iter(chunks)
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        match = marker.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        buffer = buffer[-64:]  # Enough to match a marker split across chunks
+    else:
+        raise ValueError(f"No '{field}' in response")
+
+    while True:
+        end = buffer.find('"')
+        if end != -1:
+            yield buffer[:end]
+            return
+        yield buffer
+        buffer = next(chunks, None)
+        if buffer is None:
+            raise ValueError("Response ended inside the data field")
+
+def stream_attachment(email_id, attachment_id):
+    """
+    Yield the decoded content of an attachment in chunks
+    Requests the attachments().get URI over a streaming session so the base64
+    payload is decoded as it arrives instead of being held in memory whole.
+    Raises requests.HTTPError for error responses (404 when the attachment id is stale).
+    """
+    service = authenticate_gmail()
+    uri = service.users().messages().attachments().get(
+        userId='me', messageId=email_id, id=attachment_id
+    ).uri
+    _ensure_fresh_credentials()
+    with _thread_session().get(uri, stream=True, timeout=ATTACHMENT_TIMEOUT) as response:
+        response.raise_for_status()
+        text = (chunk.decode('latin-1') for chunk in response.iter_content(ATTACHMENT_READ_SIZE))
+        yield from decode_base64_stream(_json_string_field(text, 'data'))
     
+def build_message(to, subject, body, in_reply_to=None, message_id=None):
+    """
+    Reply message from BOT_EMAIL, base64url-encoded for messages.send
+    message_id: Message-ID header to set, so the sent copy can be found again
+    """
+    msg = email.message.EmailMessage()
+    msg.set_content(body)
+    msg['To'] = to
+    msg['Subject'] = subject
+    msg['From'] = BOT_EMAIL
+    if message_id:
+        msg['Message-ID'] = message_id
+
+    if in_reply_to:
+        msg['In-Reply-To'] = f"<{in_reply_to}>"
+        msg['References'] = f"<{in_reply_to}>"
+    return base64.urlsafe_b64encode(msg.as_bytes()).decode()
+
+def send_message(raw_message):
+    """Send a message built by build_message; raises HttpError. Returns Gmail's id for it"""
+    service = authenticate_gmail()
+    return service.users().messages().send(userId='me', body={'raw': raw_message}).execute()['id']
+
+def find_sent_message(message_id):
+    """Gmail id of the sent message with this Message-ID header, or None if there is none"""
+    service = authenticate_gmail()
+    result = service.users().messages().list(
+        userId='me', q=f"in:sent rfc822msgid:{message_id}", maxResults=1
+    ).execute()
+    messages = result.get('messages', [])
+    return messages[0]['id'] if messages else None
+
 def send_email_reply(to, subject, body, email_id, in_reply_to=None):
-    """Send an email reply and track it in replied emails"""
+    """Send an email reply right away and track it in replied emails (the app queues replies in src/outbox.py)"""
     if not to:
         logger.error("No recipient specified for reply")
         return False
 
     try:
-        service = authenticate_gmail()
-
-        # Create email message
-        msg = email.message.EmailMessage()
-        msg.set_content(body)
-        msg['To'] = to
-        msg['Subject'] = subject
-        msg['From'] = BOT_EMAIL
-
-        if in_reply_to:
-            msg['In-Reply-To'] = f"<{in_reply_to}>"
-            msg['References'] = f"<{in_reply_to}>"
-
-        # Encode and send
-        raw_message = base64.urlsafe_b64encode(msg.as_bytes()).decode()
-        service.users().messages().send(
-            userId='me',
-            body={'raw': raw_message}
-        ).execute()
+        send_message(build_message(to, subject, body, in_reply_to))
 
         # Track successful reply
-        save_replied_email(email_id)
+        mark_replied(email_id)
         logger.info(f"Successfully sent reply to {to}")
         return True
 
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from dotenv import load_dotenv
+from src.storage import get_connection
+from src.utils import Counters, KeyedLocks
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 24 * 60 * 60))  # Seconds a response stays valid
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 5000))
+LLM_CACHE_EVICT_TO = 0.9  # Eviction trims to this share of the limit, so it runs once per many inserts
+LLM_CACHE_TOUCH_BATCH = 100  # Hits whose last_used_at is written to the table in one go
+# When set, prompts sent with a temperature above this are not cached (e.g. 0 caches only greedy decoding)
+LLM_CACHE_MAX_TEMPERATURE = os.getenv("LLM_CACHE_MAX_TEMPERATURE")
+LLM_CACHE_MAX_TEMPERATURE = float(LLM_CACHE_MAX_TEMPERATURE) if LLM_CACHE_MAX_TEMPERATURE else None
+
+cache_stats = Counters('hits', 'misses', 'bypassed', 'evictions')
+
+# One lock per key being computed, so concurrent callers with the same input share one LLM call
+_inflight = KeyedLocks()
+
+# Hits are recorded here and written in batches rather than with an UPDATE per hit
+_touch_lock = threading.Lock()
+_touched = {}
+# Row count at the last COUNT(*) plus inserts since, so put() only counts the table when it
+# may be full. Replaced and expired entries make it high, which just means an early recount.
+_entries = None
+_entries_lock = threading.Lock()
+
+def get_llm_cache_stats():
+    """Hit/miss counters plus the current number of cached entries"""
+    with get_connection() as conn:
+        entries = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+    stats = cache_stats.snapshot()
+    lookups = stats['hits'] + stats['misses']
+    stats['entries'] = entries
+    stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+    return stats
+
+def make_key(model, prompt, temperature, **params):
+    """Content hash of everything that influences the completion"""
+    payload = json.dumps(
+        {'model': model, 'prompt': prompt, 'temperature': temperature, 'params': params},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def get(key):
+    """Return the cached response for key, or None if missing or expired"""
+    now = time.time()
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if now - row['created_at'] > LLM_CACHE_TTL:
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            return None
+        with _touch_lock:
+            _touched[key] = now
+            flush = len(_touched) >= LLM_CACHE_TOUCH_BATCH
+        if flush:
+            _flush_touches(conn)
+        return row['response']
+
+def _flush_touches(conn):
+    """Write the recorded hit times, so eviction sees current recency"""
+    with _touch_lock:
+        touched = [(used_at, key) for key, used_at in _touched.items()]
+        _touched.clear()
+    if touched:
+        conn.executemany("UPDATE llm_cache SET last_used_at = ? WHERE key = ?", touched)
+
+def put(key, model, response):
+    """
+    Store a response; once there are more than LLM_CACHE_MAX_ENTRIES, evict the
+    least recently used down to LLM_CACHE_EVICT_TO of that
+    """
+    global _entries
+    now = time.time()
+    with get_connection() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO llm_cache (key, model, response, created_at, last_used_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (key, model, response, now, now))
+        with _entries_lock:
+            if _entries is not None:
+                _entries += 1
+            if _entries is not None and _entries <= LLM_CACHE_MAX_ENTRIES:
+                return
+
+            entries = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            if entries > LLM_CACHE_MAX_ENTRIES:
+                _flush_touches(conn)
+                excess = entries - int(LLM_CACHE_MAX_ENTRIES * LLM_CACHE_EVICT_TO)
+                conn.execute('''
+                    DELETE FROM llm_cache WHERE key IN (
+                        SELECT key FROM llm_cache ORDER BY last_used_at ASC LIMIT ?
+                    )
+                ''', (excess,))
+                cache_stats.add('evictions', excess)
+                entries -= excess
+            _entries = entries
+
+def purge_expired():
+    """Delete every entry older than the TTL"""
+    with get_connection() as conn:
+        conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - LLM_CACHE_TTL,))
+
+def lookup(key):
+    """get() that records a hit or miss and treats cache errors as a miss"""
+    try:
+        response = get(key)
+    except Exception as e:
+        logger.warning(f"LLM cache lookup failed: {e}")
+        response = None
+    cache_stats.add('hits' if response is not None else 'misses')
+    return response
+
+def store(key, model, response):
+    """put() that logs instead of raising, so a cache failure never loses a response"""
+    try:
+        put(key, model, response)
+    except Exception as e:
+        logger.warning(f"Could not store LLM response in cache: {e}")
+
+def is_cacheable(temperature):
+    """False when LLM_CACHE_MAX_TEMPERATURE excludes responses sampled at this temperature"""
+    return LLM_CACHE_MAX_TEMPERATURE is None or temperature <= LLM_CACHE_MAX_TEMPERATURE
+
+def _usable(response, validate):
+    try:
+        validate(response)
+        return True
+    except ValueError as e:
+        logger.warning(f"Discarding cached LLM response that no longer validates: {e}")
+        return False
+
+def cached_completion(model, prompt, temperature, compute, validate=None, **params):
+    """
+    Return compute() for this (model, prompt, temperature, params), reusing a
+    stored response when one exists within the TTL. compute must return the
+    response text; exceptions it raises are not cached.
+    validate: called with each new response before it is stored; raising
+    ValueError keeps a malformed response out of the cache (the error reaches
+    the caller). A cached response that fails it is computed again.
+    """
+    if not is_cacheable(temperature):
+        cache_stats.add('bypassed')
+        return compute()
+
+    key = make_key(model, prompt, temperature, **params)
+    with _inflight.hold(key):
+        response = lookup(key)
+        if response is not None and (validate is None or _usable(response, validate)):
+            return response
+
+        response = compute()
+        if validate is not None:
+            validate(response)
+        store(key, model, response)
+        return response
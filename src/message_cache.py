@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import zlib
+import logging
+import threading
+from dotenv import load_dotenv
+from src.storage import get_connection
+from src.utils import Counters
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Gmail messages never change once sent, so cached entries don't expire; the
+# cache is only bounded by the total compressed size
+MESSAGE_CACHE_MAX_BYTES = int(os.getenv("MESSAGE_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+# zlib (default), zstd (needs the zstandard package) or none
+MESSAGE_CACHE_CODEC = os.getenv("MESSAGE_CACHE_CODEC", "zlib").lower()
+MESSAGE_CACHE_LEVEL = int(os.getenv("MESSAGE_CACHE_LEVEL", 6))
+MESSAGE_CACHE_EVICT_TO = 0.9  # Eviction trims to this share of the budget, so it runs once per many inserts
+MESSAGE_CACHE_TOUCH_BATCH = 100  # Hits whose last_used_at is written to the table in one go
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+if MESSAGE_CACHE_CODEC == "zstd" and zstandard is None:
+    logger.warning("zstandard is not installed, compressing cached messages with zlib")
+    MESSAGE_CACHE_CODEC = "zlib"
+
+cache_stats = Counters('hits', 'misses', 'evictions')
+
+# Hits are recorded here and written in batches rather than with an UPDATE per hit
+_touch_lock = threading.Lock()
+_touched = {}
+# Total size at the last SUM(size) plus what put() has changed since, so the table is only
+# summed when it may be over budget. Deleted emails make it high, which just means an early recount.
+_total_bytes = None
+_total_lock = threading.Lock()
+
+
+def _compress(raw, codec):
+    if codec == "zlib":
+        return zlib.compress(raw, MESSAGE_CACHE_LEVEL)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=MESSAGE_CACHE_LEVEL).compress(raw)
+    return raw
+
+
+def _decompress(data, codec):
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def get(message_id, version=0):
+    """Cached message details for message_id, or None on a miss or if cached by another version"""
+    try:
+        with get_connection() as conn:
+            row = conn.execute(
+                "SELECT codec, data FROM message_cache WHERE message_id = ? AND version = ?",
+                (message_id, version)
+            ).fetchone()
+            if row is not None:
+                with _touch_lock:
+                    _touched[message_id] = time.time()
+                    flush = len(_touched) >= MESSAGE_CACHE_TOUCH_BATCH
+                if flush:
+                    _flush_touches(conn)
+        details = json.loads(_decompress(row['data'], row['codec'])) if row is not None else None
+    except Exception as e:
+        logger.warning(f"Message cache lookup failed for {message_id}: {e}")
+        details = None
+    cache_stats.add('hits' if details is not None else 'misses')
+    return details
+
+
+def _flush_touches(conn):
+    """Write the recorded hit times, so eviction sees current recency"""
+    with _touch_lock:
+        touched = [(used_at, message_id) for message_id, used_at in _touched.items()]
+        _touched.clear()
+    if touched:
+        conn.executemany("UPDATE message_cache SET last_used_at = ? WHERE message_id = ?", touched)
+
+
+def _evict(conn, total):
+    """Delete least recently used entries until total is within MESSAGE_CACHE_EVICT_TO of the budget"""
+    _flush_touches(conn)
+    target = MESSAGE_CACHE_MAX_BYTES * MESSAGE_CACHE_EVICT_TO
+    evicted = []
+    # Walks the last_used_at index from the oldest entry and stops once enough is freed
+    rows = conn.execute("SELECT message_id, size FROM message_cache ORDER BY last_used_at, message_id")
+    for row in rows:
+        if total <= target:
+            break
+        evicted.append((row['message_id'],))
+        total -= row['size'] or 0
+    rows.close()
+    conn.executemany("DELETE FROM message_cache WHERE message_id = ?", evicted)
+    if evicted:
+        cache_stats.add('evictions', len(evicted))
+    return total
+
+
+def put(message_id, details, version=0):
+    """
+    Store message details; once the cache holds more than MESSAGE_CACHE_MAX_BYTES, evict
+    the least recently used entries down to MESSAGE_CACHE_EVICT_TO of that
+    version identifies the code that produced details; get only returns entries with a matching version
+    """
+    global _total_bytes
+    data = _compress(json.dumps(details).encode('utf-8'), MESSAGE_CACHE_CODEC)
+    now = time.time()
+    try:
+        with get_connection() as conn, _total_lock:
+            old = conn.execute("SELECT size FROM message_cache WHERE message_id = ?", (message_id,)).fetchone()
+            conn.execute('''
+                INSERT OR REPLACE INTO message_cache (message_id, version, codec, data, size, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (message_id, version, MESSAGE_CACHE_CODEC, data, len(data), now, now))
+            if _total_bytes is not None:
+                _total_bytes += len(data) - ((old['size'] or 0) if old else 0)
+                if _total_bytes <= MESSAGE_CACHE_MAX_BYTES:
+                    return
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM message_cache").fetchone()[0]
+            _total_bytes = _evict(conn, total) if total > MESSAGE_CACHE_MAX_BYTES else total
+    except Exception as e:
+        _total_bytes = None
+        logger.warning(f"Could not cache message {message_id}: {e}")
+
+
+def get_message_cache_stats():
+    """Hit/miss counters plus the number and compressed size of cached messages"""
+    with get_connection() as conn:
+        row = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM message_cache").fetchone()
+    stats = cache_stats.snapshot()
+    lookups = stats['hits'] + stats['misses']
+    stats['entries'] = row[0]
+    stats['bytes'] = row[1]
+    stats['codec'] = MESSAGE_CACHE_CODEC
+    stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+    return stats
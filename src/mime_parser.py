@@ -0,0 +1,156 @@
+import os
+import re
+import base64
+import logging
+from html.parser import HTMLParser
+from typing import Dict, Any, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bump when extraction changes so bodies cached with the old logic are refetched
+PARSER_VERSION = 3
+MAX_BODY_CHARS = int(os.getenv("MAX_BODY_CHARS", 100_000))  # Cap on the extracted text
+# HTML carries a lot of markup per character of text, so more of it is decoded
+HTML_DECODE_FACTOR = 4
+HTML_FEED_CHARS = 64 * 1024  # HTML is parsed in chunks so conversion can stop at the cap
+
+CHARSET = re.compile(r'charset\s*=\s*"?([\w.:-]+)', re.IGNORECASE)
+SKIPPED_TAGS = {"script", "style", "head", "title", "noscript"}
+
+
+def iter_parts(payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Depth-first walk over a Gmail payload's leaf parts, including a single-part payload itself"""
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        children = part.get('parts')
+        if children:
+            stack.extend(reversed(children))
+        else:
+            yield part
+
+
+def _header(part: Dict[str, Any], name: str) -> str:
+    for header in part.get('headers', []):
+        if header['name'].lower() == name:
+            return header['value']
+    return ''
+
+
+def is_attachment(part: Dict[str, Any]) -> bool:
+    """True for parts that are files rather than the message text"""
+    if part.get('filename') or part.get('body', {}).get('attachmentId'):
+        return True
+    return _header(part, 'content-disposition').lower().startswith('attachment')
+
+
+def list_attachments(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Attachment parts of a Gmail payload, without decoding them
+    Each has part_id, filename, mime_type, size, attachment_id (for attachments().get)
+    and data (base64url, only set when Gmail inlined the content in the message).
+    """
+    attachments = []
+    for part in iter_parts(payload):
+        if not is_attachment(part):
+            continue
+        body = part.get('body', {})
+        attachments.append({
+            'part_id': part.get('partId'),
+            'filename': part.get('filename') or f"part-{part.get('partId')}",
+            'mime_type': part.get('mimeType') or 'application/octet-stream',
+            'size': body.get('size', 0),
+            'attachment_id': body.get('attachmentId'),
+            'data': body.get('data')
+        })
+    return attachments
+
+
+def decode_part(part: Dict[str, Any], max_chars: int) -> str:
+    """
+    Decode a text part's base64url data, stopping after roughly max_chars characters
+    Only the needed prefix of the data is decoded, so large parts cost the same as small ones.
+    """
+    data = part.get('body', {}).get('data', '')
+    if not data:
+        return ''
+    # Up to 4 bytes per character in UTF-8, and 4 base64 characters per 3 bytes
+    max_bytes = max_chars * 4
+    chunk = data[:(max_bytes + 2) // 3 * 4]
+    raw = base64.urlsafe_b64decode(chunk + '=' * (-len(chunk) % 4))
+
+    match = CHARSET.search(_header(part, 'content-type'))
+    charset = match.group(1) if match else 'utf-8'
+    try:
+        text = raw.decode(charset, errors='replace')
+    except LookupError:
+        text = raw.decode('utf-8', errors='replace')
+    return text[:max_chars]
+
+
+class _TextCollector(HTMLParser):
+    """Collects visible text nodes as the HTML is fed in, without building a tree"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self.length = 0
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        data = data.strip()
+        if data and not self._skip_depth:
+            self.lines.append(data)
+            self.length += len(data) + 1
+
+
+def html_to_text(html: str, max_chars: int = MAX_BODY_CHARS) -> str:
+    """Visible text of an HTML body, one text node per line, stopping once max_chars are collected"""
+    collector = _TextCollector()
+    for start in range(0, len(html), HTML_FEED_CHARS):
+        collector.feed(html[start:start + HTML_FEED_CHARS])
+        if collector.length >= max_chars:
+            break
+    else:
+        collector.close()
+    return "\n".join(collector.lines)[:max_chars]
+
+
+def extract_body(payload: Dict[str, Any], max_chars: int = MAX_BODY_CHARS) -> str:
+    """
+    Text body of a Gmail message payload in format='full'
+    Prefers the first text/plain part anywhere in the tree and falls back to the
+    first text/html part converted to text. Attachments are never decoded.
+    """
+    html_part: Optional[Dict[str, Any]] = None
+    for part in iter_parts(payload):
+        mime_type = part.get('mimeType', '').lower()
+        if mime_type not in ('text/plain', 'text/html') or is_attachment(part):
+            continue
+        if mime_type == 'text/plain':
+            try:
+                text = decode_part(part, max_chars)
+            except Exception as e:
+                logger.warning(f"Error decoding part {part.get('partId')}: {e}")
+                continue
+            if text.strip():
+                return text
+        elif html_part is None:
+            html_part = part
+
+    if html_part is None:
+        return ''
+    try:
+        html = decode_part(html_part, max_chars * HTML_DECODE_FACTOR)
+        return html_to_text(html, max_chars)
+    except Exception as e:
+        logger.warning(f"Error converting HTML part {html_part.get('partId')}: {e}")
+        return ''
@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from email.utils import parseaddr
+from googleapiclient.errors import HttpError
+from dotenv import load_dotenv
+from src.email_service import BOT_EMAIL, RETRYABLE_STATUSES, build_message, send_message, find_sent_message
+from src.rate_limit import TokenBucket, backoff_delay
+from src.storage import get_connection, mark_replied, log_action
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Outgoing mail is written to the outbox table and sent by one background thread,
+# so request handlers and scheduler ticks never wait on Gmail
+OUTBOX_SENDS_PER_MINUTE = float(os.getenv("OUTBOX_SENDS_PER_MINUTE", 20))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 6))
+OUTBOX_RETRY_BASE = 2.0   # Seconds; doubles per attempt, with full jitter
+OUTBOX_RETRY_CAP = 600.0
+OUTBOX_POLL_SECONDS = 30  # Idle wait when nothing is due (enqueue wakes the sender early)
+# A message left in 'sending' this long was interrupted (crash or restart) and is
+# checked against Gmail's sent mail before it is tried again
+OUTBOX_SENDING_TIMEOUT = 300
+AUTO_REPLY_DEDUP_WINDOW = float(os.getenv("AUTO_REPLY_DEDUP_HOURS", 24)) * 3600
+
+send_limiter = TokenBucket(OUTBOX_SENDS_PER_MINUTE / 60.0, min(5, OUTBOX_SENDS_PER_MINUTE))
+
+_wake = threading.Event()
+_stop = threading.Event()
+_sender = None
+_on_sent = None
+
+
+def _message_id_header(key):
+    domain = (BOT_EMAIL or '').rpartition('@')[2] or 'localhost'
+    return f"<outbox-{key[:32]}@{domain}>"
+
+
+def enqueue(email_id, to, subject, body, kind='reply', idempotency_key=None, dedup_window=0):
+    """
+    Queue a message for the background sender
+    idempotency_key: a repeated request with the same key returns the first entry
+    instead of queueing again (or requeues it, if it failed); defaults to a hash
+    of the message itself
+    dedup_window: seconds; if a message of the same kind went to the same recipient
+    within it (and did not fail), that entry is returned and nothing is queued
+    Returns: (outbox entry dict, True if this call queued it)
+    """
+    recipient = parseaddr(to or '')[1].lower()
+    if not recipient:
+        raise ValueError("No recipient specified")
+    key = idempotency_key or hashlib.sha256(
+        json.dumps([kind, email_id, recipient, subject, body]).encode('utf-8')
+    ).hexdigest()
+    now = time.time()
+
+    with get_connection() as conn:
+        existing = conn.execute("SELECT * FROM outbox WHERE idempotency_key = ?", (key,)).fetchone()
+        if existing is not None and existing['status'] == 'failed':
+            # Sending a failed message again is a retry, not a duplicate. last_error is
+            # kept, so _deliver first checks Gmail in case an earlier attempt got through.
+            created = conn.execute('''
+                UPDATE outbox SET status = 'queued', attempts = 0, next_attempt_at = ?, updated_at = ?
+                WHERE id = ? AND status = 'failed'
+            ''', (now, now, existing['id'])).rowcount == 1
+            entry = dict(conn.execute("SELECT * FROM outbox WHERE id = ?", (existing['id'],)).fetchone())
+        else:
+            if existing is None and dedup_window:
+                existing = conn.execute('''
+                    SELECT * FROM outbox
+                    WHERE recipient = ? AND kind = ? AND created_at >= ? AND status != 'failed'
+                    ORDER BY id DESC LIMIT 1
+                ''', (recipient, kind, now - dedup_window)).fetchone()
+            if existing is not None:
+                return dict(existing), False
+
+            # OR IGNORE: a concurrent request with the same key may have just inserted it
+            created = conn.execute('''
+                INSERT OR IGNORE INTO outbox
+                (idempotency_key, kind, email_id, recipient, to_addr, subject, body, in_reply_to,
+                 message_id_header, status, next_attempt_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?)
+            ''', (key, kind, email_id, recipient, to, subject, body, email_id,
+                  _message_id_header(key), now, now, now)).rowcount == 1
+            entry = dict(conn.execute("SELECT * FROM outbox WHERE idempotency_key = ?", (key,)).fetchone())
+
+    if created:
+        _wake.set()
+    return entry, created
+
+
+def get_outbox_entry(entry_id):
+    with get_connection() as conn:
+        row = conn.execute("SELECT * FROM outbox WHERE id = ?", (entry_id,)).fetchone()
+        return dict(row) if row else None
+
+
+def list_outbox(limit=50):
+    """Most recent outbox entries, newest first"""
+    with get_connection() as conn:
+        return [dict(row) for row in conn.execute("SELECT * FROM outbox ORDER BY id DESC LIMIT ?", (limit,))]
+
+
+def get_outbox_stats():
+    with get_connection() as conn:
+        counts = {row['status']: row['count'] for row in conn.execute(
+            "SELECT status, COUNT(*) AS count FROM outbox GROUP BY status"
+        )}
+        oldest = conn.execute("SELECT MIN(created_at) FROM outbox WHERE status IN ('queued', 'sending')").fetchone()[0]
+    return {
+        'queued': counts.get('queued', 0),
+        'sending': counts.get('sending', 0),
+        'sent': counts.get('sent', 0),
+        'failed': counts.get('failed', 0),
+        'oldest_pending_seconds': round(time.time() - oldest, 1) if oldest else None,
+        'sender_running': _sender is not None and _sender.is_alive()
+    }
+
+
+def _update(entry_id, **fields):
+    fields['updated_at'] = time.time()
+    assignments = ', '.join(f"{name} = ?" for name in fields)
+    with get_connection() as conn:
+        conn.execute(f"UPDATE outbox SET {assignments} WHERE id = ?", (*fields.values(), entry_id))
+
+
+def _claim_next():
+    """Mark the next due message as sending and return it, or None if nothing is due"""
+    with get_connection() as conn:
+        row = conn.execute('''
+            SELECT id FROM outbox WHERE status = 'queued' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at, id LIMIT 1
+        ''', (time.time(),)).fetchone()
+        if row is None:
+            return None
+        # The status check keeps a second sender process from claiming it too
+        claimed = conn.execute('''
+            UPDATE outbox SET status = 'sending', attempts = attempts + 1, updated_at = ?
+            WHERE id = ? AND status = 'queued'
+        ''', (time.time(), row['id'])).rowcount
+        return dict(conn.execute("SELECT * FROM outbox WHERE id = ?", (row['id'],)).fetchone()) if claimed else None
+
+
+def _seconds_until_due():
+    with get_connection() as conn:
+        next_at = conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'queued'").fetchone()[0]
+    if next_at is None:
+        return OUTBOX_POLL_SECONDS
+    return min(OUTBOX_POLL_SECONDS, max(0.0, next_at - time.time()))
+
+
+def _recover_interrupted():
+    """Requeue messages stuck in 'sending', unless Gmail shows they were in fact sent"""
+    with get_connection() as conn:
+        stuck = [dict(row) for row in conn.execute(
+            "SELECT * FROM outbox WHERE status = 'sending' AND updated_at < ?",
+            (time.time() - OUTBOX_SENDING_TIMEOUT,)
+        )]
+    for entry in stuck:
+        try:
+            gmail_id = find_sent_message(entry['message_id_header'])
+        except Exception as e:
+            logger.warning(f"Could not check whether outbox message {entry['id']} was sent: {e}")
+            continue
+        if gmail_id:
+            _mark_sent(entry, gmail_id)
+        else:
+            logger.info(f"Outbox message {entry['id']} was interrupted before sending, requeueing")
+            _update(entry['id'], status='queued', next_attempt_at=time.time())
+
+
+def _mark_sent(entry, gmail_id):
+    now = time.time()
+    _update(entry['id'], status='sent', gmail_message_id=gmail_id, sent_at=now, last_error=None)
+    mark_replied(entry['email_id'])
+    log_action(entry['email_id'], 'reply_sent' if entry['kind'] == 'reply' else entry['kind'], json.dumps({
+        'to': entry['to_addr'], 'subject': entry['subject'], 'body_length': len(entry['body']),
+        'outbox_id': entry['id'], 'attempts': entry['attempts'],
+        'queued_seconds': round(now - entry['created_at'], 1)
+    }))
+    if _on_sent is not None:
+        try:
+            _on_sent(entry)
+        except Exception as e:
+            logger.error(f"Outbox sent callback failed for {entry['id']}: {e}")
+
+
+def _deliver(entry):
+    """Send one claimed message; returns Gmail's id for it"""
+    if entry['last_error']:
+        # An earlier attempt may have reached Gmail before failing (e.g. a timeout
+        # after the send was accepted); never send the same message twice
+        gmail_id = find_sent_message(entry['message_id_header'])
+        if gmail_id:
+            return gmail_id
+    raw = build_message(entry['to_addr'], entry['subject'], entry['body'],
+                        entry['in_reply_to'], entry['message_id_header'])
+    return send_message(raw)
+
+
+def _retry_after(error):
+    try:
+        return float(error.resp.get('retry-after', 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _send_one(entry):
+    try:
+        gmail_id = _deliver(entry)
+    except Exception as e:
+        status = e.resp.status if isinstance(e, HttpError) else None
+        retryable = status is None or status in RETRYABLE_STATUSES
+        if not retryable or entry['attempts'] >= OUTBOX_MAX_ATTEMPTS:
+            logger.error(f"Outbox message {entry['id']} to {entry['recipient']} failed: {e}")
+            _update(entry['id'], status='failed', last_error=str(e)[:500])
+            return
+        delay = backoff_delay(entry['attempts'] - 1, OUTBOX_RETRY_BASE, OUTBOX_RETRY_CAP)
+        if isinstance(e, HttpError):
+            delay = max(delay, _retry_after(e))
+        logger.warning(f"Outbox message {entry['id']} attempt {entry['attempts']} failed ({e}), retrying in {delay:.1f}s")
+        _update(entry['id'], status='queued', next_attempt_at=time.time() + delay, last_error=str(e)[:500])
+        return
+    _mark_sent(entry, gmail_id)
+
+
+def send_due():
+    """Send every message that is due now, paced by send_limiter; returns seconds until the next one is due"""
+    while not _stop.is_set():
+        entry = _claim_next()
+        if entry is None:
+            return _seconds_until_due()
+        wait = send_limiter.reserve(1)
+        if wait > 0:
+            time.sleep(wait)
+        _send_one(entry)
+    return 0
+
+
+def _run():
+    while not _stop.is_set():
+        _wake.clear()
+        try:
+            _recover_interrupted()
+            wait = send_due()
+        except Exception as e:
+            logger.error(f"Outbox sender error: {e}")
+            wait = OUTBOX_POLL_SECONDS
+        _wake.wait(wait)
+
+
+def start_sender(on_sent=None):
+    """
+    Start the background sender thread (once per process)
+    on_sent: optional callback(entry) run after each message is sent
+    """
+    global _sender, _on_sent
+    _on_sent = on_sent
+    if _sender is not None and _sender.is_alive():
+        return _sender
+    _stop.clear()
+    _sender = threading.Thread(target=_run, name='outbox-sender', daemon=True)
+    _sender.start()
+    return _sender
+
+
+def stop_sender(timeout=None):
+    _stop.set()
+    _wake.set()
+    if _sender is not None:
+        _sender.join(timeout)
@@ -0,0 +1,128 @@
+import os
+import re
+from typing import Dict, Any, Optional, Iterable
+from dotenv import load_dotenv
+from src.utils import Counters
+
+load_dotenv()
+
+PRECLASSIFIER_MODEL = "rules"
+
+# Keyword -> class. Priority keywords are matched as substrings, like the
+# original fallback logic.
+KEYWORD_CLASSES = {
+    'urgent': 'urgent', 'asap': 'urgent', 'immediately': 'urgent',
+    'please respond': 'respond', 'awaiting your response': 'respond',
+    'meeting': 'meeting', 'schedule': 'meeting',
+    'reminder': 'reminder',
+    'fyi': 'fyi', 'for your information': 'fyi',
+    'unsubscribe': 'automated', 'newsletter': 'automated', 'no longer wish to receive': 'automated',
+    'view this email in your browser': 'automated', 'view this email in browser': 'automated',
+    'view in your browser': 'automated', 'view in browser': 'automated',
+    'order confirmation': 'automated', 'your receipt': 'automated',
+    'verification code': 'automated', 'password reset': 'automated',
+}
+
+# All keywords in one compiled alternation (longest first), run over lower-cased
+# text. The lookahead on possible first letters lets the engine skip most
+# positions without trying every alternative.
+KEYWORD_PATTERN = re.compile(
+    "(?=[" + "".join(sorted({k[0] for k in KEYWORD_CLASSES})) + "])(?:"
+    + "|".join(re.escape(k) for k in sorted(KEYWORD_CLASSES, key=len, reverse=True))
+    + ")"
+)
+
+# Keyword class -> manual priority, checked in this order
+KEYWORD_PRIORITIES = [('urgent', 9), ('respond', 8), ('meeting', 7), ('reminder', 6), ('fyi', 3)]
+
+AUTOMATED_SENDER = re.compile(
+    r"^(?:no-?reply|do-?not-?reply|mailer-daemon|notifications?|newsletters?|marketing|bounces?)[^@]*@",
+    re.IGNORECASE
+)
+BULK_PRECEDENCE = {'bulk', 'list', 'junk'}
+BULK_LABELS = {'CATEGORY_PROMOTIONS', 'CATEGORY_SOCIAL', 'CATEGORY_FORUMS', 'SPAM'}
+
+
+def _address_list(env_name: str) -> set:
+    return {v.strip().lower() for v in os.getenv(env_name, "").split(",") if v.strip()}
+
+# Comma-separated addresses or domains. Allowed senders always go to the LLM;
+# denied senders are treated as low-priority bulk mail without one.
+ALLOW_SENDERS = _address_list("PRECLASSIFY_ALLOW_SENDERS")
+DENY_SENDERS = _address_list("PRECLASSIFY_DENY_SENDERS")
+
+preclassifier_stats = Counters('local', 'llm')
+
+
+def keyword_classes(text: str) -> set:
+    """Set of keyword classes (urgent, respond, meeting, reminder, fyi, automated) found in text."""
+    return {KEYWORD_CLASSES[keyword] for keyword in KEYWORD_PATTERN.findall(text.lower())}
+
+
+def priority_from_classes(classes: set) -> int:
+    for name, priority in KEYWORD_PRIORITIES:
+        if name in classes:
+            return priority
+    return 5
+
+
+def _sender_in(sender: str, entries: set) -> bool:
+    return bool(entries) and (sender in entries or sender.rpartition('@')[2] in entries)
+
+
+def is_bulk(sender: str, headers: Optional[Dict[str, str]] = None, label_ids: Optional[Iterable[str]] = None) -> bool:
+    """Detect mailing-list/automated mail from sender, List-*/Precedence headers and Gmail category labels."""
+    if _sender_in(sender, DENY_SENDERS) or AUTOMATED_SENDER.match(sender):
+        return True
+    if headers:
+        if 'list-unsubscribe' in headers or 'list-id' in headers:
+            return True
+        if headers.get('precedence', '').strip().lower() in BULK_PRECEDENCE:
+            return True
+        if headers.get('auto-submitted', 'no').strip().lower() != 'no':
+            return True
+    return bool(label_ids) and not BULK_LABELS.isdisjoint(label_ids)
+
+
+def _local_result(priority: int, topics: list) -> Dict[str, Any]:
+    return {
+        "category": "general",
+        "priority": priority,
+        "requires_action": False,
+        "action_type": "none",
+        "key_topics": topics
+    }
+
+
+def preclassify(sender: str, subject: str, body: str,
+                headers: Optional[Dict[str, str]] = None,
+                label_ids: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Classify clear-cut emails locally.
+    Returns an analysis dict (same schema as analyze_email) for bulk, automated
+    and FYI-only mail, or None when the email is ambiguous and needs the LLM.
+    headers: lower-cased header names to values, when available.
+    """
+    sender = (sender or "").lower()
+    result = None
+
+    if not _sender_in(sender, ALLOW_SENDERS):
+        if is_bulk(sender, headers, label_ids):
+            result = _local_result(2, ["bulk"])
+        else:
+            classes = keyword_classes(f"{subject or ''}\n{body or ''}")
+            if classes == {'automated'}:
+                result = _local_result(2, ["automated"])
+            elif classes == {'fyi'}:
+                result = _local_result(3, ["fyi"])
+
+    preclassifier_stats.add('local' if result else 'llm')
+    return result
+
+
+def get_preclassifier_stats() -> Dict[str, Any]:
+    """Counts of emails settled locally vs sent to the LLM, and the fraction of LLM calls avoided."""
+    stats = preclassifier_stats.snapshot()
+    total = stats['local'] + stats['llm']
+    stats['llm_calls_avoided'] = round(stats['local'] / total, 3) if total else 0.0
+    return stats
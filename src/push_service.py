@@ -0,0 +1,131 @@
+import os
+import hmac
+import json
+import time
+import base64
+import logging
+from dotenv import load_dotenv
+from src.email_service import authenticate_gmail, BOT_EMAIL
+from src.storage import get_setting, set_setting
+from src.sync_service import HISTORY_ID_KEY
+from src.utils import Counters
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Gmail publishes mailbox changes to this Pub/Sub topic, whose push subscription
+# posts them to /api/gmail/push?token=GMAIL_PUSH_TOKEN. Push is off unless both are set.
+GMAIL_PUBSUB_TOPIC = os.getenv("GMAIL_PUBSUB_TOPIC")  # projects/<project>/topics/<topic>
+GMAIL_PUSH_TOKEN = os.getenv("GMAIL_PUSH_TOKEN")
+WATCH_LABELS = ['INBOX']
+# Gmail drops a watch after 7 days; renew once less than this much is left
+WATCH_RENEW_MARGIN = float(os.getenv("WATCH_RENEW_MARGIN_HOURS", 24)) * 3600
+WATCH_CHECK_INTERVAL = 3600  # Seconds between renewal checks
+# While the watch is live, polling is only a safety net for lost notifications
+PUSH_FALLBACK_INTERVAL = float(os.getenv("PUSH_FALLBACK_INTERVAL", 900))
+WATCH_EXPIRATION_KEY = 'gmail_watch_expiration'
+
+push_stats = Counters('received', 'triggered', 'stale', 'ignored', 'invalid',
+                      'rejected', 'renewals', 'renewal_failures')
+_last_notification_at = None
+
+
+def push_enabled():
+    return bool(GMAIL_PUBSUB_TOPIC and GMAIL_PUSH_TOKEN)
+
+
+def verify_push_token(token):
+    """Check the token the push subscription was configured with"""
+    if token and hmac.compare_digest(token.encode(), GMAIL_PUSH_TOKEN.encode()):
+        return True
+    push_stats.add('rejected')
+    return False
+
+
+def watch_expiration():
+    """Epoch seconds at which the current watch lapses, or None if there is none"""
+    expiration = get_setting(WATCH_EXPIRATION_KEY)
+    return int(expiration) / 1000 if expiration else None
+
+
+def start_watch():
+    """Ask Gmail to publish inbox changes to GMAIL_PUBSUB_TOPIC; renews an existing watch"""
+    response = authenticate_gmail().users().watch(userId='me', body={
+        'topicName': GMAIL_PUBSUB_TOPIC,
+        'labelIds': WATCH_LABELS,
+        'labelFilterBehavior': 'INCLUDE'
+    }).execute()
+    set_setting(WATCH_EXPIRATION_KEY, str(response['expiration']))
+    push_stats.add('renewals')
+    logger.info(f"Gmail watch on {GMAIL_PUBSUB_TOPIC} renewed until "
+                f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(int(response['expiration']) / 1000))}")
+    return response
+
+
+def ensure_watch():
+    """
+    Start or renew the watch when it lapses within WATCH_RENEW_MARGIN
+    Returns: True if a watch is live afterwards
+    """
+    if not push_enabled():
+        return False
+    expiration = watch_expiration()
+    if expiration is None or expiration - time.time() < WATCH_RENEW_MARGIN:
+        try:
+            start_watch()
+        except Exception as e:
+            push_stats.add('renewal_failures')
+            logger.error(f"Gmail watch renewal failed: {e}")
+        expiration = watch_expiration()
+    return expiration is not None and expiration > time.time()
+
+
+def parse_notification(envelope):
+    """
+    Decode a Pub/Sub push envelope from Gmail
+    Returns: (emailAddress, historyId as int); raises ValueError if it is not a Gmail notification
+    """
+    try:
+        data = json.loads(base64.b64decode(envelope['message']['data']))
+        return data['emailAddress'], int(data['historyId'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Malformed Gmail push notification: {e}") from e
+
+
+def handle_notification(envelope):
+    """
+    Record a push notification
+    Returns: True if it reports changes past the history already synced, so a sync is due.
+    Redelivered and out-of-order notifications (history already synced) return False.
+    """
+    global _last_notification_at
+    push_stats.add('received')
+    try:
+        email_address, history_id = parse_notification(envelope)
+    except ValueError as e:
+        logger.warning(str(e))
+        push_stats.add('invalid')
+        return False
+    if BOT_EMAIL and email_address.lower() != BOT_EMAIL.lower():
+        logger.warning(f"Ignoring Gmail push notification for {email_address}")
+        push_stats.add('ignored')
+        return False
+
+    _last_notification_at = time.time()
+    synced = get_setting(HISTORY_ID_KEY)
+    if synced and history_id <= int(synced):
+        push_stats.add('stale')
+        return False
+    push_stats.add('triggered')
+    return True
+
+
+def get_push_stats():
+    stats = push_stats.snapshot()
+    expiration = watch_expiration() if push_enabled() else None
+    stats.update({
+        'enabled': push_enabled(),
+        'watch_expires_in_hours': round((expiration - time.time()) / 3600, 1) if expiration else None,
+        'last_notification_seconds_ago': round(time.time() - _last_notification_at, 1) if _last_notification_at else None
+    })
+    return stats
@@ -0,0 +1,62 @@
+import os
+import time
+import random
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Provider limits for the Groq account; defaults match the free tier for llama3-8b-8192
+GROQ_RPM = int(os.getenv("GROQ_RPM", 30))
+GROQ_TPM = int(os.getenv("GROQ_TPM", 30000))
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at rate tokens per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        """Take amount tokens, going into debt if needed; returns how long the caller must wait"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+
+class LLMRateLimiter:
+    """Paces LLM calls to stay under both requests-per-minute and tokens-per-minute limits"""
+
+    def __init__(self, rpm=GROQ_RPM, tpm=GROQ_TPM):
+        self.requests = TokenBucket(rpm / 60.0, rpm)
+        self.tokens = TokenBucket(tpm / 60.0, tpm)
+
+    def acquire(self, estimated_tokens):
+        """Block until a request of estimated_tokens may be sent"""
+        wait = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+        if wait > 0:
+            time.sleep(wait)
+
+
+def estimate_tokens(text, max_tokens=0):
+    """Rough prompt+completion token estimate (about 4 characters per token)"""
+    return len(text) // 4 + max_tokens
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """Exponential backoff with full jitter for the given retry attempt (0-based)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+llm_limiter = LLMRateLimiter()
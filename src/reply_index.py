@@ -0,0 +1,212 @@
+import os
+import re
+import math
+import zlib
+import logging
+import tempfile
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from src.storage import get_connection
+from src.utils import Counters
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Past replies are looked up by the email they answered. Each email becomes a
+# hashed TF-IDF vector (word and word-pair counts hashed into EMBEDDING_DIM
+# signed buckets), so no model or vocabulary has to be loaded or kept in sync.
+REPLY_INDEX_DIR = os.getenv("REPLY_INDEX_DIR", "reply_index")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", 256))
+SEARCH_BLOCK_ROWS = 32768  # Rows scored per matrix product, bounding the scratch memory
+SIMILAR_REPLIES = int(os.getenv("SIMILAR_REPLIES", 3))  # Past replies added to a reply prompt
+SIMILAR_REPLY_MIN_SCORE = float(os.getenv("SIMILAR_REPLY_MIN_SCORE", 0.15))  # Cosine similarity
+
+WORD = re.compile(r"[a-z0-9][a-z0-9'_-]*")
+
+index_stats = Counters('added', 'searches')
+
+
+def _features(text: str) -> List[str]:
+    words = WORD.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def embed(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Hashed, log-scaled term counts of text (not normalized)"""
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature, count in Counter(_features(text)).items():
+        h = zlib.crc32(feature.encode('utf-8'))
+        # The sign bit spreads hash collisions around zero instead of piling them up
+        vector[h % dim] += (1.0 if h & 0x80000000 else -1.0) * (1.0 + math.log(count))
+    return vector
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class EmbeddingIndex:
+    """
+    Unit-length float32 vectors appended to a flat file and searched through a
+    read-only memory map, so the matrix is paged in by the OS rather than loaded.
+    Per-bucket document frequencies are kept beside it for query-side IDF weighting.
+    """
+
+    def __init__(self, directory, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self.vectors_path = os.path.join(directory, 'vectors.f32')
+        self.df_path = os.path.join(directory, 'df.npy')
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._df = None
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self.vectors_path) // self.row_bytes
+        except FileNotFoundError:
+            return 0
+
+    def _document_frequencies(self):
+        if self._df is None:
+            try:
+                self._df = np.load(self.df_path)
+            except FileNotFoundError:
+                self._df = np.zeros(self.dim, dtype=np.float64)
+        return self._df
+
+    def _save_document_frequencies(self, df):
+        directory = os.path.dirname(self.df_path)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.df-', suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, df)
+        os.replace(temp_path, self.df_path)
+        self._df = df
+
+    def append(self, vectors) -> int:
+        """Normalize and append vectors; returns the row number of the first one"""
+        vectors = _normalize(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+        with self._lock:
+            os.makedirs(os.path.dirname(self.vectors_path) or '.', exist_ok=True)
+            with open(self.vectors_path, 'ab') as f:
+                size = f.tell()
+                if size % self.row_bytes:
+                    # A crash mid-append left part of a row; drop it so rows stay aligned
+                    f.truncate(size - size % self.row_bytes)
+                start = size // self.row_bytes
+                f.write(vectors.tobytes())
+            df = self._document_frequencies() + (vectors != 0).sum(axis=0)
+            self._save_document_frequencies(df)
+        return start
+
+    def idf(self) -> np.ndarray:
+        with self._lock:
+            df = self._document_frequencies()
+        return (np.log((1.0 + len(self)) / (1.0 + df)) + 1.0).astype(np.float32)
+
+    def _mapped(self):
+        rows = len(self)
+        if rows == 0:
+            return None
+        if self._matrix is None or len(self._matrix) != rows:
+            # Appends only grow the file, so a stale map is still valid for its rows
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+        return self._matrix
+
+    def search(self, queries, k) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top k rows by cosine similarity for each query, best first
+        queries: one vector or a (n, dim) batch, scored together in each block
+        Returns: (scores, rows), both (n, min(k, len(self)))
+        """
+        queries = _normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        with self._lock:
+            matrix = self._mapped()
+        if matrix is None or k <= 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.float32), empty.astype(np.int64)
+
+        k = min(k, len(matrix))
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(matrix), SEARCH_BLOCK_ROWS):
+            scores = queries @ matrix[start:start + SEARCH_BLOCK_ROWS].T
+            rows = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+            scores = np.concatenate([best_scores, scores], axis=1)
+            rows = np.concatenate([best_rows, rows], axis=1)
+            if scores.shape[1] > k:
+                top = np.argpartition(scores, -k, axis=1)[:, -k:]
+                scores = np.take_along_axis(scores, top, axis=1)
+                rows = np.take_along_axis(rows, top, axis=1)
+            best_scores, best_rows = scores, rows
+
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+
+
+_index = EmbeddingIndex(REPLY_INDEX_DIR)
+
+
+def add_reply(email_id: str, email_text: str, subject: str, reply: str) -> None:
+    """Index a sent reply under the text of the email it answered"""
+    vector = embed(email_text)
+    if not vector.any():
+        return
+    row = _index.append(vector)
+    with get_connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO reply_index (row, email_id, subject, reply) VALUES (?, ?, ?, ?)",
+            (row, email_id, subject, reply)
+        )
+    index_stats.add('added')
+
+
+def find_similar_replies(email_text: str, k: int = SIMILAR_REPLIES, exclude_email_id: str = None,
+                         min_score: float = SIMILAR_REPLY_MIN_SCORE) -> List[Dict[str, Any]]:
+    """
+    Replies previously sent to the emails most similar to email_text, best first
+    Returns: list of dicts with email_id, subject, reply and score; empty if the lookup fails
+    """
+    try:
+        vector = embed(email_text)
+        if not vector.any() or k <= 0:
+            return []
+        index_stats.add('searches')
+        # Extra candidates cover the excluded email and repeat replies to one email
+        scores, rows = _index.search(vector * _index.idf(), k * 2 + 1)
+        candidates = [(float(score), int(row)) for score, row in zip(scores[0], rows[0]) if score >= min_score]
+        if not candidates:
+            return []
+
+        with get_connection() as conn:
+            placeholders = ','.join('?' * len(candidates))
+            stored = {
+                r['row']: dict(r) for r in conn.execute(
+                    f"SELECT row, email_id, subject, reply FROM reply_index WHERE row IN ({placeholders})",
+                    [row for _, row in candidates]
+                )
+            }
+
+        results, seen = [], {exclude_email_id}
+        for score, row in candidates:
+            entry = stored.get(row)
+            if entry is None or entry['email_id'] in seen:
+                continue
+            seen.add(entry['email_id'])
+            results.append({'email_id': entry['email_id'], 'subject': entry['subject'],
+                            'reply': entry['reply'], 'score': round(score, 3)})
+        return results[:k]
+    except Exception as e:
+        logger.warning(f"Similar reply lookup failed: {e}")
+        return []
+
+
+def get_reply_index_stats():
+    stats = index_stats.snapshot()
+    stats['vectors'] = len(_index)
+    return stats
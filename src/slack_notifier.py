@@ -1,64 +1,198 @@
 import os
+import time
+import queue
+import logging
+import threading
 from datetime import datetime
 import requests
 from dotenv import load_dotenv
+from src.rate_limit import backoff_delay
+from src.utils import Counters
 
 load_dotenv()  # ✅ Load .env at the top
+logger = logging.getLogger(__name__)
 
 # ✅ Load after dotenv
 SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")
 CHANNEL_ID = os.getenv("CHANNEL_ID")
+SLACK_API_URL = os.getenv("SLACK_API_URL", "https://slack.com/api/chat.postMessage")
+SLACK_TIMEOUT = (3.05, 10)  # Connect, read (seconds)
+SLACK_MAX_RETRIES = int(os.getenv("SLACK_MAX_RETRIES", 3))
+# After a message is posted, alerts arriving within this many seconds are held
+# and posted together as one digest
+SLACK_COALESCE_SECONDS = float(os.getenv("SLACK_COALESCE_SECONDS", 10))
+SLACK_DIGEST_MAX_LINES = 15
+SLACK_QUEUE_SIZE = 1000
+
+# One keep-alive connection to Slack instead of a new TLS handshake per message
+_session = requests.Session()
+
+_queue = queue.Queue(maxsize=SLACK_QUEUE_SIZE)
+_STOP = object()
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+dispatch_stats = Counters('queued', 'posted', 'digests', 'coalesced', 'failed', 'dropped')
+
+
+def get_slack_stats():
+    stats = dispatch_stats.snapshot()
+    stats['pending'] = _queue.qsize()
+    return stats
+
+
+def _payload(title, message):
+    return {
+        "channel": CHANNEL_ID,
+        "text": message,
+        "blocks": [
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f"*{title}*\n{message}"
+                }
+            },
+            {
+                "type": "context",
+                "elements": [
+                    {
+                        "type": "mrkdwn",
+                        "text": f"Sent at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+                    }
+                ]
+            }
+        ]
+    }
+
+
+def _retry_after(response, attempt):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return backoff_delay(attempt)
+
+
+def _post(payload):
+    """Post to chat.postMessage, retrying rate limits (after Retry-After), 5xx and network errors"""
+    headers = {
+        "Authorization": f"Bearer {SLACK_BOT_TOKEN}",
+        "Content-Type": "application/json"
+    }
+    error = None
+    for attempt in range(SLACK_MAX_RETRIES + 1):
+        try:
+            response = _session.post(SLACK_API_URL, headers=headers, json=payload, timeout=SLACK_TIMEOUT)
+        except requests.RequestException as e:
+            error, delay = e, backoff_delay(attempt)
+        else:
+            if response.status_code == 429 or response.status_code >= 500:
+                error, delay = f"HTTP {response.status_code}", _retry_after(response, attempt)
+            else:
+                response.raise_for_status()
+                data = response.json()
+                if data.get('ok'):
+                    return True
+                if data.get('error') != 'ratelimited':
+                    print(f"Slack API error: {data.get('error', 'Unknown error')}")
+                    return False
+                error, delay = "ratelimited", _retry_after(response, attempt)
+
+        if attempt < SLACK_MAX_RETRIES:
+            time.sleep(delay)
+    print(f"Error sending Slack notification: {error}")
+    return False
+
 
 def send_slack_notification(message):
+    """Post one notification right away, blocking until Slack answers (see queue_slack_notification)"""
     if not SLACK_BOT_TOKEN or not CHANNEL_ID:
         print("Slack credentials not configured")
         return False
-    
-    print("Using SLACK_BOT_TOKEN:", SLACK_BOT_TOKEN)
-    print("Using CHANNEL_ID:", CHANNEL_ID)
 
     try:
-        url = "https://slack.com/api/chat.postMessage"
-        headers = {
-            "Authorization": f"Bearer {SLACK_BOT_TOKEN}",
-            "Content-Type": "application/json"
-        }
-
-        payload = {
-            "channel": CHANNEL_ID,
-            "text": message,
-            "blocks": [
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"*New Email Notification*\n{message}"
-                    }
-                },
-                {
-                    "type": "context",
-                    "elements": [
-                        {
-                            "type": "mrkdwn",
-                            "text": f"Sent at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                        }
-                    ]
-                }
-            ]
-        }
-
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
+        return _post(_payload("New Email Notification", message))
+    except Exception as e:
+        print(f"Error sending Slack notification: {e}")
+        return False
 
-        data = response.json()
-        if not data.get('ok'):
-            print(f"Slack API error: {data.get('error', 'Unknown error')}")
-            return False
 
-        return True
+def _post_batch(messages):
+    if len(messages) == 1:
+        title, text = "New Email Notification", messages[0]
+    else:
+        title = f"{len(messages)} New Email Notifications"
+        lines = [f"• {message}" for message in messages[:SLACK_DIGEST_MAX_LINES]]
+        if len(messages) > SLACK_DIGEST_MAX_LINES:
+            lines.append(f"…and {len(messages) - SLACK_DIGEST_MAX_LINES} more")
+        text = "\n".join(lines)
+        dispatch_stats.add('digests')
+        dispatch_stats.add('coalesced', len(messages))
 
+    try:
+        posted = _post(_payload(title, text))
     except Exception as e:
         print(f"Error sending Slack notification: {e}")
+        posted = False
+    dispatch_stats.add('posted' if posted else 'failed')
+
+
+def _run():
+    next_post_at = 0.0
+    stopping = False
+    while not stopping:
+        first = _queue.get()
+        if first is _STOP:
+            break
+        batch = [first]
+        # The first alert after a quiet period goes out at once; alerts arriving
+        # within SLACK_COALESCE_SECONDS of the last post (or while it was being
+        # retried) wait and go out together
+        while True:
+            remaining = next_post_at - time.monotonic()
+            try:
+                item = _queue.get(timeout=remaining) if remaining > 0 else _queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+        _post_batch(batch)
+        next_post_at = time.monotonic() + SLACK_COALESCE_SECONDS
+
+
+def _ensure_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None or not _dispatcher.is_alive():
+            _dispatcher = threading.Thread(target=_run, name='slack-dispatcher', daemon=True)
+            _dispatcher.start()
+
+
+def queue_slack_notification(message):
+    """
+    Hand a notification to the background dispatcher without waiting for Slack
+    Returns: False if Slack is not configured or the queue is full (the alert is dropped)
+    """
+    if not SLACK_BOT_TOKEN or not CHANNEL_ID:
+        return False
+    _ensure_dispatcher()
+    try:
+        _queue.put_nowait(message)
+    except queue.Full:
+        logger.warning("Slack notification queue is full, dropping alert")
+        dispatch_stats.add('dropped')
         return False
+    dispatch_stats.add('queued')
+    return True
 
 
+def stop_dispatcher(timeout=None):
+    """Post whatever is still queued, then stop the dispatcher thread"""
+    global _dispatcher
+    with _dispatcher_lock:
+        dispatcher, _dispatcher = _dispatcher, None
+    if dispatcher is not None and dispatcher.is_alive():
+        _queue.put(_STOP, timeout=timeout)
+        dispatcher.join(timeout)
@@ -0,0 +1,230 @@
+import os
+import time
+import queue
+import logging
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+STAGE_QUEUE_SIZE = int(os.getenv("STAGE_QUEUE_SIZE", 100))  # Items a stage holds before put() blocks
+FETCH_MIN_INTERVAL = float(os.getenv("FETCH_MIN_INTERVAL", 15))  # Seconds between polls while mail is arriving
+FETCH_MAX_INTERVAL = float(os.getenv("FETCH_MAX_INTERVAL", 300))  # Ceiling the interval backs off to when idle
+FETCH_BACKOFF = 1.5  # Interval growth per idle poll
+LAG_SMOOTHING = 0.2  # Weight of the newest sample in the averaged lag and busy times
+
+_STOP = object()
+_stages = []
+_pollers = []
+
+
+class Stage:
+    """
+    A named pool of worker threads fed by a bounded queue
+    handler(item) runs once per item and may put() into a downstream stage. A full
+    stage blocks put(), so a slow stage fills the queues in front of it and holds
+    everything upstream to its pace instead of piling up work.
+    batch_size: above 1, handler gets a list instead: the next item, plus up to
+    batch_size - 1 more when over batch_after items are waiting behind it
+    """
+
+    def __init__(self, name, handler, workers=1, queue_size=STAGE_QUEUE_SIZE, batch_size=1, batch_after=0):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_after = batch_after
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = {'queued': 0, 'processed': 0, 'failed': 0, 'busy': 0,
+                       'blocked_puts': 0, 'blocked_seconds': 0.0,
+                       'lag_ms': 0.0, 'max_lag_ms': 0.0, 'busy_ms': 0.0}
+        _stages.append(self)
+
+    def put(self, item):
+        """Queue an item, waiting while the stage is full"""
+        queued_at = time.monotonic()
+        try:
+            self._queue.put_nowait((queued_at, item))
+        except queue.Full:
+            self._queue.put((queued_at, item))
+            with self._lock:
+                self._stats['blocked_puts'] += 1
+                self._stats['blocked_seconds'] += time.monotonic() - queued_at
+        with self._lock:
+            self._stats['queued'] += 1
+
+    def _record(self, started, finished, entries, ok):
+        busy_ms = (finished - started) * 1000
+        with self._lock:
+            stats = self._stats
+            stats['busy'] -= 1
+            stats['processed' if ok else 'failed'] += len(entries)
+            for queued_at, _ in entries:
+                lag_ms = (started - queued_at) * 1000
+                stats['lag_ms'] += LAG_SMOOTHING * (lag_ms - stats['lag_ms'])
+                stats['max_lag_ms'] = max(stats['max_lag_ms'], lag_ms)
+            stats['busy_ms'] += LAG_SMOOTHING * (busy_ms - stats['busy_ms'])
+
+    def _take(self):
+        entries = [self._queue.get()]
+        if self.batch_size > 1 and self._queue.qsize() > self.batch_after:
+            while len(entries) < self.batch_size and entries[-1] is not _STOP:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+        return entries
+
+    def _work(self):
+        stopping = False
+        while not stopping:
+            entries = self._take()
+            if entries[-1] is _STOP:
+                stopping = True
+                entries.pop()
+            if not entries:
+                continue
+            items = [item for _, item in entries]
+            started = time.monotonic()
+            with self._lock:
+                self._stats['busy'] += 1
+            ok = True
+            try:
+                self.handler(items if self.batch_size > 1 else items[0])
+            except Exception as e:
+                ok = False
+                logger.error(f"{self.name} stage failed: {e}")
+            self._record(started, time.monotonic(), entries, ok)
+
+    def start(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        for i in range(len(self._threads), self.workers):
+            thread = threading.Thread(target=self._work, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Finish what is already queued, then stop the workers"""
+        for _ in self._threads:
+            self._queue.put(_STOP, timeout=timeout)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self):
+        with self._queue.mutex:
+            head = self._queue.queue[0] if self._queue.queue else None
+            pending = len(self._queue.queue)
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'workers': self.workers,
+            'pending': pending,
+            # How long the item at the front has been waiting: the stage's current lag
+            'oldest_wait_seconds': round(time.monotonic() - head[0], 2) if head and head is not _STOP else 0.0,
+            'lag_ms': round(stats['lag_ms'], 1),
+            'max_lag_ms': round(stats['max_lag_ms'], 1),
+            'busy_ms': round(stats['busy_ms'], 1),
+            'blocked_seconds': round(stats['blocked_seconds'], 2)
+        })
+        return stats
+
+
+class Poller:
+    """
+    Calls poll() from one thread, so runs never overlap: the next run is timed from
+    the end of the previous one, however long that took. The interval drops to
+    min_interval whenever poll() returns True (there was work) and grows by
+    FETCH_BACKOFF per idle run up to max_interval. trigger() runs it early.
+    """
+
+    def __init__(self, name, poll, min_interval=FETCH_MIN_INTERVAL, max_interval=FETCH_MAX_INTERVAL):
+        self.name = name
+        self.poll = poll
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {'runs': 0, 'active': 0, 'failed': 0, 'triggered': 0,
+                       'last_run_ms': 0.0, 'max_run_ms': 0.0, 'last_run_at': None}
+        _pollers.append(self)
+
+    def trigger(self):
+        """Run as soon as the current run (if any) finishes; repeated triggers collapse into one run"""
+        with self._lock:
+            self._stats['triggered'] += 1
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            started = time.monotonic()
+            try:
+                active = bool(self.poll())
+            except Exception as e:
+                active = False
+                logger.error(f"{self.name} poll failed: {e}")
+                with self._lock:
+                    self._stats['failed'] += 1
+            run_ms = (time.monotonic() - started) * 1000
+            self.interval = self.min_interval if active else min(self.max_interval, self.interval * FETCH_BACKOFF)
+            with self._lock:
+                stats = self._stats
+                stats['runs'] += 1
+                stats['active'] += active
+                stats['last_run_ms'] = run_ms
+                stats['max_run_ms'] = max(stats['max_run_ms'], run_ms)
+                stats['last_run_at'] = time.time()
+            self._wake.wait(self.interval)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'interval_seconds': round(self.interval, 1),
+            'last_run_ms': round(stats['last_run_ms'], 1),
+            'max_run_ms': round(stats['max_run_ms'], 1),
+            'running': self._thread is not None and self._thread.is_alive()
+        })
+        return stats
+
+
+def start_scheduler():
+    """Start every stage, then the pollers that feed them"""
+    for stage in _stages:
+        stage.start()
+    for poller in _pollers:
+        poller.start()
+
+
+def stop_scheduler(timeout=None):
+    """Stop the pollers, then drain the stages in the order they were created (upstream first)"""
+    for poller in _pollers:
+        poller.stop(timeout)
+    for stage in _stages:
+        stage.stop(timeout)
+
+
+def get_scheduler_stats():
+    stats = {poller.name: poller.stats() for poller in _pollers}
+    stats.update({stage.name: stage.stats() for stage in _stages})
+    return stats
@@ -1,12 +1,253 @@
 import sqlite3
 import os
-from datetime import datetime
-
-DB_FILE = "ai_email_assistant.db"
+import base64
+import json
+import re
+import logging
+import threading
+from contextlib import contextmanager
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+DB_FILE = os.getenv("DB_FILE", "ai_email_assistant.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8))  # Idle connections kept open
+
+# Applied to every pooled connection. WAL lets the scheduler write while UI
+# requests read; busy_timeout waits out the remaining writer/writer overlaps.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,          # 64MB page cache (negative = KiB)
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+
+
+class ConnectionPool:
+    """
+    Reuses SQLite connections across calls. A thread keeps the connection it
+    checked out for nested calls, then returns it to a shared idle list so
+    short-lived request threads don't pay connection setup each time.
+    """
+
+    def __init__(self, path, max_idle=DB_POOL_SIZE):
+        self.path = path
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma, value in SQLITE_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        return conn
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """
+        Yield a connection inside a transaction that commits on success and rolls back on error
+        A nested call runs in a savepoint of the caller's transaction instead, so it
+        neither commits nor rolls back the caller's work when it finishes.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.depth += 1
+            savepoint = f"nested_{self._local.depth}"
+            if not conn.in_transaction:
+                # Otherwise releasing the savepoint would commit on the caller's behalf
+                conn.execute("BEGIN")
+            conn.execute(f"SAVEPOINT {savepoint}")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+                raise
+            else:
+                conn.execute(f"RELEASE {savepoint}")
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self._acquire()
+        self._local.conn = conn
+        self._local.depth = 0
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pool = ConnectionPool(DB_FILE)
+
+def get_connection():
+    """Context manager yielding a pooled connection to DB_FILE"""
+    return _pool.connection()
+
+def set_db_path(path):
+    """Point storage at a different database file and create its tables"""
+    global DB_FILE, _pool
+    _pool.close()
+    DB_FILE = path
+    _pool = ConnectionPool(path)
+    init_db()
+    init_settings()
+
+def parse_timestamp_ms(value, default=None):
+    """Parse an RFC 2822 Date header or ISO timestamp into epoch milliseconds"""
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        try:
+            parsed = parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            try:
+                parsed = datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                return default
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+def _migrate_timestamp_ms(cursor):
+    """Add the timestamp_ms column to older databases and backfill it"""
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(emails)")}
+    if 'timestamp_ms' not in columns:
+        cursor.execute("ALTER TABLE emails ADD COLUMN timestamp_ms INTEGER")
+
+    cursor.execute("SELECT id, timestamp, created_at FROM emails WHERE timestamp_ms IS NULL")
+    updates = [
+        (parse_timestamp_ms(row[1], parse_timestamp_ms(row[2], 0)), row[0])
+        for row in cursor.fetchall()
+    ]
+    cursor.executemany("UPDATE emails SET timestamp_ms = ? WHERE id = ?", updates)
+
+ATTACHMENT_COLUMNS = {
+    'message_id': 'TEXT', 'part_id': 'TEXT', 'mime_type': 'TEXT', 'size': 'INTEGER',
+    'gmail_attachment_id': 'TEXT', 'sha256': 'TEXT', 'downloaded_at': 'DATETIME'
+}
+
+def _migrate_attachments(cursor):
+    """Add the Gmail part and content-hash columns to the original attachments table"""
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(attachments)")}
+    for name, sql_type in ATTACHMENT_COLUMNS.items():
+        if name not in columns:
+            cursor.execute(f"ALTER TABLE attachments ADD COLUMN {name} {sql_type}")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_attachments_message_part ON attachments (message_id, part_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_attachments_sha256 ON attachments (sha256)")
+
+REPLIED_EMAILS_FILE = os.getenv("REPLIED_EMAILS_FILE", "replied_emails.json")  # Pre-SQLite replied list
+REPLIED_IMPORT_KEY = 'replied_emails_imported'  # Setting recorded once the old file has been imported
+
+def _create_replied_emails(cursor):
+    """Message ids we have replied to, keyed for direct lookups (see _import_replied_emails)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS replied_emails (
+            message_id TEXT PRIMARY KEY,
+            replied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    ''')
+
+def _import_replied_emails(cursor):
+    """
+    Import the ids in the old replied_emails.json, once. The file was rewritten in
+    place and may be truncated; if it does not parse, nothing is recorded as done
+    and the import is tried again on the next start rather than losing the ids
+    (which would let the bot reply twice to threads it already answered).
+    """
+    if cursor.execute("SELECT 1 FROM settings WHERE key = ?", (REPLIED_IMPORT_KEY,)).fetchone():
+        return
+    if os.path.exists(REPLIED_EMAILS_FILE):
+        try:
+            with open(REPLIED_EMAILS_FILE) as f:
+                message_ids = json.load(f)
+            if not isinstance(message_ids, list) or not all(isinstance(m, str) for m in message_ids):
+                raise ValueError("expected a list of message ids")
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not import replied ids from {REPLIED_EMAILS_FILE}, will retry on the next start; "
+                         f"fix or restore the file to keep the bot from replying twice: {e}")
+            return
+        cursor.executemany("INSERT OR IGNORE INTO replied_emails (message_id) VALUES (?)",
+                           [(m,) for m in message_ids])
+        logger.info(f"Imported {len(message_ids)} replied ids from {REPLIED_EMAILS_FILE}")
+    cursor.execute("INSERT INTO settings (key, value) VALUES (?, ?)", (REPLIED_IMPORT_KEY, str(int(time.time()))))
+
+# Column weights for bm25 ranking (sender, subject, body): a subject hit counts most
+SEARCH_RANK = "bm25(2.0, 5.0, 1.0)"
+SEARCH_RANK_WINDOW = int(os.getenv("SEARCH_RANK_WINDOW", 1000))  # Newest matches scored per query
+
+def _create_search_index(cursor):
+    """
+    FTS5 index over sender, subject and body, stored as an external-content table
+    so the text is not duplicated; triggers keep it in step with emails
+    """
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'emails_fts'"
+    ).fetchone()
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+            sender, subject, body,
+            content='emails', content_rowid='id',
+            tokenize='porter unicode61', prefix='2 3'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS emails_fts_insert AFTER INSERT ON emails BEGIN
+            INSERT INTO emails_fts (rowid, sender, subject, body)
+            VALUES (new.id, new.sender, new.subject, new.body);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS emails_fts_delete AFTER DELETE ON emails BEGIN
+            INSERT INTO emails_fts (emails_fts, rowid, sender, subject, body)
+            VALUES ('delete', old.id, old.sender, old.subject, old.body);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS emails_fts_update AFTER UPDATE OF sender, subject, body ON emails BEGIN
+            INSERT INTO emails_fts (emails_fts, rowid, sender, subject, body)
+            VALUES ('delete', old.id, old.sender, old.subject, old.body);
+            INSERT INTO emails_fts (rowid, sender, subject, body)
+            VALUES (new.id, new.sender, new.subject, new.body);
+        END
+    ''')
+    if not exists:
+        cursor.execute("INSERT INTO emails_fts (emails_fts, rank) VALUES ('rank', ?)", (SEARCH_RANK,))
+        # Index the emails stored before search existed
+        cursor.execute("INSERT INTO emails_fts (emails_fts) VALUES ('rebuild')")
 
 def init_db():
     """Initialize the database with required tables"""
-    with sqlite3.connect(DB_FILE) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         
         # Create emails table
@@ -21,9 +262,11 @@ def init_db():
             body TEXT,
             thread_id TEXT,
             is_reply INTEGER DEFAULT 0,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            timestamp_ms INTEGER
         )
         ''')
+        _migrate_timestamp_ms(cursor)
         
         # Create attachments table
         cursor.execute('''
@@ -35,6 +278,8 @@ def init_db():
             FOREIGN KEY (email_id) REFERENCES emails (id)
         )
         ''')
+        # file_path is set once the content has been downloaded into the store (see src/attachment_store.py)
+        _migrate_attachments(cursor)
         
         # Create actions table
         cursor.execute('''
@@ -53,11 +298,106 @@ def init_db():
                 message_id TEXT PRIMARY KEY
             )
         ''')
+
+        # Stored analyze_email results, one row per email
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS analysis (
+                message_id TEXT PRIMARY KEY,
+                category TEXT,
+                priority INTEGER,
+                requires_action INTEGER,
+                action_type TEXT,
+                key_topics TEXT,
+                model TEXT,
+                analyzed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                notified_at DATETIME,
+                attempts INTEGER DEFAULT 0,
+                next_retry_at REAL,
+                FOREIGN KEY (message_id) REFERENCES emails (message_id)
+            )
+        ''')
+        analysis_columns = {row[1] for row in cursor.execute("PRAGMA table_info(analysis)")}
+        if 'attempts' not in analysis_columns:
+            cursor.execute("ALTER TABLE analysis ADD COLUMN attempts INTEGER DEFAULT 0")
+            cursor.execute("ALTER TABLE analysis ADD COLUMN next_retry_at REAL")
+
+        # LLM responses keyed by hash(model, prompt, temperature); see src/llm_cache.py
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                created_at REAL,
+                last_used_at REAL
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used_at)")
+
+        # Decoded Gmail messages (get_email_details output), compressed; see src/message_cache.py
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS message_cache (
+                message_id TEXT PRIMARY KEY,
+                version INTEGER DEFAULT 0,
+                codec TEXT,
+                data BLOB,
+                size INTEGER,
+                created_at REAL,
+                last_used_at REAL
+            )
+        ''')
+        if 'version' not in {row[1] for row in cursor.execute("PRAGMA table_info(message_cache)")}:
+            cursor.execute("ALTER TABLE message_cache ADD COLUMN version INTEGER DEFAULT 0")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_message_cache_last_used ON message_cache (last_used_at)")
+
+        # Outgoing mail waiting for, or already handled by, the background sender; see src/outbox.py
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT UNIQUE,
+                kind TEXT,
+                email_id TEXT,
+                recipient TEXT,
+                to_addr TEXT,
+                subject TEXT,
+                body TEXT,
+                in_reply_to TEXT,
+                message_id_header TEXT,
+                status TEXT DEFAULT 'queued',
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at REAL,
+                last_error TEXT,
+                gmail_message_id TEXT,
+                created_at REAL,
+                updated_at REAL,
+                sent_at REAL
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status_next ON outbox (status, next_attempt_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_recipient ON outbox (recipient, kind, created_at)")
+
+        # Sent replies behind the rows of the embedding matrix; see src/reply_index.py
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reply_index (
+                row INTEGER PRIMARY KEY,
+                email_id TEXT,
+                subject TEXT,
+                reply TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Ordering and date ranges use the parsed timestamp_ms; the raw header string sorts wrongly
+        cursor.execute("DROP INDEX IF EXISTS idx_emails_timestamp")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_emails_timestamp_ms ON emails (timestamp_ms)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_emails_thread_id ON emails (thread_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_actions_email_created ON actions (email_id, created_at)")
+
+        _create_search_index(cursor)
+        _create_replied_emails(cursor)
         
-        conn.commit()
 
 def init_settings():
-    with sqlite3.connect(DB_FILE) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS settings (
@@ -70,26 +410,69 @@ def init_settings():
             INSERT OR IGNORE INTO settings (key, value)
             VALUES ('auto_reply_mode', 'off')
         ''')
-        conn.commit()
+        _import_replied_emails(cursor)
 
 
+def _timestamp_ms_or_now(timestamp):
+    return parse_timestamp_ms(timestamp) or int(time.time() * 1000)
+
 def store_email(message_id, sender, recipient, subject, timestamp, body, thread_id=None, is_reply=False):
     """Store an email in the database"""
-    with sqlite3.connect(DB_FILE) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             INSERT OR IGNORE INTO emails 
-            (message_id, sender, recipient, subject, timestamp, body, thread_id, is_reply)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (message_id, sender, recipient, subject, timestamp, body, thread_id, int(is_reply)))
-        conn.commit()
+            (message_id, sender, recipient, subject, timestamp, body, thread_id, is_reply, timestamp_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (message_id, sender, recipient, subject, timestamp, body, thread_id, int(is_reply),
+              _timestamp_ms_or_now(timestamp)))
+
+def _select_existing_ids(cursor, message_ids, chunk_size=500, table='emails'):
+    """Return the subset of message_ids present in table, querying in chunks to stay under SQLite's variable limit"""
+    message_ids = list(message_ids)
+    existing = set()
+    for start in range(0, len(message_ids), chunk_size):
+        chunk = message_ids[start:start + chunk_size]
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f"SELECT message_id FROM {table} WHERE message_id IN ({placeholders})", chunk)
+        existing.update(row[0] for row in cursor.fetchall())
+    return existing
+
+def store_emails_bulk(emails):
+    """
+    Store many emails in a single transaction
+    emails: iterable of dicts with the same keys as store_email's arguments
+    Returns: List of message_ids that were newly inserted, in input order
+    """
+    rows = {}
+    for e in emails:
+        rows.setdefault(e['message_id'], (
+            e['message_id'], e.get('sender'), e.get('recipient'), e.get('subject'),
+            e.get('timestamp'), e.get('body'), e.get('thread_id'), int(e.get('is_reply', False)),
+            _timestamp_ms_or_now(e.get('timestamp'))
+        ))
+    if not rows:
+        return []
+
+    with get_connection() as conn:
+        if not conn.in_transaction:
+            # Take the write lock up front so the existence check and insert are atomic
+            conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.cursor()
+        existing = _select_existing_ids(cursor, rows)
+        new_ids = [m for m in rows if m not in existing]
+        cursor.executemany('''
+            INSERT OR IGNORE INTO emails
+            (message_id, sender, recipient, subject, timestamp, body, thread_id, is_reply, timestamp_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [rows[m] for m in new_ids])
+    return new_ids
 
 
 
 def get_emails(limit=10):
     """Fetch emails from database"""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT * FROM emails 
@@ -98,10 +481,191 @@ def get_emails(limit=10):
         ''', (limit,))
         return [dict(row) for row in cursor.fetchall()]
 
+class InvalidCursor(ValueError):
+    """A paging cursor that was not produced by this module (or has been tampered with)"""
+
+def _encode_cursor(*values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def _decode_cursor(cursor, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}") from e
+    if not isinstance(values, list) or len(values) != size or not all(
+            isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        raise InvalidCursor("Invalid cursor")
+    return values
+
+def list_emails(limit=100, cursor=None):
+    """
+    List emails newest first, skipping ones marked as deleted
+    cursor: opaque value returned as next_cursor by the previous page
+    Returns: (list of email dicts, next_cursor or None when there are no more rows)
+    """
+    params = []
+    after_clause = ''
+    if cursor:
+        after_clause = 'AND (e.timestamp_ms, e.id) < (?, ?)'
+        params.extend(_decode_cursor(cursor, 2))
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT e.id, e.message_id, e.sender, e.recipient, e.subject, e.timestamp, e.timestamp_ms,
+                   e.body, e.thread_id
+            FROM emails e
+            WHERE NOT EXISTS (SELECT 1 FROM deleted_emails d WHERE d.message_id = e.message_id)
+            {after_clause}
+            ORDER BY e.timestamp_ms DESC, e.id DESC
+            LIMIT ?
+        ''', (*params, limit + 1))
+        rows = [dict(row) for row in cursor.fetchall()]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1]['timestamp_ms'], rows[-1]['id'])
+    return rows, next_cursor
+
+SEARCH_FIELDS = {'from': 'sender', 'sender': 'sender', 'subject': 'subject', 'body': 'body'}
+SEARCH_TERM = re.compile(r'(?:(\w+):)?("[^"]*"|\S+)')
+
+def build_search_query(text):
+    """
+    Turn free text into an FTS5 query. Words are quoted so punctuation can't break
+    the syntax, all words must match, the last word also matches as a prefix, and
+    from:/subject:/body: limit a word or "quoted phrase" to one column.
+    """
+    terms = []
+    phrase = False
+    for field, value in SEARCH_TERM.findall(text):
+        words = re.findall(r'\w+', value)
+        if not words:
+            continue
+        term = '"' + ' '.join(words) + '"'
+        column = SEARCH_FIELDS.get(field.lower())
+        terms.append(f"{column} : {term}" if column else term)
+        phrase = value.startswith('"')
+    if terms and not phrase:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+def _rank_matches(conn, query, floor, older, after, limit):
+    """
+    Matches ranked by bm25 among either the recent window (rowid >= floor) or the
+    older matches before it, continuing after the (rank, rowid) pair `after`
+    """
+    params = [query, floor]
+    after_clause = ''
+    if after:
+        # Rank ties come back in rowid order, so pages never overlap or skip rows
+        after_clause = 'AND (rank > ? OR (rank = ? AND rowid > ?))'
+        params.extend([after[0], after[0], after[1]])
+
+    # Ordering by rank alone lets FTS5 sort internally, so highlight() and
+    # snippet() run only for the rows on this page
+    return conn.execute(f'''
+        SELECT rowid, rank,
+               highlight(emails_fts, 1, '<mark>', '</mark>') AS subject_highlight,
+               snippet(emails_fts, 2, '<mark>', '</mark>', '…', 16) AS snippet
+        FROM emails_fts
+        WHERE emails_fts MATCH ? AND rowid {'<' if older else '>='} ?
+        AND rowid NOT IN (SELECT e.id FROM deleted_emails d JOIN emails e ON e.message_id = d.message_id)
+        {after_clause}
+        ORDER BY rank
+        LIMIT ?
+    ''', (*params, limit)).fetchall()
+
+def search_emails(text, limit=20, cursor=None):
+    """
+    Full-text search ranked by bm25, best match first, skipping deleted emails
+    Queries matching more than SEARCH_RANK_WINDOW emails rank the most recent
+    SEARCH_RANK_WINDOW of them first, which keeps broad queries fast on large
+    mailboxes; paging past those continues with the older matches, ranked among themselves.
+    cursor: opaque value returned as next_cursor by the previous page; raises InvalidCursor if malformed
+    Returns: (list of result dicts with snippet and subject highlighted with <mark>, next_cursor or None)
+    """
+    query = build_search_query(text)
+    if not query:
+        return [], None
+
+    with get_connection() as conn:
+        if cursor:
+            rank, rowid, floor, older = _decode_cursor(cursor, 4)
+            after = (rank, rowid)
+        else:
+            # Cheap: walks the match list in rowid order without scoring it
+            row = conn.execute('''
+                SELECT rowid FROM emails_fts WHERE emails_fts MATCH ?
+                ORDER BY rowid DESC LIMIT 1 OFFSET ?
+            ''', (query, SEARCH_RANK_WINDOW - 1)).fetchone()
+            floor, older, after = (row[0] if row else 0), False, None
+
+        ranked = [(r, older) for r in _rank_matches(conn, query, floor, older, after, limit + 1)]
+        if not older and floor and len(ranked) <= limit:
+            # The recent window is used up: fill the page from the older matches
+            ranked += [(r, True) for r in _rank_matches(conn, query, floor, True, None, limit + 1 - len(ranked))]
+
+        page = ranked[:limit]
+        details = {}
+        if page:
+            placeholders = ','.join('?' * len(page))
+            for row in conn.execute(f'''
+                SELECT id, message_id, sender, subject, timestamp, thread_id
+                FROM emails WHERE id IN ({placeholders})
+            ''', [r['rowid'] for r, _ in page]):
+                details[row['id']] = dict(row)
+
+    rows = [dict(details[r['rowid']], rank=r['rank'], subject_highlight=r['subject_highlight'],
+                 snippet=r['snippet'])
+            for r, _ in page if r['rowid'] in details]
+    next_cursor = None
+    if len(ranked) > limit:
+        last, last_older = page[-1]
+        next_cursor = _encode_cursor(last['rank'], last['rowid'], floor, int(last_older))
+    return rows, next_cursor
+
+def rebuild_search_index():
+    """Re-index every stored email from scratch (e.g. after editing emails outside the app)"""
+    with get_connection() as conn:
+        conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('rebuild')")
+
+def optimize_search_index():
+    """Merge the index's b-tree segments into one, which speeds up queries after many inserts"""
+    with get_connection() as conn:
+        conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('optimize')")
+
+def get_emails_in_range(start=None, end=None, limit=None):
+    """
+    Emails received in [start, end), newest first
+    start/end: datetimes or epoch milliseconds; either may be None for an open range
+    """
+    start_ms = parse_timestamp_ms(start) if isinstance(start, datetime) else start
+    end_ms = parse_timestamp_ms(end) if isinstance(end, datetime) else end
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM emails
+            WHERE timestamp_ms >= ? AND timestamp_ms < ?
+            ORDER BY timestamp_ms DESC
+            LIMIT ?
+        ''', (start_ms if start_ms is not None else -2 ** 63,
+              end_ms if end_ms is not None else 2 ** 63 - 1,
+              limit if limit is not None else -1))
+        return [dict(row) for row in cursor.fetchall()]
+
+def count_emails_since(since):
+    """Number of emails received at or after since (datetime or epoch milliseconds)"""
+    since_ms = parse_timestamp_ms(since) if isinstance(since, datetime) else since
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM emails WHERE timestamp_ms >= ?", (since_ms,))
+        return cursor.fetchone()[0]
+
 def get_email_thread(thread_id):
     """Get all emails in a thread"""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT * FROM emails 
@@ -109,10 +673,24 @@ def get_email_thread(thread_id):
             ORDER BY created_at ASC
         ''', (thread_id,))
         return [dict(row) for row in cursor.fetchall()]
+
+def get_thread_for_message(message_id):
+    """
+    Get all emails in the thread of a stored message, without needing its thread id
+    Returns an empty list when the message has not been stored yet
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM emails
+            WHERE thread_id = (SELECT thread_id FROM emails WHERE message_id = ?)
+            ORDER BY created_at ASC
+        ''', (message_id,))
+        return [dict(row) for row in cursor.fetchall()]
     
 def is_email_deleted(message_id):
     """Check if the email with given message_id has been marked as deleted"""
-    with sqlite3.connect(DB_FILE) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT 1 FROM deleted_emails WHERE message_id = ?
@@ -122,37 +700,35 @@ def is_email_deleted(message_id):
     
 def mark_email_deleted(message_id):
     """Mark an email as deleted by adding it to the deleted_emails table"""
-    with sqlite3.connect(DB_FILE) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             INSERT OR IGNORE INTO deleted_emails (message_id)
             VALUES (?)
         ''', (message_id,))
-        conn.commit()
 
 
 
 
 def log_action(email_id, action_type, details=None):
     """Log an action taken on an email"""
-    with sqlite3.connect(DB_FILE) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO actions (email_id, action_type, details)
             VALUES (?, ?, ?)
         ''', (email_id, action_type, details))
-        conn.commit()
 
 
 def is_auto_reply_enabled():
-    with sqlite3.connect(DB_FILE) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT value FROM settings WHERE key = 'auto_reply_mode'")
         row = cursor.fetchone()
         return row and row[0] == 'on'
 
 def set_auto_reply_mode(enabled):
-    with sqlite3.connect(DB_FILE) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         value = 'on' if enabled else 'off'
         cursor.execute('''
@@ -160,7 +736,200 @@ def set_auto_reply_mode(enabled):
             SET value = ?
             WHERE key = 'auto_reply_mode'
         ''', (value,))
-        conn.commit()
+
+
+def get_setting(key, default=None):
+    """Read a value from the settings table"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM settings WHERE key = ?", (key,))
+        row = cursor.fetchone()
+        return row[0] if row else default
+
+def set_setting(key, value):
+    """Insert or update a value in the settings table"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO settings (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        ''', (key, value))
+
+
+def get_local_message_ids():
+    """Return the set of message_ids currently stored"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT message_id FROM emails")
+        return {row[0] for row in cursor.fetchall()}
+
+def get_existing_message_ids(message_ids):
+    """Return the subset of message_ids that are already stored"""
+    with get_connection() as conn:
+        return _select_existing_ids(conn.cursor(), message_ids)
+
+def mark_replied(message_id):
+    """Record that message_id has been replied to (repeat calls are no-ops)"""
+    with get_connection() as conn:
+        conn.execute("INSERT OR IGNORE INTO replied_emails (message_id) VALUES (?)", (message_id,))
+
+def is_replied(message_id):
+    with get_connection() as conn:
+        return conn.execute(
+            "SELECT 1 FROM replied_emails WHERE message_id = ?", (message_id,)
+        ).fetchone() is not None
+
+def get_replied_ids(message_ids):
+    """Return the subset of message_ids that have been replied to"""
+    with get_connection() as conn:
+        return _select_existing_ids(conn.cursor(), message_ids, table='replied_emails')
+
+def delete_emails(message_ids):
+    """Remove emails that are no longer in the unread inbox"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        params = [(m,) for m in message_ids]
+        cursor.executemany("DELETE FROM analysis WHERE message_id = ?", params)
+        cursor.executemany("DELETE FROM message_cache WHERE message_id = ?", params)
+        cursor.executemany("DELETE FROM emails WHERE message_id = ?", params)
+
+
+def store_attachments(message_id, attachments):
+    """
+    Record the attachment parts of a message (as returned by mime_parser.list_attachments)
+    Gmail issues a new attachment id on every fetch, so it is refreshed for known parts.
+    """
+    with get_connection() as conn:
+        conn.executemany('''
+            INSERT INTO attachments (email_id, message_id, part_id, filename, mime_type, size, gmail_attachment_id)
+            VALUES ((SELECT id FROM emails WHERE message_id = ?), ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (message_id, part_id) DO UPDATE SET gmail_attachment_id = excluded.gmail_attachment_id
+        ''', [
+            (message_id, message_id, a['part_id'], a['filename'], a['mime_type'], a['size'], a['attachment_id'])
+            for a in attachments
+        ])
+
+def get_attachments(message_id):
+    """Attachments recorded for a message, in part order"""
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT * FROM attachments WHERE message_id = ? ORDER BY id", (message_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+def get_attachment(message_id, part_id):
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT * FROM attachments WHERE message_id = ? AND part_id = ?", (message_id, part_id)
+        ).fetchone()
+        return dict(row) if row else None
+
+def set_attachment_content(message_id, part_id, sha256, file_path, size):
+    """Point an attachment at its downloaded content"""
+    with get_connection() as conn:
+        conn.execute('''
+            UPDATE attachments SET sha256 = ?, file_path = ?, size = ?, downloaded_at = CURRENT_TIMESTAMP
+            WHERE message_id = ? AND part_id = ?
+        ''', (sha256, file_path, size, message_id, part_id))
+
+# Model recorded for the keyword guess analyze_email returns when the LLM call
+# fails; such emails still count as unanalyzed and are retried
+FALLBACK_MODEL = 'fallback'
+# A FALLBACK_MODEL guess is retried after ANALYSIS_RETRY_BASE seconds, doubling per failed
+# attempt up to ANALYSIS_RETRY_CAP, and kept as final after ANALYSIS_MAX_ATTEMPTS
+ANALYSIS_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_MAX_ATTEMPTS", 8))
+ANALYSIS_RETRY_BASE = 60
+ANALYSIS_RETRY_CAP = 6 * 3600
+
+def _analysis_from_row(row):
+    return {
+        'category': row['category'],
+        'priority': row['priority'],
+        'requires_action': bool(row['requires_action']),
+        'action_type': row['action_type'],
+        'key_topics': json.loads(row['key_topics'] or '[]'),
+        'model': row['model'],
+        'analyzed_at': row['analyzed_at'],
+        'notified_at': row['notified_at'],
+        'attempts': row['attempts'],
+        'next_retry_at': row['next_retry_at']
+    }
+
+def analysis_retry_due(analysis):
+    """True for a FALLBACK_MODEL guess whose next retry is due (see get_unanalyzed_emails)"""
+    return (analysis['model'] == FALLBACK_MODEL and (analysis['attempts'] or 0) < ANALYSIS_MAX_ATTEMPTS
+            and (analysis['next_retry_at'] or 0) <= time.time())
+
+def store_analysis(message_id, analysis, model=None):
+    """
+    Save (or replace) the analysis result for an email
+    Storing a FALLBACK_MODEL guess counts a failed attempt and schedules the next retry.
+    """
+    fallback = model == FALLBACK_MODEL
+    now = time.time()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO analysis (message_id, category, priority, requires_action, action_type, key_topics, model,
+                                  attempts, next_retry_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(message_id) DO UPDATE SET
+                category = excluded.category,
+                priority = excluded.priority,
+                requires_action = excluded.requires_action,
+                action_type = excluded.action_type,
+                key_topics = excluded.key_topics,
+                model = excluded.model,
+                analyzed_at = CURRENT_TIMESTAMP,
+                attempts = CASE WHEN ? THEN analysis.attempts + 1 ELSE 0 END,
+                next_retry_at = CASE WHEN ? THEN ? + MIN(?, ? * (1 << MIN(analysis.attempts, 30))) END
+        ''', (
+            message_id,
+            analysis.get('category'),
+            analysis.get('priority'),
+            int(bool(analysis.get('requires_action'))),
+            analysis.get('action_type'),
+            json.dumps(analysis.get('key_topics') or []),
+            model,
+            int(fallback),
+            now + ANALYSIS_RETRY_BASE if fallback else None,
+            fallback, fallback, now, ANALYSIS_RETRY_CAP, ANALYSIS_RETRY_BASE
+        ))
+
+def get_analysis(message_id):
+    """Stored analysis for an email, or None if it hasn't been analyzed"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM analysis WHERE message_id = ?", (message_id,))
+        row = cursor.fetchone()
+        return _analysis_from_row(row) if row else None
+
+def get_unanalyzed_emails(limit=None):
+    """
+    Stored, non-deleted emails with no analysis yet, oldest first; emails with only a
+    FALLBACK_MODEL guess are included once their retry is due, up to ANALYSIS_MAX_ATTEMPTS
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT e.* FROM emails e
+            WHERE NOT EXISTS (
+                SELECT 1 FROM analysis a WHERE a.message_id = e.message_id
+                AND (a.model IS NOT ? OR a.attempts >= ? OR a.next_retry_at > ?)
+            )
+              AND NOT EXISTS (SELECT 1 FROM deleted_emails d WHERE d.message_id = e.message_id)
+            ORDER BY e.timestamp_ms ASC
+            LIMIT ?
+        ''', (FALLBACK_MODEL, ANALYSIS_MAX_ATTEMPTS, time.time(), limit if limit is not None else -1))
+        return [dict(row) for row in cursor.fetchall()]
+
+def mark_notified(message_id):
+    """Record that a Slack alert went out for this email"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE analysis SET notified_at = CURRENT_TIMESTAMP WHERE message_id = ?", (message_id,)
+        )
 
 
 
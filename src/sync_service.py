@@ -0,0 +1,120 @@
+import logging
+from googleapiclient.errors import HttpError
+from src.email_service import (
+    authenticate_gmail, list_unread_emails, fetch_message_metadata, parse_message_metadata,
+    MAX_EMAIL_SIZE, MAX_RESULTS
+)
+from src.storage import (
+    get_setting, set_setting, get_local_message_ids, get_existing_message_ids, get_replied_ids
+)
+
+logger = logging.getLogger(__name__)
+
+HISTORY_ID_KEY = 'gmail_history_id'
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+WATCHED_LABELS = {'INBOX', 'UNREAD'}
+
+
+def _in_unread_inbox(message):
+    """Whether a history message belongs to the view list_unread_emails lists (unread inbox, not sent by me)"""
+    label_ids = set(message.get('labelIds', []))
+    return WATCHED_LABELS.issubset(label_ids) and 'SENT' not in label_ids
+
+def list_history_changes(service, start_history_id):
+    """
+    Walk users.history.list from start_history_id
+    Returns: (added message ids, removed message ids, latest historyId)
+    Raises HttpError 404 when start_history_id is too old to be replayed.
+    """
+    added, removed = set(), set()
+    latest_history_id = start_history_id
+    page_token = None
+
+    while True:
+        result = service.users().history().list(
+            userId='me',
+            startHistoryId=start_history_id,
+            historyTypes=HISTORY_TYPES,
+            pageToken=page_token
+        ).execute()
+        latest_history_id = result.get('historyId', latest_history_id)
+
+        # Records are in chronological order, so the last event for a message wins
+        for record in result.get('history', []):
+            events = (
+                record.get('messagesAdded', []) + record.get('labelsAdded', []) +
+                record.get('labelsRemoved', [])
+            )
+            for item in events:
+                message = item['message']
+                if _in_unread_inbox(message):
+                    added.add(message['id'])
+                    removed.discard(message['id'])
+                else:
+                    removed.add(message['id'])
+                    added.discard(message['id'])
+            for item in record.get('messagesDeleted', []):
+                removed.add(item['message']['id'])
+                added.discard(item['message']['id'])
+
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            break
+
+    return added, removed, latest_history_id
+
+def _full_sync(service, max_results):
+    """List the unread inbox from scratch and record the historyId to resume from"""
+    # Read the historyId first so changes made while listing are replayed next time
+    history_id = service.users().getProfile(userId='me').execute()['historyId']
+    # Raises on API errors: a failed listing must neither delete local emails nor
+    # record a historyId, or the inbox would never be listed again
+    emails, listed, failed = list_unread_emails(service, max_results)
+    removed = get_local_message_ids() - listed
+    if failed:
+        logger.warning(f"Metadata fetch failed for {len(failed)} emails, listing the inbox again next sync")
+    else:
+        set_setting(HISTORY_ID_KEY, str(history_id))
+    return {'emails': emails, 'removed': removed, 'full_sync': True}
+
+def _incremental_sync(service, history_id):
+    """Fetch only the messages that changed since history_id"""
+    added, removed, latest_history_id = list_history_changes(service, history_id)
+
+    unseen = added - get_existing_message_ids(added)
+    new_ids = list(unseen - get_replied_ids(unseen))
+    failed = []
+    metadata = fetch_message_metadata(service, new_ids, failed=failed)
+
+    emails = []
+    for msg_id in new_ids:
+        msg_data = metadata.get(msg_id)
+        if msg_data is None or int(msg_data.get('sizeEstimate', 0)) > MAX_EMAIL_SIZE:
+            continue
+        emails.append(parse_message_metadata(msg_data))
+
+    if failed:
+        # Replaying is safe (already stored ids are skipped), and skipping ahead would lose these emails
+        logger.warning(f"Metadata fetch failed for {len(failed)} new emails, replaying history from {history_id} next sync")
+    else:
+        set_setting(HISTORY_ID_KEY, str(latest_history_id))
+    return {'emails': emails, 'removed': removed, 'full_sync': False}
+
+def sync_inbox(max_results=MAX_RESULTS):
+    """
+    Bring the local copy of the unread inbox up to date
+    Returns: Dict with 'emails' (newly arrived email dictionaries), 'removed'
+    (message ids no longer in the unread inbox) and 'full_sync'
+    """
+    service = authenticate_gmail()
+    history_id = get_setting(HISTORY_ID_KEY)
+
+    if history_id:
+        try:
+            return _incremental_sync(service, history_id)
+        except HttpError as error:
+            if error.resp.status != 404:
+                raise
+            logger.warning("Gmail history expired, falling back to full sync")
+
+    return _full_sync(service, max_results)
@@ -0,0 +1,47 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# cl100k_base is not Llama's tokenizer, but it tracks it closely enough for
+# budgeting prompts against llama3-8b-8192's context window.
+ENCODING_NAME = "cl100k_base"
+
+_encoding = None
+_encoding_loaded = False
+_lock = threading.Lock()
+
+
+def _get_encoding():
+    """Load the tiktoken encoding once; None if tiktoken or its data file is unavailable"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(ENCODING_NAME)
+                except Exception as e:
+                    logger.warning(f"tiktoken unavailable, estimating token counts: {e}")
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text):
+    """Number of tokens in text (about 4 characters per token when tiktoken is unavailable)"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text down to at most max_tokens tokens"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
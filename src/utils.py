@@ -1 +1,49 @@
-# src/utils.py - Auto-generated file
+import threading
+from contextlib import contextmanager
+
+
+class Counters:
+    """Named counters that any thread can bump, for the get_*_stats() health snapshots"""
+
+    def __init__(self, *names):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(names, 0)
+
+    def add(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def snapshot(self):
+        """A consistent copy of every counter"""
+        with self._lock:
+            return dict(self._counts)
+
+
+class KeyedLocks:
+    """
+    One lock per key in use, so concurrent callers with the same key (e.g. the same
+    LLM prompt or attachment) take turns and the later ones find the first one's result
+    A key's lock is dropped once nobody holds or waits for it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}  # key -> [lock, holders and waiters]
+
+    @contextmanager
+    def hold(self, key):
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._locks)
@@ -19,6 +19,11 @@ document.addEventListener('DOMContentLoaded', function () {
     let currentEmail = null;
     let lastFetchTime = 0;
     const FETCH_COOLDOWN = 60000;
+    let nextCursor = null;
+    let isLoadingMore = false;
+    let loadedEmails = [];
+    let searchQuery = '';
+    let searchCursor = null;
 
     safeLoadEmails();
     setupAutoReplyToggle();
@@ -28,6 +33,7 @@ document.addEventListener('DOMContentLoaded', function () {
     refreshBtn.addEventListener('click', safeLoadEmails);
     closeBtn.addEventListener('click', closeModal);
     searchInput.addEventListener('input', debounce(searchEmails, 300));
+    window.addEventListener('scroll', debounce(maybeLoadMoreEmails, 100));
 
     replyModal.addEventListener('click', function (e) {
         if (e.target === replyModal) {
@@ -137,7 +143,9 @@ document.addEventListener('DOMContentLoaded', function () {
                 throw new Error(data.error || 'Failed to load emails');
             }
 
-            renderEmails(data.emails);
+            nextCursor = data.next_cursor || null;
+            loadedEmails = data.emails || [];
+            if (!searchQuery) renderEmails(loadedEmails);
         } catch (error) {
             console.error('Error:', error);
             showToast(error.message, "error");
@@ -147,19 +155,52 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     }
     
-    function renderEmails(emails) {
-        if (!emails || emails.length === 0) {
+    async function maybeLoadMoreEmails() {
+        const cursor = searchQuery ? searchCursor : nextCursor;
+        if (!cursor || isLoadingMore) return;
+        const nearBottom = window.innerHeight + window.scrollY >= document.body.offsetHeight - 300;
+        if (!nearBottom) return;
+
+        isLoadingMore = true;
+        try {
+            if (searchQuery) {
+                await runSearch(searchQuery, cursor);
+                return;
+            }
+            const response = await fetch(`/api/emails/page?cursor=${encodeURIComponent(cursor)}`);
+            const data = await response.json();
+            if (!response.ok || !data.success) {
+                throw new Error(data.error || `HTTP error! status: ${response.status}`);
+            }
+            nextCursor = data.next_cursor || null;
+            loadedEmails = loadedEmails.concat(data.emails || []);
+            renderEmails(data.emails, true);
+        } catch (error) {
+            console.error('Error loading more emails:', error);
+            showToast(error.message, "error");
+        } finally {
+            isLoadingMore = false;
+        }
+    }
+
+    function renderEmails(emails, append = false) {
+        if (append) {
+            if (!emails || emails.length === 0) return;
+        } else if (!emails || emails.length === 0) {
             emailList.innerHTML = '<div class="empty-state">No emails found</div>';
             return;
+        } else {
+            emailList.innerHTML = '';
         }
     
-        emailList.innerHTML = '';
-    
         emails.forEach(email => {
             console.log("Email object:", email);  // Debugging
     
             const emailId = email.message_id || email.id || '';
             const emailBody = email.snippet || 'No content'; // ✅ Using snippet instead of body
+            // Search results come with <mark> tags around matched words
+            const subjectHtml = email.subject_highlight ? highlightHtml(email.subject_highlight) : escapeHtml(email.subject);
+            const bodyHtml = email.score !== undefined ? highlightHtml(emailBody) : escapeHtml(emailBody);
     
             const emailItem = document.createElement('div');
             emailItem.className = 'email-item';
@@ -170,8 +211,8 @@ document.addEventListener('DOMContentLoaded', function () {
                     <span class="email-sender">${escapeHtml(email.from)}</span>
                     <span class="email-date">${escapeHtml(email.date)}</span>
                 </div>
-                <div class="email-subject">${escapeHtml(email.subject)}</div>
-                <div class="email-body">${escapeHtml(emailBody)}</div>
+                <div class="email-subject">${subjectHtml}</div>
+                <div class="email-body">${bodyHtml}</div>
                 <div class="email-actions">
                     <button class="reply-btn" data-id="${escapeHtml(emailId)}">
                         <i class="fas fa-reply"></i> Reply
@@ -197,18 +238,41 @@ document.addEventListener('DOMContentLoaded', function () {
     
     
 
-    function searchEmails() {
-        const query = searchInput.value.trim().toLowerCase();
+    async function searchEmails() {
+        const query = searchInput.value.trim();
+        searchQuery = query;
+        searchCursor = null;
         if (!query) {
-            loadEmails();
+            renderEmails(loadedEmails);
             return;
         }
 
-        const emailItems = document.querySelectorAll('.email-item');
-        emailItems.forEach(item => {
-            const text = item.textContent.toLowerCase();
-            item.style.display = text.includes(query) ? 'block' : 'none';
-        });
+        try {
+            await runSearch(query, null);
+        } catch (error) {
+            console.error('Search failed:', error);
+            showToast(error.message, "error");
+        }
+    }
+
+    async function runSearch(query, cursor) {
+        let url = `/api/search?q=${encodeURIComponent(query)}`;
+        if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+
+        const response = await fetch(url);
+        const data = await response.json();
+        if (!response.ok || !data.success) {
+            throw new Error(data.error || `HTTP error! status: ${response.status}`);
+        }
+        // Ignore responses for a query the user has already changed
+        if (query !== searchQuery) return;
+
+        searchCursor = data.next_cursor || null;
+        if (!cursor && data.results.length === 0) {
+            emailList.innerHTML = '<div class="empty-state">No matching emails</div>';
+            return;
+        }
+        renderEmails(data.results, Boolean(cursor));
     }
 
     async function generateReply(emailId) {
@@ -224,11 +288,11 @@ document.addEventListener('DOMContentLoaded', function () {
         showLoading();
 
         try {
-            const response = await fetch('/api/reply/generate', {
+            const response = await fetch('/api/reply/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
-                    'Accept': 'application/json'
+                    'Accept': 'text/event-stream'
                 },
                 body: JSON.stringify({ email_id: emailId })
             });
@@ -238,40 +302,71 @@ document.addEventListener('DOMContentLoaded', function () {
                 throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
             }
 
-            const data = await response.json();
-
-            if (!data.success) {
-                throw new Error(data.error || 'Failed to generate reply');
-            }
-
-            currentEmail = {
-                id: emailId,
-                from: data.sender,
-                subject: data.subject
-            };
-
-            document.getElementById('reply-to').textContent = data.sender;
-            document.getElementById('reply-subject').textContent = `Re: ${data.subject}`;
-            replyContent.value = data.reply;
-            replyContent.readOnly = true;
-            replyModal.dataset.emailId = emailId;
-            editReplyBtn.innerHTML = '<i class="fas fa-edit"></i> Edit';
-
-            openModal();
-
-            if (data.analysis) {
-                showToast(`Email priority: ${data.analysis.priority || 'normal'}`);
-            }
+            await readEventStream(response, (event, data) => {
+                if (event === 'meta') {
+                    currentEmail = {
+                        id: emailId,
+                        from: data.sender,
+                        subject: data.subject
+                    };
+
+                    document.getElementById('reply-to').textContent = data.sender;
+                    document.getElementById('reply-subject').textContent = `Re: ${data.subject}`;
+                    replyContent.value = '';
+                    replyContent.readOnly = true;
+                    replyModal.dataset.emailId = emailId;
+                    editReplyBtn.innerHTML = '<i class="fas fa-edit"></i> Edit';
+                    sendReplyBtn.disabled = true;
+
+                    hideLoading();
+                    openModal();
+                } else if (event === 'token') {
+                    replyContent.value += data.text;
+                    replyContent.scrollTop = replyContent.scrollHeight;
+                } else if (event === 'analysis') {
+                    showToast(`Email priority: ${data.priority || 'normal'}`);
+                } else if (event === 'error') {
+                    throw new Error(data.error || 'Failed to generate reply');
+                }
+            });
 
         } catch (error) {
             console.error('Error:', error);
             showToast(error.message, "error");
         } finally {
+            sendReplyBtn.disabled = false;
             isFetching = false;
             hideLoading();
         }
     }
 
+    // Parse a text/event-stream response body, calling onEvent(event, data) per event
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                let data = '';
+                block.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                });
+                if (data) onEvent(event, JSON.parse(data));
+            }
+        }
+    }
+
     async function sendReply(emailId, to, subject, body) {
         if (isFetching) return;
         isFetching = true;
@@ -304,8 +399,9 @@ document.addEventListener('DOMContentLoaded', function () {
                 throw new Error(data.error || 'Failed to send reply');
             }
 
-            showToast('Reply sent successfully!');
+            showToast(data.queued ? 'Reply queued for sending' : 'This reply is already queued');
             closeModal();
+            watchDelivery(data.outbox.id);
             await safeLoadEmails();
 
         } catch (error) {
@@ -317,6 +413,26 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     }
 
+    // Sending happens in the background; poll the outbox until the reply is sent or gives up
+    async function watchDelivery(outboxId, attempt = 0) {
+        if (attempt >= 60) return;
+        try {
+            const response = await fetch(`/api/outbox/${outboxId}`);
+            const data = await response.json();
+            if (data.outbox.status === 'sent') {
+                showToast('Reply sent successfully!');
+                return;
+            }
+            if (data.outbox.status === 'failed') {
+                showToast(`Reply could not be sent: ${data.outbox.last_error}`, "error");
+                return;
+            }
+        } catch (error) {
+            console.error('Error checking delivery:', error);
+        }
+        setTimeout(() => watchDelivery(outboxId, attempt + 1), 2000);
+    }
+
     // Utilities
     function escapeHtml(unsafe) {
         if (!unsafe) return '';
@@ -328,6 +444,12 @@ document.addEventListener('DOMContentLoaded', function () {
             .replace(/'/g, "&#039;");
     }
 
+    function highlightHtml(text) {
+        return escapeHtml(text)
+            .replace(/&lt;mark&gt;/g, '<mark>')
+            .replace(/&lt;\/mark&gt;/g, '</mark>');
+    }
+
     function formatDate(dateString) {
         if (!dateString) return '';
         try {
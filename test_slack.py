@@ -1,7 +1,7 @@
 from src.slack_notifier import send_slack_notification
 import os
 
-print("SLACK_BOT_TOKEN:", os.getenv("SLACK_BOT_TOKEN"))  # Debug
+print("SLACK_BOT_TOKEN set:", bool(os.getenv("SLACK_BOT_TOKEN")))  # Debug
 print("CHANNEL_ID:", os.getenv("CHANNEL_ID"))            # Debug
 
 message = "🛎️ Test notification from Python Slack bot!"
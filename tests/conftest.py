@@ -0,0 +1,27 @@
+import os
+import tempfile
+
+# src.storage opens DB_FILE and creates its tables on import, so point it at a scratch file first
+_tmp = tempfile.TemporaryDirectory()
+os.environ['DB_FILE'] = os.path.join(_tmp.name, 'test.db')
+os.environ['REPLIED_EMAILS_FILE'] = os.path.join(_tmp.name, 'replied_emails.json')
+os.environ.setdefault('GROQ_API_KEY', 'test')
+
+import pytest
+
+from src import storage
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A fresh, empty database for one test"""
+    storage.set_db_path(str(tmp_path / 'test.db'))
+
+
+def email_row(message_id, body='', **fields):
+    """An emails row as store_emails_bulk takes it"""
+    row = {'message_id': message_id, 'sender': 'client@example.com', 'recipient': 'assistant@example.com',
+           'subject': f"Subject {message_id}", 'body': body, 'timestamp': '2026-10-18T09:00:00',
+           'thread_id': message_id}
+    row.update(fields)
+    return row
@@ -0,0 +1,109 @@
+import json
+import re
+
+import pytest
+
+from src import ai_processing
+from src.storage import FALLBACK_MODEL
+
+EMAILS = [(f"e{i}", f"Can we meet about item {i}?") for i in range(8)]
+
+
+def _result(key, priority=5):
+    return {'id': key, 'category': 'meeting', 'priority': priority, 'requires_action': True,
+            'action_type': 'schedule', 'key_topics': ['meeting']}
+
+
+class FakeLLM:
+    """Stands in for _complete; answer(keys) gives the batch reply for the prompt's item keys"""
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.calls = []
+
+    def __call__(self, prompt, temperature, validate=None, **params):
+        keys = re.findall(r'\[id: (\w+)\]', prompt)
+        self.calls.append(keys)
+        if not keys:
+            # A single email goes through analyze_email's own prompt
+            return json.dumps(_result('single'))
+        return self.answer(keys)
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    def install(answer):
+        fake = FakeLLM(answer)
+        monkeypatch.setattr(ai_processing, '_complete', fake)
+        return fake
+    return install
+
+
+def test_whole_batch_in_one_call(llm):
+    fake = llm(lambda keys: json.dumps({'results': [_result(k) for k in keys]}))
+
+    results = ai_processing.analyze_emails_batch(EMAILS)
+
+    assert set(results) == {email_id for email_id, _ in EMAILS}
+    assert len(fake.calls) == 1
+
+
+def test_invalid_items_are_split_and_retried(llm):
+    # Only the odd-numbered items in each reply come back valid
+    fake = llm(lambda keys: json.dumps({'results': [
+        _result(k) if i % 2 else _result(k, priority=99) for i, k in enumerate(keys)
+    ]}))
+
+    results = ai_processing.analyze_emails_batch(EMAILS)
+
+    assert set(results) == {email_id for email_id, _ in EMAILS}
+    assert len(fake.calls) > 1
+    # Retries only ever ask about items that have not been answered yet
+    assert sum(len(keys) for keys in fake.calls[1:]) < len(EMAILS) * 2
+
+
+def test_transport_error_is_not_split(llm):
+    def down(keys):
+        raise ConnectionError("network down")
+    fake = llm(down)
+
+    results = ai_processing.analyze_emails_batch(EMAILS)
+
+    assert results == {}
+    assert len(fake.calls) == 1
+
+
+def test_unparseable_reply_is_not_split(llm):
+    fake = llm(lambda keys: '{"results": [')
+
+    assert ai_processing.analyze_emails_batch(EMAILS) == {}
+    assert len(fake.calls) == 1
+
+
+def test_stops_at_the_first_failed_batch(llm, monkeypatch):
+    monkeypatch.setattr(ai_processing, 'BATCH_MAX_ITEMS', 4)
+    replies = iter([json.dumps({'results': [_result(str(i)) for i in range(1, 5)]})])
+
+    def answer(keys):
+        reply = next(replies, None)
+        if reply is None:
+            raise ConnectionError("network down")
+        return reply
+    fake = llm(answer)
+
+    results = ai_processing.analyze_emails_batch(EMAILS)
+
+    # The first batch of four is kept; the rest stays unanalyzed for the next fetch
+    assert set(results) == {'e0', 'e1', 'e2', 'e3'}
+    assert len(fake.calls) == 2
+
+
+def test_single_email_failure_falls_back_to_keywords(monkeypatch):
+    def down(prompt, temperature, **params):
+        raise ConnectionError("network down")
+    monkeypatch.setattr(ai_processing, '_complete', down)
+
+    analysis = ai_processing.analyze_email("URGENT: please reply today")
+
+    assert analysis['model'] == FALLBACK_MODEL
+    assert 1 <= analysis['priority'] <= 10
@@ -0,0 +1,102 @@
+import base64
+
+from src.mime_parser import extract_body, html_to_text, iter_parts, list_attachments
+
+
+def b64(text, charset='utf-8'):
+    return base64.urlsafe_b64encode(text.encode(charset)).decode().rstrip('=')
+
+
+def part(part_id, mime_type, text='', filename='', charset=None, **body):
+    headers = []
+    if charset:
+        headers.append({'name': 'Content-Type', 'value': f'{mime_type}; charset="{charset}"'})
+    if text:
+        body['data'] = b64(text, charset or 'utf-8')
+    return {'partId': part_id, 'mimeType': mime_type, 'filename': filename,
+            'headers': headers, 'body': body}
+
+
+def multipart(part_id, mime_type, *parts):
+    return {'partId': part_id, 'mimeType': mime_type, 'parts': list(parts)}
+
+
+def test_iter_parts_is_depth_first():
+    payload = multipart('', 'multipart/mixed',
+                        multipart('0', 'multipart/alternative',
+                                  part('0.0', 'text/plain', 'a'),
+                                  part('0.1', 'text/html', '<p>a</p>')),
+                        part('1', 'application/pdf', filename='a.pdf', attachmentId='x'))
+
+    assert [p['partId'] for p in iter_parts(payload)] == ['0.0', '0.1', '1']
+
+
+def test_single_part_payload_is_its_own_leaf():
+    payload = part('', 'text/plain', 'Hello')
+    assert list(iter_parts(payload)) == [payload]
+    assert extract_body(payload) == 'Hello'
+
+
+def test_prefers_nested_plain_text_over_html():
+    payload = multipart('', 'multipart/mixed',
+                        multipart('0', 'multipart/related',
+                                  part('0.0', 'text/html', '<p>html body</p>'),
+                                  multipart('0.1', 'multipart/alternative',
+                                            part('0.1.0', 'text/plain', 'plain body'))))
+
+    assert extract_body(payload) == 'plain body'
+
+
+def test_falls_back_to_html_without_plain_text():
+    payload = multipart('', 'multipart/alternative',
+                        part('0', 'text/plain', '   '),
+                        part('1', 'text/html',
+                             '<html><head><title>t</title><style>p {}</style></head>'
+                             '<body><p>Hello</p><script>x()</script><p>World &amp; all</p></body></html>'))
+
+    assert extract_body(payload) == 'Hello\nWorld & all'
+
+
+def test_attachments_are_skipped_and_listed():
+    payload = multipart('', 'multipart/mixed',
+                        part('0', 'text/plain', 'attached notes', filename='notes.txt'),
+                        part('1', 'text/plain', 'the body'),
+                        part('2', 'application/pdf', filename='report.pdf', attachmentId='att-1', size=2048))
+
+    assert extract_body(payload) == 'the body'
+    assert [(a['part_id'], a['filename'], a['attachment_id']) for a in list_attachments(payload)] == [
+        ('0', 'notes.txt', None), ('2', 'report.pdf', 'att-1')]
+    assert list_attachments(payload)[0]['data'] == b64('attached notes')
+
+
+def test_inline_disposition_without_filename_is_an_attachment():
+    payload = multipart('', 'multipart/mixed',
+                        part('0', 'text/plain', 'the body'),
+                        part('1', 'text/plain', 'forwarded'))
+    payload['parts'][1]['headers'].append({'name': 'Content-Disposition', 'value': 'attachment'})
+
+    assert [a['filename'] for a in list_attachments(payload)] == ['part-1']
+
+
+def test_decodes_declared_charset():
+    payload = part('', 'text/plain', 'Grüße aus Köln', charset='iso-8859-1')
+    assert extract_body(payload) == 'Grüße aus Köln'
+
+
+def test_unknown_charset_falls_back_to_utf8():
+    payload = part('', 'text/plain', 'café')
+    payload['headers'] = [{'name': 'Content-Type', 'value': 'text/plain; charset=x-unknown'}]
+    assert extract_body(payload) == 'café'
+
+
+def test_body_is_capped():
+    assert extract_body(part('', 'text/plain', 'x' * 5000), max_chars=100) == 'x' * 100
+    html = '<p>' + 'y' * 5000 + '</p>'
+    assert extract_body(part('', 'text/html', html), max_chars=100) == 'y' * 100
+    assert len(html_to_text('<p>word</p>' * 100_000, max_chars=50)) == 50
+
+
+def test_no_text_parts():
+    payload = multipart('', 'multipart/mixed',
+                        part('0', 'image/png', filename='a.png', attachmentId='x'))
+    assert extract_body(payload) == ''
@@ -0,0 +1,80 @@
+import pytest
+
+from src import outbox
+from src.outbox import enqueue, get_outbox_entry
+from src.storage import get_connection
+
+
+def _fail(entry_id):
+    with get_connection() as conn:
+        conn.execute("UPDATE outbox SET status = 'failed', attempts = 3, last_error = 'boom' WHERE id = ?",
+                     (entry_id,))
+
+
+def test_same_key_returns_the_first_entry(db):
+    first, created = enqueue('m1', 'Client <client@example.com>', 'Re: hi', 'Thanks', idempotency_key='k1')
+    again, created_again = enqueue('m1', 'client@example.com', 'Re: hi', 'Other text', idempotency_key='k1')
+
+    assert created and not created_again
+    assert again['id'] == first['id']
+    assert again['body'] == 'Thanks'
+
+
+def test_default_key_deduplicates_identical_messages(db):
+    first, _ = enqueue('m1', 'client@example.com', 'Re: hi', 'Thanks')
+    again, created = enqueue('m1', 'CLIENT@example.com', 'Re: hi', 'Thanks')
+    other, other_created = enqueue('m1', 'client@example.com', 'Re: hi', 'Thanks again')
+
+    assert not created and again['id'] == first['id']
+    assert other_created and other['id'] != first['id']
+
+
+def test_failed_entry_is_requeued_by_a_retry(db):
+    entry, _ = enqueue('m1', 'client@example.com', 'Re: hi', 'Thanks', idempotency_key='k1')
+    _fail(entry['id'])
+
+    retried, created = enqueue('m1', 'client@example.com', 'Re: hi', 'Thanks', idempotency_key='k1')
+
+    assert created
+    assert retried['id'] == entry['id']
+    assert retried['status'] == 'queued' and retried['attempts'] == 0
+    # Kept so the sender checks Gmail before sending again
+    assert retried['last_error'] == 'boom'
+
+
+def test_dedup_window_skips_a_second_message_to_the_same_recipient(db):
+    first, _ = enqueue('m1', 'client@example.com', 'Away', 'Out of office', kind='auto-reply', dedup_window=3600)
+    second, created = enqueue('m2', 'client@example.com', 'Away', 'Out of office', kind='auto-reply',
+                              dedup_window=3600)
+
+    assert not created and second['id'] == first['id']
+
+
+def test_dedup_window_ignores_failed_messages(db):
+    first, _ = enqueue('m1', 'client@example.com', 'Away', 'Out of office', kind='auto-reply', dedup_window=3600)
+    _fail(first['id'])
+    second, created = enqueue('m2', 'client@example.com', 'Away', 'Out of office', kind='auto-reply',
+                              dedup_window=3600)
+
+    assert created and second['id'] != first['id']
+
+
+def test_missing_recipient_is_rejected(db):
+    with pytest.raises(ValueError):
+        enqueue('m1', '', 'Re: hi', 'Thanks')
+
+
+def test_requeued_message_is_not_sent_twice(db, monkeypatch):
+    sent = []
+    monkeypatch.setattr(outbox, 'find_sent_message', lambda header: 'gmail-1')
+    monkeypatch.setattr(outbox, 'send_message', lambda raw: sent.append(raw) or 'gmail-2')
+    monkeypatch.setattr(outbox, 'mark_replied', lambda email_id: None)
+
+    entry, _ = enqueue('m1', 'client@example.com', 'Re: hi', 'Thanks', idempotency_key='k1')
+    _fail(entry['id'])
+    enqueue('m1', 'client@example.com', 'Re: hi', 'Thanks', idempotency_key='k1')
+    outbox.send_due()
+
+    # The earlier attempt had reached Gmail, so it is recorded instead of sent again
+    assert sent == []
+    assert get_outbox_entry(entry['id'])['gmail_message_id'] == 'gmail-1'
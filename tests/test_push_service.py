@@ -0,0 +1,74 @@
+import base64
+import json
+
+import pytest
+
+from src import push_service, storage
+from src.sync_service import HISTORY_ID_KEY
+
+MAILBOX = 'bot@example.com'
+
+
+def envelope(payload):
+    data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+    return {'message': {'data': base64.b64encode(data).decode(), 'messageId': '1'}}
+
+
+def notification(history_id, email_address=MAILBOX):
+    return envelope({'emailAddress': email_address, 'historyId': history_id})
+
+
+@pytest.fixture(autouse=True)
+def mailbox(db, monkeypatch):
+    monkeypatch.setattr(push_service, 'BOT_EMAIL', MAILBOX)
+
+
+def test_parse_notification():
+    assert push_service.parse_notification(notification(1234)) == (MAILBOX, 1234)
+    # Gmail sends historyId as a number, but a string must parse the same
+    assert push_service.parse_notification(notification('1234')) == (MAILBOX, 1234)
+
+
+@pytest.mark.parametrize('bad', [
+    {},
+    {'message': {}},
+    {'message': {'data': 'not base64!'}},
+    envelope(b'not json'),
+    envelope({'emailAddress': MAILBOX}),
+    envelope({'emailAddress': MAILBOX, 'historyId': 'abc'}),
+    envelope(['a list']),
+])
+def test_parse_notification_rejects_malformed(bad):
+    with pytest.raises(ValueError):
+        push_service.parse_notification(bad)
+
+
+def test_new_history_triggers_a_sync():
+    storage.set_setting(HISTORY_ID_KEY, '100')
+    assert push_service.handle_notification(notification(101))
+
+
+def test_first_notification_triggers_a_sync():
+    assert push_service.handle_notification(notification(1))
+
+
+@pytest.mark.parametrize('history_id', [99, 100])
+def test_stale_notification_is_skipped(history_id):
+    storage.set_setting(HISTORY_ID_KEY, '100')
+    before = push_service.push_stats.snapshot()['stale']
+
+    assert not push_service.handle_notification(notification(history_id))
+    assert push_service.push_stats.snapshot()['stale'] == before + 1
+
+
+def test_other_mailbox_is_ignored():
+    assert not push_service.handle_notification(notification(101, 'someone@example.com'))
+    # Addresses compare case-insensitively
+    assert push_service.handle_notification(notification(101, MAILBOX.upper()))
+
+
+def test_malformed_notification_is_not_a_sync():
+    before = push_service.push_stats.snapshot()['invalid']
+
+    assert not push_service.handle_notification({'message': {'data': 'garbage'}})
+    assert push_service.push_stats.snapshot()['invalid'] == before + 1
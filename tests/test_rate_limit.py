@@ -0,0 +1,73 @@
+import pytest
+
+from src import rate_limit
+from src.rate_limit import LLMRateLimiter, TokenBucket, backoff_delay
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(rate_limit.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_no_wait_while_tokens_last(clock):
+    bucket = TokenBucket(rate=1, capacity=3)
+    assert [bucket.reserve(1) for _ in range(3)] == [0, 0, 0]
+
+
+def test_wait_covers_the_deficit(clock):
+    bucket = TokenBucket(rate=2, capacity=4)
+    assert bucket.reserve(4) == 0
+    assert bucket.reserve(1) == pytest.approx(0.5)
+    # Reservations queue up behind the debt already taken on
+    assert bucket.reserve(3) == pytest.approx(2.0)
+
+
+def test_refills_over_time(clock):
+    bucket = TokenBucket(rate=2, capacity=4)
+    bucket.reserve(4)
+    clock.now += 1
+    assert bucket.reserve(2) == 0
+    assert bucket.reserve(1) == pytest.approx(0.5)
+
+
+def test_refill_stops_at_capacity(clock):
+    bucket = TokenBucket(rate=10, capacity=5)
+    clock.now += 60
+    assert bucket.reserve(5) == 0
+    assert bucket.reserve(1) == pytest.approx(0.1)
+
+
+def test_oversized_request_is_clamped_to_capacity(clock):
+    bucket = TokenBucket(rate=1, capacity=10)
+    # More than the bucket can ever hold would otherwise never be allowed through
+    assert bucket.reserve(50) == 0
+    assert bucket.reserve(1) == pytest.approx(1.0)
+
+
+def test_limiter_waits_for_the_tighter_limit(clock):
+    limiter = LLMRateLimiter(rpm=60, tpm=600)
+    limiter.acquire(600)
+    assert clock.slept == []
+    limiter.acquire(100)
+    # The request limit has room to spare, but 100 more tokens take 10s to refill
+    assert clock.slept == [pytest.approx(10.0)]
+
+
+def test_backoff_delay_is_capped():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, base=1.0, cap=8.0) <= min(8.0, 2 ** attempt)
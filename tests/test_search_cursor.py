@@ -0,0 +1,64 @@
+import base64
+
+import pytest
+
+from src import storage
+from src.storage import InvalidCursor, _decode_cursor, _encode_cursor
+from tests.conftest import email_row
+
+
+def test_cursor_round_trip():
+    assert _decode_cursor(_encode_cursor(-1.25, 42, 7, 1), 4) == [-1.25, 42, 7, 1]
+
+
+@pytest.mark.parametrize('cursor', [
+    'zzz',                                             # Not base64
+    '!!!',
+    base64.urlsafe_b64encode(b'not json').decode(),
+    base64.urlsafe_b64encode(b'{"a": 1}').decode(),    # Not a list
+    _encode_cursor(1, 2),                              # Wrong length
+    _encode_cursor(1, 'x', 3, 0),                      # Not numbers
+    _encode_cursor(1, True, 3, 0),
+])
+def test_malformed_cursor_raises(cursor):
+    with pytest.raises(InvalidCursor):
+        _decode_cursor(cursor, 4)
+
+
+def test_invalid_cursor_is_a_value_error():
+    assert issubclass(InvalidCursor, ValueError)
+
+
+def test_list_emails_rejects_bad_cursor(db):
+    with pytest.raises(InvalidCursor):
+        storage.list_emails(10, 'zzz')
+
+
+def test_search_pages_past_the_rank_window(db, monkeypatch):
+    monkeypatch.setattr(storage, 'SEARCH_RANK_WINDOW', 3)
+    # m0 is the oldest email and by far the best match
+    storage.store_emails_bulk([
+        email_row(f"m{i}", body='invoice ' * (10 if i == 0 else 1) + f"filler {i}",
+                  timestamp=f"2026-10-{i + 1:02d}T09:00:00")
+        for i in range(10)
+    ])
+
+    seen, cursor = [], None
+    while True:
+        rows, cursor = storage.search_emails('invoice', 4, cursor)
+        seen.extend(row['message_id'] for row in rows)
+        if cursor is None:
+            break
+
+    assert sorted(seen) == sorted(f"m{i}" for i in range(10))
+    # The three newest are ranked first; the older matches follow, best first
+    assert set(seen[:3]) == {'m7', 'm8', 'm9'}
+    assert seen[3] == 'm0'
+
+
+def test_search_api_answers_400_for_bad_cursor(db):
+    import app as web
+
+    client = web.app.test_client()
+    assert client.get('/api/search?q=invoice&cursor=zzz').status_code == 400
+    assert client.get('/api/emails/page?cursor=zzz').status_code == 400